@@ -1,7 +1,9 @@
 import os
 import json
-from openai import AzureOpenAI
+import threading
 from dotenv import load_dotenv
+from .metrics import ChatMetrics
+from .upstream import UpstreamPool
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,12 +14,9 @@ class ChatService:
         self.deployment = os.getenv("DEPLOYMENT_NAME", "")
         self.subscription_key = os.getenv("AZURE_OPENAI_API_KEY", "")
         
-        # Initialize Azure OpenAI client
-        self.client = AzureOpenAI(
-            azure_endpoint=self.endpoint,
-            api_key=self.subscription_key,
-            api_version="2025-01-01-preview",
-        )
+        # Azure OpenAI client, created on first use (see the client property)
+        self._client = None
+        self._client_lock = threading.Lock()
         
         # System message that stays constant
         self.system_message = {
@@ -29,6 +28,46 @@ class ChatService:
                 }
             ]
         }
+        
+        # Latency and throughput metrics for streamed responses (served at /metrics)
+        self.metrics = ChatMetrics()
+        
+        # One tuned connection pool shared by all upstream requests; when no request
+        # was made for UPSTREAM_PING_INTERVAL_SECONDS, a cheap ping keeps a connection open
+        self.upstream = UpstreamPool(
+            self.metrics,
+            max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100")),
+            max_keepalive=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("UPSTREAM_KEEPALIVE_SECONDS", "120")),
+        )
+        self.ping_interval = float(os.getenv("UPSTREAM_PING_INTERVAL_SECONDS", "0"))
+        self._keep_warm = None
+        self._stopping = threading.Event()
+    
+    @property
+    def client(self):
+        """
+        Azure OpenAI client, created on first use so that importing the app
+        (and a worker's cold start) does not pay for importing openai
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self.create_client()
+        return self._client
+    
+    def create_client(self):
+        """
+        Create the Azure OpenAI client used for chat completions
+        """
+        from openai import AzureOpenAI
+        
+        return AzureOpenAI(
+            azure_endpoint=self.endpoint,
+            api_key=self.subscription_key,
+            api_version="2025-01-01-preview",
+            http_client=self.upstream.http_client(),
+        )
     
     def create_chat_prompt(self, conversation_history):
         """
@@ -40,8 +79,11 @@ class ChatService:
     
     def stream_chat_response(self, conversation_history):
         """
-        Stream chat response from Azure OpenAI
+        Stream chat response from Azure OpenAI.
+        Closing the generator early closes the upstream stream, so generation stops.
         """
+        stream = self.metrics.stream()
+        response = None
         try:
             messages = self.create_chat_prompt(conversation_history)
             
@@ -60,10 +102,17 @@ class ChatService:
             for update in response:
                 if update.choices and update.choices[0].delta.content:
                     content = update.choices[0].delta.content
+                    stream.chunk(content)
                     yield content
+            stream.complete()
                     
         except Exception as e:
+            stream.fail()
             yield f"Error: {str(e)}"
+        finally:
+            stream.finish()
+            if response is not None:
+                response.close()
     
     def format_user_message(self, user_input):
         """
@@ -93,7 +142,44 @@ class ChatService:
             ]
         }
     
+    def warm_up(self):
+        """
+        Create the client and open a pooled connection to the endpoint,
+        so the first chat request does not pay for them
+        """
+        self.ping()
+    
+    def ping(self):
+        """
+        Cheap request (list models, no tokens used) that opens or refreshes a pooled connection
+        """
+        try:
+            self.client.with_options(max_retries=0, timeout=10).models.list()
+        except Exception:
+            # Any response, even an error status, leaves a connection in the pool
+            pass
+    
+    def start_keep_warm(self):
+        """
+        Ping the endpoint in the background whenever no upstream request was made
+        for UPSTREAM_PING_INTERVAL_SECONDS (no-op when the interval is 0)
+        """
+        if not self.ping_interval or self._keep_warm is not None:
+            return
+        self._keep_warm = threading.Thread(target=self._keep_warm_loop, name='upstream-keep-warm', daemon=True)
+        self._keep_warm.start()
+    
+    def _keep_warm_loop(self):
+        while True:
+            wait = self.ping_interval - self.upstream.idle_seconds()
+            if wait <= 0:
+                self.ping()
+                wait = self.ping_interval
+            if self._stopping.wait(wait):
+                return
+    
     def close(self):
-        """Close the OpenAI client"""
-        if hasattr(self.client, 'close'):
-            self.client.close()
+        """Stop the keep-warm pings and close the OpenAI client (if it was created)"""
+        self._stopping.set()
+        if self._client is not None:
+            self._client.close()
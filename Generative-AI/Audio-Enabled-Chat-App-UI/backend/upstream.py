@@ -0,0 +1,122 @@
+import time
+import threading
+
+
+class _ConnectionTrace:
+    """
+    httpcore trace callback for one request: notes whether the request had to
+    open a new connection and how long DNS, TCP and TLS setup took
+    """
+
+    __slots__ = ('connect_started', 'connected_at')
+
+    def __init__(self):
+        self.connect_started = None
+        self.connected_at = None
+
+    def __call__(self, name, info):
+        if name == 'connection.connect_tcp.started':
+            self.connect_started = time.monotonic()
+        elif name in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+            self.connected_at = time.monotonic()
+
+
+class _AsyncConnectionTrace(_ConnectionTrace):
+    """The async client awaits its trace callback"""
+
+    __slots__ = ()
+
+    async def __call__(self, name, info):
+        _ConnectionTrace.__call__(self, name, info)
+
+
+class UpstreamPool:
+    """
+    Settings and instrumentation for the HTTP connection pool of the Azure
+    OpenAI client. The service keeps one client, so every upstream request in
+    the process shares this pool. Idle connections are kept for
+    keepalive_expiry seconds (the openai default is 5), and each request is
+    counted as reusing a pooled connection or opening a new one.
+    """
+
+    CONNECT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self, metrics, max_connections=100, max_keepalive=20, keepalive_expiry=120):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+
+        self._counts = {'reused': 0, 'new': 0}
+        self._last_request_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.requests = metrics.registry.counter(
+            'chat_upstream_requests_total', 'Requests to Azure OpenAI by connection (reused from the pool or new)',
+            ('connection',),
+        )
+        self.connect_seconds = metrics.registry.histogram(
+            'chat_upstream_connect_seconds', 'Time to open a new connection to Azure OpenAI (DNS, TCP and TLS)',
+            self.CONNECT_BUCKETS,
+        )
+
+    def limits(self):
+        import httpx
+
+        return httpx.Limits(
+            max_connections=self.max_connections or None,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def http_client(self):
+        """httpx client for AzureOpenAI(http_client=...)"""
+        from openai import DefaultHttpxClient
+
+        def on_request(request):
+            request.extensions['trace'] = _ConnectionTrace()
+
+        def on_response(response):
+            self._record(response.request)
+
+        return DefaultHttpxClient(limits=self.limits(), event_hooks={'request': [on_request], 'response': [on_response]})
+
+    def async_http_client(self):
+        """httpx client for AsyncAzureOpenAI(http_client=...)"""
+        from openai import DefaultAsyncHttpxClient
+
+        async def on_request(request):
+            request.extensions['trace'] = _AsyncConnectionTrace()
+
+        async def on_response(response):
+            self._record(response.request)
+
+        return DefaultAsyncHttpxClient(limits=self.limits(), event_hooks={'request': [on_request], 'response': [on_response]})
+
+    def _record(self, request):
+        trace = request.extensions.get('trace')
+        connection = 'new' if trace is not None and trace.connect_started is not None else 'reused'
+        with self._lock:
+            self._counts[connection] += 1
+            self._last_request_at = time.monotonic()
+        self.requests.inc(connection=connection)
+        if connection == 'new' and trace.connected_at is not None:
+            self.connect_seconds.observe(trace.connected_at - trace.connect_started)
+
+    def idle_seconds(self):
+        """Seconds since the last upstream response (or since startup)"""
+        with self._lock:
+            return time.monotonic() - self._last_request_at
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = counts['reused'] + counts['new']
+        return {
+            'max_connections': self.max_connections,
+            'max_keepalive': self.max_keepalive,
+            'keepalive_expiry_seconds': self.keepalive_expiry,
+            'requests': total,
+            'reused_connections': counts['reused'],
+            'new_connections': counts['new'],
+            'reuse_ratio': round(counts['reused'] / total, 4) if total else None,
+        }
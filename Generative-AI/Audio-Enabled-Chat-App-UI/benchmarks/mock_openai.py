@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Mock Azure OpenAI chat completions server for offline load tests
+
+Serves POST /openai/deployments/<deployment>/chat/completions like Azure
+OpenAI, streaming synthetic tokens with a configurable time to first token,
+token rate, error rate and 429 (rate limit) injection. Non-streaming calls
+(e.g. history summaries) get a complete JSON response. POST
+/openai/deployments/<deployment>/embeddings returns a deterministic
+pseudo-random unit vector per input text. Uses only the standard library.
+
+Usage:
+    python benchmarks/mock_openai.py --port 8100 --ttft-ms 300 --token-rate 50
+
+Then point the app at it:
+    ENDPOINT_URL=http://127.0.0.1:8100 AZURE_OPENAI_API_KEY=mock DEPLOYMENT_NAME=mock python app.py
+"""
+
+import json
+import time
+import math
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "Paris is known for its museums, cafes and the Eiffel Tower. A three day trip "
+    "could include the Louvre, a Seine river cruise and a walk through Montmartre. "
+    "Book trains early, carry a travel card and check opening hours before you go."
+).split()
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'streams': 0, 'errors': 0, 'rate_limited': 0, 'disconnects': 0,
+                       'embedding_requests': 0, 'embedded_texts': 0}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+    stats = None
+
+    def log_message(self, format, *args):
+        if self.config.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self.send_json(200, self.stats.snapshot())
+        else:
+            self.send_json(404, {'error': {'code': 'NotFound', 'message': 'Not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if '/embeddings' in self.path:
+            self.embeddings(body)
+            return
+        if '/chat/completions' not in self.path:
+            self.send_json(404, {'error': {'code': 'NotFound', 'message': 'Not found'}})
+            return
+        self.stats.count('requests')
+
+        roll = random.random()
+        if roll < self.config.rate_limit_rate:
+            self.stats.count('rate_limited')
+            self.send_json(429, {'error': {'code': '429', 'message': 'Rate limit is exceeded. Try again later.'}},
+                           {'Retry-After': str(self.config.retry_after)})
+            return
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self.stats.count('errors')
+            self.send_json(500, {'error': {'code': 'InternalServerError', 'message': 'Injected server error'}})
+            return
+
+        tokens = self.response_tokens(body)
+        if body.get('stream'):
+            self.stream(tokens)
+        else:
+            time.sleep(self.delay(self.config.ttft_ms))
+            self.send_json(200, {
+                'id': 'chatcmpl-mock',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': 'mock',
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': ''.join(tokens)}}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(tokens), 'total_tokens': len(tokens)},
+            })
+
+    def embeddings(self, body):
+        texts = body.get('input') or []
+        if isinstance(texts, str):
+            texts = [texts]
+        dimensions = body.get('dimensions') or self.config.embedding_dimensions
+        self.stats.count('embedding_requests')
+        self.stats.count('embedded_texts', len(texts))
+        time.sleep(self.delay(self.config.embedding_ms))
+        self.send_json(200, {
+            'object': 'list',
+            'model': 'mock',
+            'data': [{'object': 'embedding', 'index': index, 'embedding': self.embedding(text, dimensions)}
+                     for index, text in enumerate(texts)],
+            'usage': {'prompt_tokens': 0, 'total_tokens': 0},
+        })
+
+    def embedding(self, text, dimensions):
+        """Unit vector seeded by the text, so the same text always gets the same vector"""
+        generator = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+        vector = [generator.gauss(0, 1) for _ in range(dimensions)]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def response_tokens(self, body):
+        count = self.config.tokens
+        if body.get('max_tokens'):
+            count = min(count, body['max_tokens'])
+        return [WORDS[index % len(WORDS)] + ' ' for index in range(count)]
+
+    def delay(self, milliseconds):
+        """Delay in seconds with +/- jitter"""
+        jitter = self.config.jitter
+        return max(0.0, milliseconds / 1000 * random.uniform(1 - jitter, 1 + jitter))
+
+    def stream(self, tokens):
+        self.stats.count('streams')
+        # Chunked transfer encoding keeps the connection reusable, like the real service
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        created = int(time.time())
+
+        def chunk(delta, finish_reason=None):
+            return {
+                'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'created': created, 'model': 'mock',
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }
+
+        try:
+            # Azure sends content filter results in a first chunk without choices
+            self.send_event({'id': '', 'object': '', 'created': 0, 'model': '', 'choices': [],
+                             'prompt_filter_results': []})
+            time.sleep(self.delay(self.config.ttft_ms))
+            self.send_event(chunk({'role': 'assistant', 'content': ''}))
+            interval = 1000 / self.config.token_rate if self.config.token_rate else 0
+            for token in tokens:
+                self.send_event(chunk({'content': token}))
+                if interval:
+                    time.sleep(self.delay(interval))
+            self.send_event(chunk({}, 'stop'))
+            self.send_chunk(b'data: [DONE]\n\n')
+            self.send_chunk(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            # The app closed the stream early (cancelled or disconnected client)
+            self.stats.count('disconnects')
+            self.close_connection = True
+
+    def send_event(self, payload):
+        self.send_chunk(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+
+    def send_chunk(self, data):
+        """Write one chunk of a chunked response (an empty chunk ends the response)"""
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--ttft-ms', type=float, default=300, help='time to first token')
+    parser.add_argument('--token-rate', type=float, default=50, help='tokens per second after the first (0 = no delay)')
+    parser.add_argument('--tokens', type=int, default=200, help='tokens per response (capped by max_tokens)')
+    parser.add_argument('--jitter', type=float, default=0.2, help='relative +/- jitter applied to every delay')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429 responses')
+    parser.add_argument('--embedding-ms', type=float, default=50, help='latency of an embeddings request')
+    parser.add_argument('--embedding-dimensions', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    MockHandler.config = args
+    MockHandler.stats = MockStats()
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    print(f"Mock Azure OpenAI listening on http://{args.host}:{args.port} (request counts at /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
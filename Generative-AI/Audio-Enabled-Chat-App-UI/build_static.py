@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Build fingerprinted, precompressed static assets
+
+Copies every file in frontend/static/ to frontend/dist/ under a content-hashed
+name (style.css -> style.<hash>.css), with gzip and (if the brotli package is
+installed) brotli variants, and writes frontend/dist/manifest.json. The app
+serves these from /assets/ with long-lived immutable caching.
+
+Run it after changing anything in frontend/static/ (run.py does this
+automatically), then restart the app.
+"""
+
+import os
+import sys
+
+from backend.static_assets import build
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(APP_DIR, 'frontend', 'static')
+OUTPUT_DIR = os.path.join(APP_DIR, 'frontend', 'dist')
+
+
+def main():
+    manifest = build(SOURCE_DIR, OUTPUT_DIR)
+    for name, hashed in sorted(manifest.items()):
+        variants = [suffix for suffix in ('.gz', '.br') if os.path.exists(os.path.join(OUTPUT_DIR, hashed + suffix))]
+        print(f"{name} -> {hashed} {' '.join(variants)}".rstrip())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
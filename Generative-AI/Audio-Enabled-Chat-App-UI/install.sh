@@ -7,6 +7,11 @@ echo ""
 echo "📦 Installing Python packages..."
 pip install -r requirements.txt --user
 
+# Build fingerprinted, precompressed static assets
+echo ""
+echo "🗜️  Building static assets..."
+python build_static.py
+
 echo ""
 echo "✅ Installation complete!"
 echo ""
@@ -0,0 +1,563 @@
+"""
+Async (ASGI) serving mode for the AI Chat Application
+
+Serves the same routes and SSE payloads as app.py, but streams responses
+from async generators backed by AsyncAzureOpenAI, so one worker process can
+hold many concurrent token streams.
+
+Also serves /ws/chat, a WebSocket transport that carries many chat turns,
+cancellation and keepalives over one connection.
+
+Run with:
+    uvicorn asgi_app:app --host 127.0.0.1 --port 5000
+"""
+
+from quart import Quart, render_template, request, jsonify, Response, session, websocket
+from quart_cors import cors, cors_exempt
+import os
+import json
+import time
+import asyncio
+import uuid
+from urllib.parse import urlsplit
+from backend.chat_service import AsyncChatService
+from backend.session_store import create_session_store
+from backend.static_assets import StaticAssets
+from backend.sse import coalesce_async, frame_data, parse_event_id
+from backend.admission import AdmissionRejected, AsyncConcurrencyLimiter, TokenBucketLimiter
+from backend.drain import Drain, drain_on_signal
+from backend.stream_registry import AsyncEventBuffer, StreamRegistry, follow_async, request_key, until_cancelled_async
+
+app = Quart(__name__,
+            template_folder='frontend/templates',
+            static_folder='frontend/static')
+app = cors(app, allow_origin='*')
+
+# Secret key for session management
+# (set SECRET_KEY when running several workers so they all accept the same session cookie)
+app.secret_key = os.getenv("SECRET_KEY") or os.urandom(24)
+
+# Initialize async chat service (the Azure OpenAI client is created on first use;
+# PREWARM=true creates it and opens a connection in the background at startup)
+chat_service = AsyncChatService()
+prewarm = os.getenv("PREWARM", "false").lower() == "true"
+
+# Store conversation histories (bounded by SESSION_* environment variables)
+session_store = create_session_store()
+
+# Streamed tokens are coalesced into SSE frames: the first token is sent at once,
+# then a frame is flushed every SSE_FLUSH_INTERVAL_MS or SSE_FLUSH_BYTES, whichever comes first
+sse_flush_interval_ms = int(os.getenv("SSE_FLUSH_INTERVAL_MS", "50"))
+sse_flush_bytes = int(os.getenv("SSE_FLUSH_BYTES", "256"))
+
+# In-flight generations, so a session's stream can be cancelled or resumed.
+# Each keeps its last STREAM_BUFFER_EVENTS events; a client that reconnects with
+# Last-Event-ID resumes from there, up to STREAM_RESUME_TTL_SECONDS after the
+# answer finished. With no client connected, generation stops after STREAM_RESUME_GRACE_SECONDS
+# (an explicit /api/chat/cancel, also sent by the frontend on pagehide, stops it at once).
+# A session's messages are answered one at a time, in order.
+active_streams = StreamRegistry(
+    buffer_factory=AsyncEventBuffer,
+    event_factory=asyncio.Event,
+    max_events=int(os.getenv("STREAM_BUFFER_EVENTS", "1024")),
+    resume_ttl=float(os.getenv("STREAM_RESUME_TTL_SECONDS", "60")),
+    resume_grace=float(os.getenv("STREAM_RESUME_GRACE_SECONDS", "10")),
+)
+# Background generation tasks (referenced so they are not garbage collected)
+generation_tasks = set()
+
+# Admission control: a global limit on concurrent streams with a bounded wait queue,
+# and a per-session token bucket (0 disables either limit)
+chat_limiter = AsyncConcurrencyLimiter(
+    max_concurrent=int(os.getenv("CHAT_MAX_CONCURRENT_STREAMS", "256")),
+    max_queue=int(os.getenv("CHAT_MAX_QUEUE", "512")),
+    queue_timeout=float(os.getenv("CHAT_QUEUE_TIMEOUT_SECONDS", "30")),
+    wait_histogram=chat_service.metrics.queue_wait,
+)
+rate_limiter = TokenBucketLimiter(
+    rate_per_minute=float(os.getenv("CHAT_RATE_PER_MINUTE", "20")),
+    burst=int(os.getenv("CHAT_RATE_BURST", "5")),
+)
+
+# WebSocket transport: a keepalive message after WS_KEEPALIVE_SECONDS without traffic.
+# Browsers send the session cookie with cross-site WebSocket handshakes too, so
+# only same-origin pages and WS_ALLOWED_ORIGINS (comma-separated) may connect
+ws_keepalive_seconds = float(os.getenv("WS_KEEPALIVE_SECONDS", "15"))
+ws_allowed_origins = {origin.strip() for origin in os.getenv("WS_ALLOWED_ORIGINS", "").split(',') if origin.strip()}
+open_websockets = set()
+
+# Graceful shutdown: on SIGTERM new chat streams are refused with 503 while running
+# answers get DRAIN_TIMEOUT_SECONDS to finish; answers still running then are
+# stopped and keep what they have. Run uvicorn with a longer --timeout-graceful-shutdown
+drain = Drain(
+    timeout=float(os.getenv("DRAIN_TIMEOUT_SECONDS", "25")),
+    pending=active_streams.active_count,
+    stop=active_streams.cancel_all,
+)
+
+# Batch endpoint: prompts per request, and how many of them run at once
+batch_max_prompts = int(os.getenv("BATCH_MAX_PROMPTS", "100"))
+batch_max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+# Fingerprinted, precompressed static files written by build_static.py
+# (templates fall back to the plain /static/ files until it has been run)
+static_assets = StaticAssets(os.path.join(app.root_path, 'frontend', 'dist'))
+
+# Application gauges reported next to the stream metrics at /metrics
+chat_service.metrics.gauge('chat_sessions', 'Conversation sessions held by the session store',
+                           lambda: session_store.stats()['sessions'])
+chat_service.metrics.gauge('chat_queue_depth', 'Requests waiting for a free stream slot',
+                           lambda: chat_limiter.waiting)
+chat_service.metrics.gauge('chat_session_queued_turns', 'Messages waiting for an earlier message of their session',
+                           active_streams.queued_count)
+chat_service.metrics.gauge('chat_websocket_connections', 'Open /ws/chat connections',
+                           lambda: len(open_websockets))
+duplicate_requests = chat_service.metrics.registry.counter(
+    'chat_duplicate_requests_total', 'Chat requests joined to the answer already running for the same request ID',
+)
+
+@app.before_serving
+async def startup():
+    """Pre-warm the upstream connection and keep it warm in the background, without delaying readiness"""
+    # Drain first, then let the server's own SIGTERM handling stop accepting connections
+    drain_on_signal(drain)
+    if prewarm:
+        app.add_background_task(chat_service.warm_up)
+    chat_service.start_keep_warm()
+
+@app.after_serving
+async def shutdown():
+    """Let running generations finish (see drain), flush session state and close the upstream client"""
+    drain.begin()
+    await asyncio.to_thread(drain.wait)
+    for task in generation_tasks:
+        task.cancel()
+    await asyncio.gather(*generation_tasks, return_exceptions=True)
+    session_store.close()
+    await chat_service.close()
+
+@app.route('/')
+async def index():
+    """Serve the main chat interface"""
+    # Generate a unique session ID for the user
+    # (history is created lazily on the first message)
+    if 'session_id' not in session:
+        session['session_id'] = str(uuid.uuid4())
+
+    return await render_template('index.html')
+
+@app.context_processor
+async def inject_asset_url():
+    """Templates link static files with asset_url('style.css')"""
+    return {'asset_url': static_assets.url}
+
+@app.route('/assets/<path:filename>')
+async def assets(filename):
+    """
+    Fingerprinted static files: the brotli or gzip variant the client accepts,
+    cached by browsers for a year (the name changes whenever the content does)
+    """
+    asset = static_assets.get(filename, request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+    status, body, headers = asset
+    return Response(body, status=status, headers=headers)
+
+@app.route('/api/chat', methods=['POST'])
+async def chat():
+    """
+    Chat endpoint that streams responses from Azure OpenAI
+    """
+    try:
+        data = await request.get_json()
+        user_message = data.get('message', '').strip()
+        # Optional ID of this submission; a retry with the same ID joins its answer
+        key = request_key(data.get('request_id'))
+
+        if not user_message:
+            return jsonify({'error': 'Message cannot be empty'}), 400
+
+        # Get or create session
+        session_id = session.get('session_id')
+        if not session_id:
+            session_id = session['session_id'] = str(uuid.uuid4())
+
+        # A repeated submission (same request ID) of a message still being
+        # answered follows that answer instead of asking again
+        generation = active_streams.find(session_id, key)
+        if generation is not None:
+            duplicate_requests.inc()
+            return event_stream_response(follow_async(generation))
+
+        if drain.draining:
+            return draining_response()
+
+        # Fast rejections: per-session rate limit, then a full wait queue
+        try:
+            rate_limiter.acquire(session_id)
+            chat_limiter.check()
+        except AdmissionRejected as e:
+            return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+
+        # This response and any resumed ones follow the generation's event buffer;
+        # a queue timeout before it starts is a 429 with Retry-After
+        try:
+            generation = await start_generation(session_id, user_message, key)
+        except AdmissionRejected as e:
+            return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+        return event_stream_response(follow_async(generation))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.websocket('/ws/chat')
+@cors_exempt
+async def chat_socket():
+    """
+    WebSocket chat: many turns, cancellation and keepalives over one connection.
+    Client messages are JSON objects:
+        {"type": "chat", "message": "...", "request_id": "..."}
+                                            ask a question (one answer at a time per connection;
+                                            request_id is optional, as for /api/chat)
+        {"type": "cancel"}                  stop the current answer (the partial answer is kept in history)
+        {"type": "ping"}                    answered with {"type": "pong"}
+    Answers arrive as the same chunk, complete and error payloads /api/chat
+    streams, one per message. The server sends {"type": "keepalive"} after
+    WS_KEEPALIVE_SECONDS without traffic. Turns go to the session's history,
+    as with /api/chat; a handshake without a session cookie gets a history
+    that lasts as long as the connection.
+    """
+    origin = websocket.origin
+    if origin and origin not in ws_allowed_origins and urlsplit(origin).netloc != websocket.host:
+        return jsonify({'error': 'Origin not allowed'}), 403
+
+    session_id = session.get('session_id') or str(uuid.uuid4())
+    await websocket.accept()
+    connection = asyncio.current_task()
+    open_websockets.add(connection)
+
+    # The answer being forwarded and the receive loop both send messages
+    send_lock = asyncio.Lock()
+
+    async def send(message):
+        async with send_lock:
+            await websocket.send(message if isinstance(message, str) else json.dumps(message))
+
+    async def forward(generation):
+        async for frame in follow_async(generation, keepalive=ws_keepalive_seconds):
+            data = frame_data(frame)
+            await send(data if data is not None else {'type': 'keepalive'})
+
+    generation = None
+    forwarder = None
+    try:
+        while True:
+            try:
+                raw = await asyncio.wait_for(websocket.receive(), ws_keepalive_seconds)
+            except asyncio.TimeoutError:
+                # While an answer streams, the forwarder sends the keepalives
+                if forwarder is None or forwarder.done():
+                    await send({'type': 'keepalive'})
+                continue
+
+            try:
+                message = json.loads(raw)
+                kind = message.get('type')
+            except (TypeError, ValueError, AttributeError):
+                await send({'content': 'Error: Messages must be JSON objects', 'type': 'error'})
+                continue
+
+            if kind == 'ping':
+                await send({'type': 'pong'})
+            elif kind == 'cancel':
+                if generation is not None:
+                    generation.cancelled.set()
+            elif kind == 'chat':
+                user_message = message.get('message')
+                user_message = user_message.strip() if isinstance(user_message, str) else ''
+                if not user_message:
+                    await send({'content': 'Error: Message cannot be empty', 'type': 'error'})
+                    continue
+                if forwarder is not None and not forwarder.done():
+                    await send({'content': 'Error: Wait for the current answer or cancel it', 'type': 'error'})
+                    continue
+
+                # Same as /api/chat: a repeated submission follows the answer already
+                # running, otherwise per-session rate limit, then a full wait queue
+                key = request_key(message.get('request_id'))
+                generation = active_streams.find(session_id, key)
+                if generation is not None:
+                    duplicate_requests.inc()
+                elif drain.draining:
+                    await send({'content': 'Error: Server is restarting, please retry', 'type': 'error', 'retry_after': 1})
+                    continue
+                else:
+                    try:
+                        rate_limiter.acquire(session_id)
+                        chat_limiter.check()
+                    except AdmissionRejected as e:
+                        await send({'content': f'Error: {str(e)}', 'type': 'error', 'retry_after': e.retry_after})
+                        continue
+                    # Admitted in the background, so this loop keeps reading cancels and
+                    # pings; a queue timeout arrives as an error carrying retry_after
+                    generation = await start_generation(session_id, user_message, key, admit_first=False)
+                forwarder = asyncio.create_task(forward(generation))
+            else:
+                await send({'content': f'Error: Unknown message type {kind!r}', 'type': 'error'})
+    finally:
+        # Like a dropped SSE connection: the answer stops once nobody follows it
+        # for STREAM_RESUME_GRACE_SECONDS, and what was generated stays in history
+        open_websockets.discard(connection)
+        if forwarder is not None:
+            forwarder.cancel()
+
+@app.route('/api/chat/batch', methods=['POST'])
+async def chat_batch():
+    """
+    Answer many independent prompts (no conversation history) concurrently,
+    at most max_concurrency (capped by BATCH_MAX_CONCURRENCY) at a time.
+    Streams one NDJSON row per prompt in completion order, with the prompt
+    index, latency_ms, content, finish_reason, token usage and whether it
+    was cached, or the error for that prompt.
+    """
+    data = await request.get_json(silent=True) or {}
+    prompts = data.get('prompts')
+    if not isinstance(prompts, list) or not prompts or not all(isinstance(p, str) and p.strip() for p in prompts):
+        return jsonify({'error': 'prompts must be a non-empty list of non-empty strings'}), 400
+    if len(prompts) > batch_max_prompts:
+        return jsonify({'error': f'At most {batch_max_prompts} prompts per batch'}), 413
+    max_concurrency = data.get('max_concurrency', batch_max_concurrency)
+    if not isinstance(max_concurrency, int) or max_concurrency < 1:
+        return jsonify({'error': 'max_concurrency must be a positive integer'}), 400
+
+    session_id = session.get('session_id')
+    if not session_id:
+        session_id = session['session_id'] = str(uuid.uuid4())
+
+    if drain.draining:
+        return draining_response()
+
+    # A batch counts as one message for the session's rate limit
+    try:
+        rate_limiter.acquire(session_id)
+        chat_limiter.check()
+    except AdmissionRejected as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+
+    # Each prompt holds a stream slot while it runs, so batches and chats share CHAT_MAX_CONCURRENT_STREAMS
+    rows = chat_service.batch_chat([p.strip() for p in prompts], min(max_concurrency, batch_max_concurrency),
+                                   chat_limiter)
+    
+    async def lines():
+        async for row in rows:
+            yield json.dumps(row) + '\n'
+
+    response = Response(drain.track_async(lines()), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+    response.timeout = None
+    return response
+
+@app.route('/api/chat/stream')
+async def resume_chat():
+    """
+    Resume a chat stream after a dropped connection, from the event after
+    the Last-Event-ID header (or last_event_id query parameter)
+    """
+    event_id = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    generation = active_streams.get(event_id[0]) if event_id else None
+    if generation is None or generation.session_id != session.get('session_id'):
+        return jsonify({'error': 'Stream not found'}), 404
+    if not generation.buffer.has(event_id[1]):
+        return jsonify({'error': 'Stream can no longer be resumed'}), 410
+    return event_stream_response(follow_async(generation, event_id[1]))
+
+async def start_generation(session_id, user_message, key=None, admit_first=True):
+    """
+    Answer a message in the background, after the session's earlier ones, so
+    the answer survives a dropped connection; clients follow the returned
+    generation's event buffer. A submission with the request ID (key) of one
+    still being answered gets that generation instead. With admit_first, a
+    message that can run now waits here for its stream slot, so the caller
+    gets AdmissionRejected before its response starts; otherwise (and for
+    messages queued behind earlier ones) the slot is taken when its turn comes.
+    """
+    generation, started = active_streams.start(session_id, key)
+    if not started:
+        duplicate_requests.inc()
+        return generation
+    admitted_at = None
+    if admit_first and generation.turn.is_set():
+        admitted_at = await admit(generation)
+    task = asyncio.create_task(generate_answer(session_id, generation, user_message, admitted_at))
+    generation_tasks.add(task)
+    task.add_done_callback(generation_tasks.discard)
+    return generation
+
+async def admit(generation):
+    """
+    Wait for a free stream slot (bounded queue and wait time) and return when
+    it was granted. When none frees up in time the generation ends with an
+    error event carrying the Retry-After hint, and AdmissionRejected is re-raised.
+    """
+    try:
+        await chat_limiter.acquire()
+    except AdmissionRejected as e:
+        generation.emit({'content': f'Error: {str(e)}', 'type': 'error', 'retry_after': e.retry_after})
+        active_streams.finish(generation)
+        raise
+    except asyncio.CancelledError:
+        # The client went away while chat() waited: let the session's next message run
+        active_streams.finish(generation)
+        raise
+    return time.monotonic()
+
+async def generate_answer(session_id, generation, user_message, admitted_at=None):
+    """
+    Stream one answer from Azure OpenAI into the generation's event buffer
+    (admitted_at: when start_generation already took its stream slot)
+    """
+    if admitted_at is None:
+        # Wait until the session's earlier messages are answered, so each turn
+        # reads the history the previous one wrote
+        await generation.turn.wait()
+        if generation.stopped():
+            # Cancelled (or left by every client) before it started
+            generation.emit({'type': 'complete', 'cancelled': True})
+            active_streams.finish(generation)
+            return
+        try:
+            admitted_at = await admit(generation)
+        except AdmissionRejected:
+            return
+
+    assistant_response = ""
+    saved = False
+    chunks = stream = None
+    try:
+        # Add user message to conversation history
+        user_msg = chat_service.format_user_message(user_message)
+        await session_store.aappend(session_id, user_msg)
+
+        chunks = chat_service.stream_chat_response(await session_store.aget(session_id))
+        stream = coalesce_async(until_cancelled_async(chunks, generation), sse_flush_interval_ms, sse_flush_bytes)
+        async for chunk in stream:
+            assistant_response += chunk
+            # Send coalesced chunks as Server-Sent Events
+            generation.emit({'content': chunk, 'type': 'chunk'})
+
+        # Add assistant response (partial if cancelled) to conversation history
+        assistant_msg = chat_service.format_assistant_message(assistant_response)
+        turn_id = await session_store.aappend(session_id, assistant_msg)
+        saved = True
+
+        # Send completion signal
+        complete = {'type': 'complete', 'turn_id': turn_id}
+        if generation.stopped():
+            complete['cancelled'] = True
+        generation.emit(complete)
+
+    except Exception as e:
+        generation.emit({'content': f'Error: {str(e)}', 'type': 'error'})
+    finally:
+        try:
+            # Close the upstream stream (it stops early when the generation is
+            # cancelled or abandoned) and keep what was already streamed
+            if stream is not None:
+                await stream.aclose()
+                await chunks.aclose()
+            if assistant_response and not saved:
+                await session_store.aappend(session_id, chat_service.format_assistant_message(assistant_response))
+        finally:
+            # Always let the session's next message run
+            active_streams.finish(generation)
+            await chat_limiter.release(time.monotonic() - admitted_at)
+
+def event_stream_response(frames):
+    response = Response(
+        drain.track_async(frames),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no',
+            'Access-Control-Allow-Origin': '*',
+        }
+    )
+    # Token streams can outlive Quart's default response timeout
+    response.timeout = None
+    return response
+
+def draining_response():
+    # Connection: close, so the client's retry opens a connection to another worker
+    return jsonify({'error': 'Server is restarting, please retry'}), 503, {'Retry-After': '1', 'Connection': 'close'}
+
+@app.route('/api/chat/cancel', methods=['POST'])
+async def cancel_chat():
+    """Stop the session's in-flight generation (the partial answer is kept in history)"""
+    session_id = session.get('session_id')
+    cancelled = active_streams.cancel(session_id) if session_id else 0
+    return jsonify({'status': 'success', 'cancelled': cancelled})
+
+@app.route('/api/clear', methods=['POST'])
+async def clear_conversation():
+    """Clear the conversation history"""
+    session_id = session.get('session_id')
+    if session_id:
+        await session_store.aclear(session_id)
+    return jsonify({'status': 'success'})
+
+@app.route('/api/history')
+async def get_history():
+    """
+    Get conversation history. Turns carry stable IDs for incremental reads:
+    ?limit=N returns the newest N turns, &before=<id> the page before that turn,
+    and ?since=<id> only the turns after it. `reset` is true when the given turn
+    no longer exists (history cleared), in which case the newest turns are returned.
+    """
+    since = request.args.get('since', type=int)
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+
+    session_id = session.get('session_id')
+    if not session_id:
+        return jsonify({'history': [], 'has_more': False, 'reset': False})
+
+    page = await session_store.aget_turns(session_id, after=since, before=before, limit=limit)
+    reset = page is None
+    if reset:
+        page = await session_store.aget_turns(session_id, limit=limit)
+    turns, has_more = page
+    return jsonify({
+        'history': [{'id': turn_id, **message} for turn_id, message in turns],
+        'has_more': has_more,
+        'reset': reset,
+    })
+
+@app.route('/api/health')
+async def health_check():
+    """Health check endpoint (503 while draining, so load balancers stop sending traffic)"""
+    return jsonify({
+        'status': 'draining' if drain.draining else 'healthy',
+        'service': 'Flask AI Chat Application',
+        'sessions': await session_store.astats(),
+        'response_cache': chat_service.response_cache.stats(),
+        'admission': chat_limiter.stats(),
+        'rate_limit': rate_limiter.stats(),
+        'upstream': chat_service.upstream.stats(),
+        'drain': drain.stats(),
+    }), 503 if drain.draining else 200
+
+@app.route('/metrics')
+async def metrics():
+    """Prometheus metrics: time to first token, stream latency, throughput and active streams"""
+    # The sessions gauge reads the session store, which may block
+    if session_store.blocking:
+        body = await asyncio.to_thread(chat_service.metrics.render)
+    else:
+        body = chat_service.metrics.render()
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='127.0.0.1', port=5000)
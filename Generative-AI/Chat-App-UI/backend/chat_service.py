@@ -1,23 +1,33 @@
 import os
 import json
-from openai import AzureOpenAI
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from .admission import AdmissionRejected
+from .metrics import ChatMetrics
+from .response_cache import ResponseCache
+from .upstream import UpstreamPool
+from .token_budget import (
+    TokenCounter, HistoryWindow, RollingSummary, MESSAGE_OVERHEAD_TOKENS, message_text,
+)
 
 # Load environment variables from .env file
 load_dotenv()
 
+def elapsed_ms(started):
+    return round((time.monotonic() - started) * 1000, 1)
+
 class ChatService:
     def __init__(self):
         self.endpoint = os.getenv("ENDPOINT_URL", "")
         self.deployment = os.getenv("DEPLOYMENT_NAME", "")
         self.subscription_key = os.getenv("AZURE_OPENAI_API_KEY", "")
         
-        # Initialize Azure OpenAI client
-        self.client = AzureOpenAI(
-            azure_endpoint=self.endpoint,
-            api_key=self.subscription_key,
-            api_version="2025-01-01-preview",
-        )
+        # Azure OpenAI client, created on first use (see the client property)
+        self._client = None
+        self._client_lock = threading.Lock()
         
         # System message that stays constant
         self.system_message = {
@@ -29,41 +39,302 @@ class ChatService:
                 }
             ]
         }
+        
+        # Input token budget for the prompt (0 sends the whole history)
+        self.token_counter = TokenCounter(os.getenv("TOKENIZER_ENCODING", "o200k_base"))
+        self.history_window = HistoryWindow(self.token_counter, int(os.getenv("MAX_INPUT_TOKENS", "8000")))
+        
+        # Optional rolling summary of the turns that no longer fit the budget
+        self.summarize_history = os.getenv("HISTORY_SUMMARY", "false").lower() == "true"
+        self.summary_max_tokens = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "200"))
+        self.rolling_summary = RollingSummary()
+        
+        # Parameters for chat completions (also part of the response cache key)
+        self.generation_params = {
+            "max_tokens": 800,
+            "temperature": 0.7,
+            "top_p": 0.95,
+            "frequency_penalty": 0,
+            "presence_penalty": 0,
+            "stop": None,
+        }
+        
+        # Exact-match cache of completed responses (RESPONSE_CACHE_MAX_ENTRIES=0 disables)
+        self.response_cache = ResponseCache(
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+            max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+            ttl_seconds=int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+        )
+        
+        # Latency and throughput metrics for streamed responses (served at /metrics)
+        self.metrics = ChatMetrics(self.token_counter.count_text)
+        
+        # One tuned connection pool shared by all upstream requests; when no request
+        # was made for UPSTREAM_PING_INTERVAL_SECONDS, a cheap ping keeps a connection open
+        self.upstream = UpstreamPool(
+            self.metrics,
+            max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100")),
+            max_keepalive=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("UPSTREAM_KEEPALIVE_SECONDS", "120")),
+        )
+        self.ping_interval = float(os.getenv("UPSTREAM_PING_INTERVAL_SECONDS", "0"))
+        self._keep_warm = None
+        self._stopping = threading.Event()
+    
+    @property
+    def client(self):
+        """
+        Azure OpenAI client, created on first use so that importing the app
+        (and a worker's cold start) does not pay for importing openai
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self.create_client()
+        return self._client
+    
+    def create_client(self):
+        """
+        Create the Azure OpenAI client used for chat completions
+        """
+        from openai import AzureOpenAI
+        
+        return AzureOpenAI(
+            azure_endpoint=self.endpoint,
+            api_key=self.subscription_key,
+            api_version="2025-01-01-preview",
+            http_client=self.upstream.http_client(),
+        )
     
     def create_chat_prompt(self, conversation_history):
         """
-        Create chat prompt with system message and conversation history
+        Create chat prompt with system message and as much of the most recent
+        conversation history as fits the input token budget
+        """
+        evicted, kept = self.split_history(conversation_history)
+        summary = self.summarize_evicted(evicted) if evicted and self.summarize_history else None
+        return self.assemble_prompt(summary, kept)
+    
+    def split_history(self, conversation_history):
         """
+        Split history into evicted (oldest) and kept messages.
+        The system message and summary are budgeted first, so they are never dropped.
+        """
+        reserved = self.token_counter.count_message(self.system_message)
+        if self.summarize_history:
+            reserved += self.summary_max_tokens + MESSAGE_OVERHEAD_TOKENS
+        return self.history_window.split(conversation_history, reserved)
+    
+    def assemble_prompt(self, summary, kept):
         chat_prompt = [self.system_message]
-        chat_prompt.extend(conversation_history)
+        if summary:
+            chat_prompt.append(self.format_summary_message(summary))
+        chat_prompt.extend(kept)
         return chat_prompt
     
+    def summarize_evicted(self, evicted):
+        """
+        Return a summary of the evicted messages, extending the cached summary
+        of an earlier prefix when there is one
+        """
+        previous, pending, key = self.rolling_summary.lookup(evicted)
+        if not pending:
+            return previous
+        try:
+            response = self.client.chat.completions.create(
+                model=self.deployment,
+                messages=self.create_summary_prompt(previous, pending),
+                max_tokens=self.summary_max_tokens,
+                temperature=0,
+            )
+            summary = response.choices[0].message.content or ""
+        except Exception:
+            # Answer without the newest part of the summary rather than fail the turn
+            return previous
+        self.rolling_summary.store(key, summary)
+        return summary
+    
+    def create_summary_prompt(self, previous_summary, messages):
+        """
+        Create the prompt that folds evicted messages into the running summary
+        """
+        transcript = "\n".join(f"{message['role']}: {message_text(message)}" for message in messages)
+        if previous_summary:
+            transcript = f"Summary so far: {previous_summary}\n\n{transcript}"
+        return [
+            {
+                "role": "system",
+                "content": "Summarize this earlier part of a conversation between a user and a travel "
+                           "assistant in a few sentences. Keep names, places, dates and preferences."
+            },
+            {"role": "user", "content": transcript}
+        ]
+    
+    def format_summary_message(self, summary):
+        """
+        Format the rolling summary as a system message placed before the kept history
+        """
+        return {
+            "role": "system",
+            "content": [
+                {
+                    "type": "text",
+                    "text": f"Summary of the earlier conversation: {summary}"
+                }
+            ]
+        }
+    
     def stream_chat_response(self, conversation_history):
         """
-        Stream chat response from Azure OpenAI
+        Stream chat response from Azure OpenAI.
+        Closing the generator early closes the upstream stream, so generation stops.
         """
+        stream = self.metrics.stream()
+        response = None
         try:
             messages = self.create_chat_prompt(conversation_history)
             
+            # Replay a cached response chunk by chunk, exactly like a live stream
+            cache_key = self.response_cache_key(messages)
+            cached = self.response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                stream.source = 'cache'
+                for content in cached:
+                    stream.chunk(content)
+                    yield content
+                stream.complete()
+                return
+            
             response = self.client.chat.completions.create(
                 model=self.deployment,
                 messages=messages,
-                max_tokens=800,
-                temperature=0.7,
-                top_p=0.95,
-                frequency_penalty=0,
-                presence_penalty=0,
-                stop=None,
+                **self.generation_params,
                 stream=True
             )
             
+            chunks = []
             for update in response:
                 if update.choices and update.choices[0].delta.content:
                     content = update.choices[0].delta.content
+                    chunks.append(content)
+                    stream.chunk(content)
                     yield content
+            stream.complete()
+            
+            # Only complete responses are cached
+            if cache_key:
+                self.response_cache.put(cache_key, chunks)
                     
         except Exception as e:
+            stream.fail()
             yield f"Error: {str(e)}"
+        finally:
+            stream.finish()
+            if response is not None:
+                response.close()
+    
+    def response_cache_key(self, messages):
+        """
+        Cache key for a prompt, or None when the response cache is disabled
+        """
+        if not self.response_cache.enabled:
+            return None
+        return self.response_cache.make_key(messages, deployment=self.deployment, **self.generation_params)
+    
+    def batch_chat(self, prompts, max_concurrency=8, limiter=None):
+        """
+        Answer independent prompts (no conversation history) concurrently, at
+        most max_concurrency at a time. Yields one result row per prompt in
+        completion order; closing the generator early drops the prompts not yet started.
+        With a limiter, each prompt holds one of its stream slots while it runs,
+        so batches share the limit with chat streams (see complete_admitted).
+        """
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(prompts))),
+                                      thread_name_prefix='chat-batch')
+        try:
+            if limiter is None:
+                futures = [executor.submit(self.complete_prompt, index, prompt) for index, prompt in enumerate(prompts)]
+            else:
+                futures = [executor.submit(self.complete_admitted, limiter, index, prompt)
+                           for index, prompt in enumerate(prompts)]
+            for future in as_completed(futures):
+                row = future.result()
+                self.metrics.record_batch(row)
+                yield row
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def complete_admitted(self, limiter, index, prompt):
+        """
+        complete_prompt in one of the limiter's stream slots; a prompt that
+        gets none in time fails with the limiter's Retry-After hint (retry_after)
+        """
+        started = time.monotonic()
+        try:
+            limiter.acquire()
+        except AdmissionRejected as e:
+            return {'index': index, 'latency_ms': elapsed_ms(started), 'error': str(e), 'retry_after': e.retry_after}
+        admitted_at = time.monotonic()
+        try:
+            return self.complete_prompt(index, prompt)
+        finally:
+            limiter.release(time.monotonic() - admitted_at)
+    
+    def complete_prompt(self, index, prompt):
+        """
+        Answer one batch prompt without streaming and return its result row
+        """
+        started = time.monotonic()
+        try:
+            messages = self.assemble_prompt(None, [self.format_user_message(prompt)])
+            cache_key = self.response_cache_key(messages)
+            cached = self.response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                return self.cached_batch_row(index, started, cached)
+            
+            response = self.client.chat.completions.create(
+                model=self.deployment,
+                messages=messages,
+                **self.generation_params
+            )
+            return self.batch_row(index, started, response, cache_key)
+        except Exception as e:
+            return {'index': index, 'latency_ms': elapsed_ms(started), 'error': str(e)}
+    
+    def batch_row(self, index, started, response, cache_key):
+        """
+        Result row for a completed batch prompt, with the token usage Azure OpenAI reported
+        """
+        choice = response.choices[0]
+        content = choice.message.content or ""
+        if cache_key:
+            self.response_cache.put(cache_key, [content])
+        usage = response.usage
+        return {
+            'index': index,
+            'latency_ms': elapsed_ms(started),
+            'content': content,
+            'finish_reason': choice.finish_reason,
+            'usage': {
+                'prompt_tokens': usage.prompt_tokens,
+                'completion_tokens': usage.completion_tokens,
+                'total_tokens': usage.total_tokens,
+            } if usage else None,
+            'cached': False,
+        }
+    
+    def cached_batch_row(self, index, started, chunks):
+        """
+        Result row for a batch prompt answered from the response cache (no tokens used)
+        """
+        return {
+            'index': index,
+            'latency_ms': elapsed_ms(started),
+            'content': ''.join(chunks),
+            'finish_reason': 'stop',
+            'usage': None,
+            'cached': True,
+        }
     
     def format_user_message(self, user_input):
         """
@@ -93,7 +364,240 @@ class ChatService:
             ]
         }
     
+    def warm_up(self):
+        """
+        Create the client, load the tokenizer and open a pooled connection to
+        the endpoint, so the first chat request does not pay for them
+        """
+        self.token_counter.warm_up()
+        self.ping()
+    
+    def ping(self):
+        """
+        Cheap request (list models, no tokens used) that opens or refreshes a pooled connection
+        """
+        try:
+            self.client.with_options(max_retries=0, timeout=10).models.list()
+        except Exception:
+            # Any response, even an error status, leaves a connection in the pool
+            pass
+    
+    def start_keep_warm(self):
+        """
+        Ping the endpoint in the background whenever no upstream request was made
+        for UPSTREAM_PING_INTERVAL_SECONDS (no-op when the interval is 0)
+        """
+        if not self.ping_interval or self._keep_warm is not None:
+            return
+        self._keep_warm = threading.Thread(target=self._keep_warm_loop, name='upstream-keep-warm', daemon=True)
+        self._keep_warm.start()
+    
+    def _keep_warm_loop(self):
+        while True:
+            wait = self.ping_interval - self.upstream.idle_seconds()
+            if wait <= 0:
+                self.ping()
+                wait = self.ping_interval
+            if self._stopping.wait(wait):
+                return
+    
     def close(self):
-        """Close the OpenAI client"""
-        if hasattr(self.client, 'close'):
-            self.client.close()
+        """Stop the keep-warm pings and close the OpenAI client (if it was created)"""
+        self._stopping.set()
+        if self._client is not None:
+            self._client.close()
+
+
+class AsyncChatService(ChatService):
+    """
+    Chat service for the async (ASGI) serving mode.
+    Uses AsyncAzureOpenAI so a single worker can hold many concurrent streams.
+    """
+    
+    def create_client(self):
+        """
+        Create the async Azure OpenAI client used for chat completions
+        """
+        from openai import AsyncAzureOpenAI
+        
+        return AsyncAzureOpenAI(
+            azure_endpoint=self.endpoint,
+            api_key=self.subscription_key,
+            api_version="2025-01-01-preview",
+            http_client=self.upstream.async_http_client(),
+        )
+    
+    async def create_chat_prompt_async(self, conversation_history):
+        """
+        Async version of create_chat_prompt (the summary call is awaited)
+        """
+        evicted, kept = self.split_history(conversation_history)
+        summary = await self.summarize_evicted_async(evicted) if evicted and self.summarize_history else None
+        return self.assemble_prompt(summary, kept)
+    
+    async def summarize_evicted_async(self, evicted):
+        """
+        Async version of summarize_evicted
+        """
+        previous, pending, key = self.rolling_summary.lookup(evicted)
+        if not pending:
+            return previous
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.deployment,
+                messages=self.create_summary_prompt(previous, pending),
+                max_tokens=self.summary_max_tokens,
+                temperature=0,
+            )
+            summary = response.choices[0].message.content or ""
+        except Exception:
+            return previous
+        self.rolling_summary.store(key, summary)
+        return summary
+    
+    async def stream_chat_response(self, conversation_history):
+        """
+        Stream chat response from Azure OpenAI as an async generator.
+        Closing or cancelling the generator early closes the upstream stream.
+        """
+        stream = self.metrics.stream()
+        response = None
+        try:
+            messages = await self.create_chat_prompt_async(conversation_history)
+            
+            # Replay a cached response chunk by chunk, exactly like a live stream
+            cache_key = self.response_cache_key(messages)
+            cached = self.response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                stream.source = 'cache'
+                for content in cached:
+                    stream.chunk(content)
+                    yield content
+                stream.complete()
+                return
+            
+            response = await self.client.chat.completions.create(
+                model=self.deployment,
+                messages=messages,
+                **self.generation_params,
+                stream=True
+            )
+            
+            chunks = []
+            async for update in response:
+                if update.choices and update.choices[0].delta.content:
+                    content = update.choices[0].delta.content
+                    chunks.append(content)
+                    stream.chunk(content)
+                    yield content
+            stream.complete()
+            
+            # Only complete responses are cached
+            if cache_key:
+                self.response_cache.put(cache_key, chunks)
+                    
+        except Exception as e:
+            stream.fail()
+            yield f"Error: {str(e)}"
+        finally:
+            stream.finish()
+            if response is not None:
+                await response.close()
+    
+    async def batch_chat(self, prompts, max_concurrency=8, limiter=None):
+        """
+        Async version of batch_chat: prompts run as tasks, at most max_concurrency
+        at a time; closing the generator early cancels the unfinished ones
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        
+        async def run(index, prompt):
+            async with semaphore:
+                if limiter is None:
+                    return await self.complete_prompt(index, prompt)
+                return await self.complete_admitted(limiter, index, prompt)
+        
+        tasks = [asyncio.ensure_future(run(index, prompt)) for index, prompt in enumerate(prompts)]
+        try:
+            for next_row in asyncio.as_completed(tasks):
+                row = await next_row
+                self.metrics.record_batch(row)
+                yield row
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def complete_admitted(self, limiter, index, prompt):
+        """
+        Async version of complete_admitted
+        """
+        started = time.monotonic()
+        try:
+            await limiter.acquire()
+        except AdmissionRejected as e:
+            return {'index': index, 'latency_ms': elapsed_ms(started), 'error': str(e), 'retry_after': e.retry_after}
+        admitted_at = time.monotonic()
+        try:
+            return await self.complete_prompt(index, prompt)
+        finally:
+            await limiter.release(time.monotonic() - admitted_at)
+    
+    async def complete_prompt(self, index, prompt):
+        """
+        Async version of complete_prompt
+        """
+        started = time.monotonic()
+        try:
+            messages = self.assemble_prompt(None, [self.format_user_message(prompt)])
+            cache_key = self.response_cache_key(messages)
+            cached = self.response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                return self.cached_batch_row(index, started, cached)
+            
+            response = await self.client.chat.completions.create(
+                model=self.deployment,
+                messages=messages,
+                **self.generation_params
+            )
+            return self.batch_row(index, started, response, cache_key)
+        except Exception as e:
+            return {'index': index, 'latency_ms': elapsed_ms(started), 'error': str(e)}
+    
+    async def warm_up(self):
+        """
+        Async version of warm_up
+        """
+        await asyncio.to_thread(self.token_counter.warm_up)
+        await self.ping()
+    
+    async def ping(self):
+        """
+        Async version of ping
+        """
+        try:
+            await self.client.with_options(max_retries=0, timeout=10).models.list()
+        except Exception:
+            pass
+    
+    def start_keep_warm(self):
+        """
+        Async version of start_keep_warm: runs as a task on the running event loop
+        """
+        if not self.ping_interval or self._keep_warm is not None:
+            return
+        self._keep_warm = asyncio.create_task(self._keep_warm_loop())
+    
+    async def _keep_warm_loop(self):
+        while True:
+            wait = self.ping_interval - self.upstream.idle_seconds()
+            if wait <= 0:
+                await self.ping()
+                wait = self.ping_interval
+            await asyncio.sleep(wait)
+    
+    async def close(self):
+        """Stop the keep-warm pings and close the async OpenAI client (if it was created)"""
+        if self._keep_warm is not None:
+            self._keep_warm.cancel()
+        if self._client is not None:
+            await self._client.close()
@@ -0,0 +1,123 @@
+import time
+import signal
+import threading
+
+
+class Drain:
+    """
+    Graceful shutdown for a chat worker. Once begin() is called (usually from
+    a SIGTERM handler), the worker is draining: new chat streams should be
+    refused with 503 so clients and load balancers go to another worker,
+    while the streams already running may finish. After `timeout` seconds the
+    `stop` callback ends the ones still running (they keep their partial
+    answers), and wait() returns once nothing is in flight or `grace` more
+    seconds have passed.
+
+    In-flight work is every response wrapped with track() / track_async(),
+    plus whatever the optional `pending` callable counts (e.g. answers that
+    are generated in the background).
+    """
+
+    def __init__(self, timeout=25, grace=5, pending=None, stop=None):
+        self.timeout = timeout
+        self.grace = grace
+        self._pending = pending
+        self._stop = stop
+
+        self._streams = 0
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._expired = False
+        self._idle = threading.Event()
+
+    @property
+    def draining(self):
+        return self._started_at is not None
+
+    @property
+    def expired(self):
+        """Whether the deadline has passed and running streams should stop"""
+        return self._expired
+
+    def begin(self):
+        """Start draining; safe to call from a signal handler and more than once"""
+        if self._started_at is not None:
+            return False
+        self._started_at = time.monotonic()
+        threading.Thread(target=self._watch, name='drain', daemon=True).start()
+        return True
+
+    def wait(self, timeout=None):
+        """Block until draining has finished; True unless timeout ran out first"""
+        return self._idle.wait(timeout)
+
+    def in_flight(self):
+        with self._lock:
+            streams = self._streams
+        return streams + (self._pending() if self._pending else 0)
+
+    def track(self, frames):
+        """Wrap a response iterator so the drain waits for it"""
+        self._add(1)
+        try:
+            yield from frames
+        finally:
+            self._add(-1)
+
+    async def track_async(self, frames):
+        """Async version of track()"""
+        self._add(1)
+        try:
+            async for frame in frames:
+                yield frame
+        finally:
+            self._add(-1)
+
+    def _add(self, count):
+        with self._lock:
+            self._streams += count
+
+    def _watch(self):
+        self._wait_idle(self._started_at + self.timeout)
+        if self.in_flight():
+            self._expired = True
+            if self._stop is not None:
+                self._stop()
+            # Stopped streams save what they have and send their last event
+            self._wait_idle(time.monotonic() + self.grace)
+        self._idle.set()
+
+    def _wait_idle(self, deadline):
+        while self.in_flight() and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+    def stats(self):
+        seconds_left = None
+        if self.draining:
+            seconds_left = round(max(0.0, self._started_at + self.timeout - time.monotonic()), 1)
+        return {
+            'draining': self.draining,
+            'expired': self.expired,
+            'in_flight': self.in_flight(),
+            'seconds_left': seconds_left,
+        }
+
+
+def drain_on_signal(drain, signum=signal.SIGTERM):
+    """
+    Begin draining when signum arrives, then run the handler that was
+    installed before (e.g. the server's own graceful shutdown, which stops
+    accepting connections and waits for the open ones). Returns False
+    outside the main thread, where signal handlers cannot be installed.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    previous = signal.getsignal(signum)
+
+    def handler(received, frame):
+        drain.begin()
+        if callable(previous):
+            previous(received, frame)
+
+    signal.signal(signum, handler)
+    return True
@@ -0,0 +1,265 @@
+import time
+import bisect
+import threading
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def samples(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return
+        yield self.name, '', value
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket upper bounds and optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))]), cumulative
+            labels = _format_labels(self.labelnames, key)
+            yield self.name + '_sum', labels, round(total, 6)
+            yield self.name + '_count', labels, cumulative
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics registry rendered in the Prometheus text format.
+    Each worker process keeps its own values.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, callback):
+        return self._register(Gauge(name, documentation, callback))
+
+    def histogram(self, name, documentation, buckets, labelnames=()):
+        return self._register(Histogram(name, documentation, buckets, labelnames))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+class StreamObservation:
+    """
+    Measures one streamed response. Per-chunk work only updates local fields;
+    the shared metrics are updated once, when the stream finishes.
+    """
+
+    __slots__ = ('metrics', 'source', 'started', 'first_chunk_at', 'chunks', 'parts', 'outcome')
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.source = 'upstream'
+        self.started = time.monotonic()
+        self.first_chunk_at = None
+        self.chunks = 0
+        self.parts = []
+        self.outcome = None
+
+    def chunk(self, text):
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.monotonic()
+        self.chunks += 1
+        self.parts.append(text)
+
+    def complete(self):
+        self.outcome = 'completed'
+
+    def fail(self):
+        self.outcome = 'error'
+
+    def finish(self):
+        """Record the stream; a stream closed before completing counts as cancelled"""
+        self.metrics.record(self, self.outcome or 'cancelled', time.monotonic())
+
+
+class ChatMetrics:
+    """
+    Latency and throughput metrics for streamed chat responses:
+    time to first token, stream duration, output tokens per second,
+    chunk and token counters, stream outcomes and in-flight streams,
+    plus how long requests waited for a free stream slot and the outcome,
+    latency and output tokens of batch prompts.
+    """
+
+    TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30)
+    DURATION_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+    TOKENS_PER_SECOND_BUCKETS = (5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+    QUEUE_WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+
+    def __init__(self, count_tokens=None):
+        # Output tokens are counted once per stream; without a tokenizer they are estimated
+        self.count_tokens = count_tokens or (lambda text: (len(text.encode('utf-8')) + 3) // 4)
+        self.registry = MetricsRegistry()
+
+        self._active = 0
+        self._lock = threading.Lock()
+
+        self.ttft = self.registry.histogram(
+            'chat_time_to_first_token_seconds', 'Time from the start of a stream to its first chunk',
+            self.TTFT_BUCKETS, ('source',),
+        )
+        self.duration = self.registry.histogram(
+            'chat_stream_duration_seconds', 'Total time to stream a response',
+            self.DURATION_BUCKETS, ('source', 'outcome'),
+        )
+        self.tokens_per_second = self.registry.histogram(
+            'chat_output_tokens_per_second', 'Output tokens per second after the first token (upstream streams)',
+            self.TOKENS_PER_SECOND_BUCKETS,
+        )
+        self.queue_wait = self.registry.histogram(
+            'chat_queue_wait_seconds', 'Time requests waited for a free stream slot, by whether they got one',
+            self.QUEUE_WAIT_BUCKETS, ('outcome',),
+        )
+        self.streams = self.registry.counter(
+            'chat_streams_total', 'Streamed responses by source and outcome', ('source', 'outcome'),
+        )
+        self.chunks = self.registry.counter('chat_chunks_total', 'Streamed chunks', ('source',))
+        self.tokens = self.registry.counter('chat_output_tokens_total', 'Streamed output tokens', ('source',))
+        self.registry.gauge('chat_active_streams', 'Responses currently being streamed', lambda: self._active)
+        self.batch_prompts = self.registry.counter('chat_batch_prompts_total', 'Batch prompts by outcome', ('outcome',))
+        self.batch_duration = self.registry.histogram(
+            'chat_batch_prompt_duration_seconds', 'Time to answer one batch prompt',
+            self.DURATION_BUCKETS, ('outcome',),
+        )
+        self.batch_tokens = self.registry.counter(
+            'chat_batch_output_tokens_total', 'Output tokens of batch prompts answered by Azure OpenAI',
+        )
+
+    def stream(self):
+        """Start measuring a stream; call finish() on the returned observation when it ends"""
+        with self._lock:
+            self._active += 1
+        return StreamObservation(self)
+
+    def record(self, observation, outcome, finished_at):
+        with self._lock:
+            self._active -= 1
+
+        source = observation.source
+        self.streams.inc(source=source, outcome=outcome)
+        self.duration.observe(finished_at - observation.started, source=source, outcome=outcome)
+        if observation.first_chunk_at is None:
+            return
+
+        self.ttft.observe(observation.first_chunk_at - observation.started, source=source)
+        tokens = self.count_tokens(''.join(observation.parts))
+        self.chunks.inc(observation.chunks, source=source)
+        self.tokens.inc(tokens, source=source)
+        generating = finished_at - observation.first_chunk_at
+        if source == 'upstream' and outcome == 'completed' and tokens > 1 and generating > 0:
+            self.tokens_per_second.observe((tokens - 1) / generating)
+
+    def record_batch(self, row):
+        """Count a finished batch prompt from its result row"""
+        if 'retry_after' in row:
+            outcome = 'rejected'
+        elif 'error' in row:
+            outcome = 'error'
+        else:
+            outcome = 'cached' if row['cached'] else 'completed'
+        self.batch_prompts.inc(outcome=outcome)
+        self.batch_duration.observe(row['latency_ms'] / 1000, outcome=outcome)
+        if row.get('usage'):
+            self.batch_tokens.inc(row['usage']['completion_tokens'])
+
+    def gauge(self, name, documentation, callback):
+        """Add an application gauge (sessions, queue depth, ...) read at scrape time"""
+        return self.registry.gauge(name, documentation, callback)
+
+    def render(self):
+        return self.registry.render()
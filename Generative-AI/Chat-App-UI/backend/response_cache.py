@@ -0,0 +1,104 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Case-fold and collapse whitespace so trivially different prompts share an entry"""
+    return ' '.join(text.split()).casefold()
+
+
+def normalize_message(message):
+    content = message.get('content', '')
+    if isinstance(content, str):
+        content = normalize_text(content)
+    else:
+        content = [
+            {**part, 'text': normalize_text(part['text'])} if isinstance(part, dict) and 'text' in part else part
+            for part in content
+        ]
+    return [message.get('role'), content]
+
+
+class ResponseCache:
+    """
+    Exact-match cache of completed chat responses.
+    Entries are keyed on the normalized prompt messages plus the generation
+    parameters, hold the original streamed chunks so hits replay exactly like
+    a live response, and are bounded by entry count, total bytes and TTL.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=16 * 1024 * 1024, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._entries = OrderedDict()
+        self._resident_bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def make_key(self, messages, **params):
+        payload = json.dumps(
+            [sorted(params.items()), [normalize_message(message) for message in messages]],
+            separators=(',', ':'), ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached chunks for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                chunks, size, stored_at = entry
+                if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+                    self._remove(key)
+                    self._evictions += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return chunks
+            self._misses += 1
+            return None
+
+    def put(self, key, chunks):
+        chunks = tuple(chunks)
+        size = sum(len(chunk.encode('utf-8')) for chunk in chunks)
+        if not self.enabled or (self.max_bytes and size > self.max_bytes):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (chunks, size, time.monotonic())
+            self._resident_bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes and self._resident_bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'resident_bytes': self._resident_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+            }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._resident_bytes -= size
@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_text(message):
+    """Return the text of a message whose content is a string or a list of text parts"""
+    content = message.get('content', '')
+    if isinstance(content, str):
+        return content
+    return ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+
+
+class TokenCounter:
+    """
+    Counts prompt tokens locally with tiktoken, or estimates them (about four
+    bytes per token) when tiktoken or its encoding file is unavailable.
+    Counts are cached per message text, so each message is tokenized once
+    rather than on every turn. The encoding is loaded on first use (or by
+    warm_up), since reading its file slows startup and may download it.
+    """
+
+    def __init__(self, encoding_name='o200k_base', cache_size=4096):
+        self.encoding_name = encoding_name
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._encoding = None
+        self._encoding_loaded = False
+        self._load_lock = threading.Lock()
+
+    def warm_up(self):
+        """Load the encoding now rather than on the first count"""
+        if self._encoding_loaded:
+            return self._encoding
+        with self._load_lock:
+            if not self._encoding_loaded:
+                try:
+                    import tiktoken
+                    self._encoding = tiktoken.get_encoding(self.encoding_name)
+                except Exception:
+                    self._encoding = None
+                self._encoding_loaded = True
+        return self._encoding
+
+    def count_text(self, text):
+        with self._lock:
+            count = self._cache.get(text)
+            if count is not None:
+                self._cache.move_to_end(text)
+                return count
+
+        encoding = self.warm_up()
+        if encoding is not None:
+            count = len(encoding.encode(text, disallowed_special=()))
+        else:
+            count = (len(text.encode('utf-8')) + 3) // 4
+
+        with self._lock:
+            self._cache[text] = count
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+    def count_message(self, message):
+        return self.count_text(message_text(message)) + MESSAGE_OVERHEAD_TOKENS
+
+
+class HistoryWindow:
+    """
+    Splits a conversation history into the oldest messages that no longer fit
+    the input token budget and the newest messages that do. The latest message
+    is always kept, even when it alone exceeds the budget.
+    """
+
+    def __init__(self, counter, max_input_tokens):
+        self.counter = counter
+        self.max_input_tokens = max_input_tokens
+
+    def split(self, conversation_history, reserved_tokens=0):
+        """Return (evicted, kept) lists, keeping as many recent messages as fit"""
+        if not self.max_input_tokens:
+            return [], list(conversation_history)
+
+        budget = self.max_input_tokens - reserved_tokens
+        used = 0
+        start = len(conversation_history)
+        while start > 0:
+            cost = self.counter.count_message(conversation_history[start - 1])
+            if used + cost > budget and start < len(conversation_history):
+                break
+            used += cost
+            start -= 1
+        return list(conversation_history[:start]), list(conversation_history[start:])
+
+
+class RollingSummary:
+    """
+    Caches summaries of evicted history prefixes. Histories only grow at the
+    end, so when more messages are evicted the previous summary is extended
+    with just the newly evicted messages instead of re-summarizing them all.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, evicted):
+        """
+        Return (previous_summary, pending_messages, key). The caller summarizes
+        previous_summary plus pending_messages and stores the result under key;
+        when pending_messages is empty, previous_summary is already current.
+        """
+        keys = []
+        digest = 0
+        for message in evicted:
+            digest = hash((digest, message.get('role'), message_text(message)))
+            keys.append(digest)
+
+        with self._lock:
+            for index in range(len(keys) - 1, -1, -1):
+                summary = self._summaries.get(keys[index])
+                if summary is not None:
+                    self._summaries.move_to_end(keys[index])
+                    return summary, evicted[index + 1:], keys[-1]
+        return None, evicted, keys[-1] if keys else None
+
+    def store(self, key, summary):
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            if len(self._summaries) > self.max_entries:
+                self._summaries.popitem(last=False)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Load generator for /api/chat
+
+Opens N concurrent sessions against a running app, each sending chat
+messages and reading the SSE stream to the end, and prints a JSON report
+with p50/p95/p99 time to first chunk and total latency, throughput and error
+counts. Run the app against benchmarks/mock_openai.py to avoid real quota.
+Uses only the standard library.
+
+Usage:
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --concurrency 20 --requests 200
+
+Disable the per-session rate limit of the app under test (CHAT_RATE_PER_MINUTE=0)
+when sending several turns per session.
+"""
+
+import json
+import time
+import uuid
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        'p50': round(percentile(values, 50), 1),
+        'p95': round(percentile(values, 95), 1),
+        'p99': round(percentile(values, 99), 1),
+        'mean': round(sum(values) / len(values), 1),
+        'max': round(values[-1], 1),
+    }
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ttft_ms = []
+        self.latency_ms = []
+        self.completed = 0
+        self.chunks = 0
+        self.chars = 0
+        self.errors = {}
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def success(self, ttft_ms, latency_ms, chunks, chars):
+        with self.lock:
+            self.completed += 1
+            self.latency_ms.append(latency_ms)
+            if ttft_ms is not None:
+                self.ttft_ms.append(ttft_ms)
+            self.chunks += chunks
+            self.chars += chars
+
+
+class Session:
+    """One client with its own session cookie"""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connect = lambda: connection_class(parts.hostname, parts.port, timeout=timeout)
+        self.cookie = None
+
+    def request(self, method, path, body=None):
+        connection = self.connect()
+        headers = {'Content-Type': 'application/json'}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = connection.getresponse()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return connection, response
+
+    def start(self):
+        connection, response = self.request('GET', '/')
+        response.read()
+        connection.close()
+
+
+def chat(session, message, results):
+    started = time.perf_counter()
+    ttft_ms = None
+    chunks = chars = 0
+    connection, response = session.request('POST', '/api/chat', {'message': message})
+    try:
+        if response.status != 200:
+            response.read()
+            results.error(f'http_{response.status}')
+            return
+        buffer = b''
+        while True:
+            data = response.read1(65536)
+            if not data:
+                break
+            buffer += data
+            *events, buffer = buffer.split(b'\n\n')
+            for event in events:
+                for line in event.split(b'\n'):
+                    if not line.startswith(b'data: '):
+                        continue
+                    payload = json.loads(line[6:])
+                    if payload['type'] == 'chunk':
+                        if ttft_ms is None:
+                            # The chat service reports upstream failures as an "Error: ..." chunk
+                            if payload['content'].startswith('Error:'):
+                                results.error('upstream_error')
+                                return
+                            ttft_ms = (time.perf_counter() - started) * 1000
+                        chunks += 1
+                        chars += len(payload['content'])
+                    elif payload['type'] == 'error':
+                        results.error('error_event')
+                        return
+                    elif payload['type'] == 'complete':
+                        results.success(ttft_ms, (time.perf_counter() - started) * 1000, chunks, chars)
+                        return
+        results.error('incomplete_stream')
+    finally:
+        connection.close()
+
+
+def worker(args, counter, results, run_id):
+    session = None
+    turns = 0
+    while True:
+        with counter['lock']:
+            if counter['sent'] >= args.requests:
+                return
+            counter['sent'] += 1
+            number = counter['sent']
+        # Unique messages by default (also across runs), so response caching does not skew results
+        message = args.message if args.cacheable else f"{args.message} (run {run_id}, request {number})"
+        try:
+            if session is None or turns >= args.turns:
+                session = Session(args.url, args.timeout)
+                session.start()
+                turns = 0
+            turns += 1
+            chat(session, message, results)
+        except Exception as e:
+            results.error(type(e).__name__)
+            session = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='base URL of the app under test')
+    parser.add_argument('--concurrency', type=int, default=10, help='concurrent sessions')
+    parser.add_argument('--requests', type=int, default=100, help='total chat messages to send')
+    parser.add_argument('--turns', type=int, default=1, help='messages per session before starting a new one')
+    parser.add_argument('--message', default='Plan a three day trip to Paris')
+    parser.add_argument('--cacheable', action='store_true', help='send identical messages (measures the response cache)')
+    parser.add_argument('--timeout', type=float, default=120, help='socket timeout in seconds')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    results = Results()
+    counter = {'lock': threading.Lock(), 'sent': 0}
+    run_id = uuid.uuid4().hex[:8]
+    threads = [threading.Thread(target=worker, args=(args, counter, results, run_id)) for _ in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {
+        'config': vars(args),
+        'elapsed_seconds': round(elapsed, 3),
+        'requests': args.requests,
+        'completed': results.completed,
+        'errors': results.errors,
+        'error_count': sum(results.errors.values()),
+        'ttft_ms': summarize(results.ttft_ms),
+        'latency_ms': summarize(results.latency_ms),
+        'throughput': {
+            'requests_per_sec': round(results.completed / elapsed, 2),
+            'chunks_per_sec': round(results.chunks / elapsed, 1),
+            'chars_per_sec': round(results.chars / elapsed, 1),
+        },
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,70 @@
+class StreamingRenderer {
+    // Shows a streamed answer as plain text while it arrives: new chunks are
+    // appended as text nodes, at most once per animation frame, instead of
+    // re-formatting the whole answer on every chunk. The caller formats the
+    // complete answer once, after finish().
+    constructor(messageElement, onFlush) {
+        this.pending = '';
+        this.frame = null;
+        this.onFlush = onFlush;
+        
+        this.textElement = document.createElement('div');
+        this.textElement.className = 'message-streaming';
+        const contentDiv = messageElement.querySelector('.message-content');
+        contentDiv.innerHTML = '';
+        contentDiv.appendChild(this.textElement);
+    }
+    
+    append(text) {
+        this.pending += text;
+        if (this.frame === null) {
+            this.frame = requestAnimationFrame(() => this.flush());
+        }
+    }
+    
+    flush() {
+        this.frame = null;
+        if (!this.pending) return;
+        this.textElement.appendChild(document.createTextNode(this.pending));
+        this.pending = '';
+        if (this.onFlush) {
+            this.onFlush();
+        }
+    }
+    
+    finish() {
+        // Render what is still pending right away instead of on the next frame
+        if (this.frame !== null) {
+            cancelAnimationFrame(this.frame);
+        }
+        this.flush();
+    }
+}
+
 class FlaskChatApp {
     constructor() {
         this.isStreaming = false;
         this.currentAssistantMessage = '';
         
+        // Turn IDs of the rendered history, so only missing turns are fetched
+        this.lastTurnId = null;
+        this.oldestTurnId = null;
+        this.hasOlderTurns = false;
+        this.loadingHistory = false;
+        this.historyPageSize = 50;
+        this.maxResumeAttempts = 3;
+        // Automatic resends when the server has no free stream slot
+        this.maxBusyRetries = 2;
+        this.maxBusyWaitSeconds = 30;
+        this.retryAfter = null;
+        this.cancelRequested = false;
+        this.wakeRetry = null;
+        
         // DOM elements
         this.messagesContainer = document.getElementById('chatMessages');
         this.messageInput = document.getElementById('messageInput');
         this.sendButton = document.getElementById('sendButton');
+        this.stopButton = document.getElementById('stopButton');
         this.typingIndicator = document.getElementById('typingIndicator');
         this.statusElement = document.getElementById('status');
         this.clearButton = document.getElementById('clearBtn');
@@ -14,12 +72,16 @@ class FlaskChatApp {
         this.initializeEventListeners();
         this.autoResizeTextarea();
         this.setWelcomeTime();
+        this.loadHistory();
     }
     
     initializeEventListeners() {
         // Send button click
         this.sendButton.addEventListener('click', () => this.sendMessage());
         
+        // Stop button click
+        this.stopButton.addEventListener('click', () => this.cancelResponse());
+        
         // Clear button click
         this.clearButton.addEventListener('click', () => this.clearConversation());
         
@@ -34,6 +96,28 @@ class FlaskChatApp {
         // Auto-resize textarea
         this.messageInput.addEventListener('input', () => this.autoResizeTextarea());
         
+        // Load older turns when scrolled to the top
+        this.messagesContainer.addEventListener('scroll', () => {
+            if (this.messagesContainer.scrollTop === 0) {
+                this.loadOlderHistory();
+            }
+        });
+        
+        // Leaving the page stops the answer at once; otherwise the server keeps
+        // generating for its resume grace period in case the client reconnects
+        window.addEventListener('pagehide', () => {
+            if (this.isStreaming) {
+                navigator.sendBeacon('/api/chat/cancel');
+            }
+        });
+        
+        // Catch up on turns added while the tab was in the background
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'visible') {
+                this.syncHistory();
+            }
+        });
+        
         // Focus on input when page loads
         this.messageInput.focus();
     }
@@ -85,7 +169,8 @@ class FlaskChatApp {
     
     async streamChatResponse(message) {
         this.isStreaming = true;
-        this.currentAssistantMessage = '';
+        this.cancelRequested = false;
+        this.showStopButton(true);
         
         // Create assistant message element
         const assistantMessageElement = this.createMessageElement('', 'assistant');
@@ -93,59 +178,293 @@ class FlaskChatApp {
         this.scrollToBottom();
         
         try {
-            const response = await fetch('/api/chat', {
+            // A new ID per submission: the server joins only repeats of the same
+            // submission, so sending the same text again gets a new answer
+            const requestId = this.newRequestId();
+            for (let attempt = 0; ; attempt++) {
+                const retryAfter = await this.requestAnswer(message, requestId, assistantMessageElement);
+                if (retryAfter === null) break;
+                
+                // No stream slot freed up in time: wait as long as the server asks
+                // and send the submission again, unless that is too long or cancelled
+                if (attempt >= this.maxBusyRetries || retryAfter > this.maxBusyWaitSeconds || this.cancelRequested) {
+                    this.updateMessageContent(assistantMessageElement, 'The server is busy. Please try again in a moment.');
+                    this.setStatus('disconnected');
+                    break;
+                }
+                this.updateMessageContent(assistantMessageElement, `The server is busy, retrying in ${retryAfter} s...`);
+                await new Promise((resolve) => {
+                    this.wakeRetry = resolve;
+                    setTimeout(resolve, retryAfter * 1000);
+                });
+                this.wakeRetry = null;
+                if (this.cancelRequested) {
+                    this.updateMessageContent(assistantMessageElement, 'Cancelled.');
+                    break;
+                }
+            }
+        } catch (error) {
+            console.error('Error streaming response:', error);
+            this.updateMessageContent(assistantMessageElement, 'Sorry, there was an error processing your request. Please try again.');
+            this.setStatus('disconnected');
+        } finally {
+            this.isStreaming = false;
+            this.showStopButton(false);
+        }
+    }
+    
+    async requestAnswer(message, requestId, assistantMessageElement) {
+        // Streams one attempt at an answer; returns the server's Retry-After
+        // (seconds) when it was too busy to answer, otherwise null
+        this.currentAssistantMessage = '';
+        this.retryAfter = null;
+        const renderer = new StreamingRenderer(assistantMessageElement, () => this.scrollToBottom());
+        
+        try {
+            let response = await fetch('/api/chat', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ message: message })
+                body: JSON.stringify({ message: message, request_id: requestId })
             });
             
+            if (response.status === 429 || response.status === 503) {
+                const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+                if (!isNaN(retryAfter)) return retryAfter;
+            }
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder();
-            
-            while (true) {
-                const { done, value } = await reader.read();
-                if (done) break;
-                
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
+            let lastEventId = null;
+            let finished = false;
+            for (let attempt = 0; ; attempt++) {
+                try {
+                    if (response) {
+                        finished = await this.readEvents(response, assistantMessageElement, renderer, (id) => { lastEventId = id; });
+                    }
+                } catch (error) {
+                    console.warn('Stream interrupted:', error);
+                }
+                if (finished || !lastEventId || attempt >= this.maxResumeAttempts) break;
                 
-                for (const line of lines) {
-                    if (line.startsWith('data: ')) {
-                        try {
-                            const data = JSON.parse(line.slice(6));
-                            
-                            if (data.type === 'chunk') {
-                                this.currentAssistantMessage += data.content;
-                                this.updateMessageContent(assistantMessageElement, this.currentAssistantMessage);
-                                this.scrollToBottom();
-                            } else if (data.type === 'complete') {
-                                this.setStatus('connected');
-                                this.addTimestamp(assistantMessageElement);
-                            } else if (data.type === 'error') {
-                                this.updateMessageContent(assistantMessageElement, data.content);
-                                this.setStatus('disconnected');
+                // The server keeps generating after a dropped connection;
+                // resume from the last received event instead of asking again
+                await new Promise((resolve) => setTimeout(resolve, 1000 * (attempt + 1)));
+                response = await fetch('/api/chat/stream', {
+                    headers: { 'Last-Event-ID': lastEventId }
+                }).catch(() => null);
+                if (response && !response.ok) break;
+            }
+            
+            if (!finished) {
+                throw new Error('Stream ended before the response completed');
+            }
+            return this.retryAfter;
+        } finally {
+            renderer.finish();
+        }
+    }
+    
+    newRequestId() {
+        // crypto.randomUUID is only available on secure origins (https, localhost)
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + Math.random().toString(36).slice(2);
+    }
+    
+    async readEvents(response, assistantMessageElement, renderer, onEventId) {
+        // Returns true once the stream has delivered its final event
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let finished = false;
+        
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            
+            // Events can be split across reads, so only parse complete ones
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            
+            for (const event of events) {
+                for (const line of event.split('\n')) {
+                    if (line.startsWith('id: ')) {
+                        onEventId(line.slice(4));
+                        continue;
+                    }
+                    if (!line.startsWith('data: ')) continue;
+                    try {
+                        const data = JSON.parse(line.slice(6));
+                        
+                        if (data.type === 'chunk') {
+                            this.currentAssistantMessage += data.content;
+                            renderer.append(data.content);
+                        } else if (data.type === 'complete') {
+                            // Format the whole answer once, now that it is complete
+                            renderer.finish();
+                            this.updateMessageContent(assistantMessageElement, this.currentAssistantMessage);
+                            if (data.turn_id !== undefined) {
+                                this.lastTurnId = data.turn_id;
                             }
-                        } catch (e) {
-                            console.error('Error parsing SSE data:', e);
+                            this.setStatus('connected');
+                            this.addTimestamp(assistantMessageElement);
+                            finished = true;
+                        } else if (data.type === 'error') {
+                            renderer.finish();
+                            this.updateMessageContent(assistantMessageElement, data.content);
+                            this.setStatus('disconnected');
+                            if (data.retry_after !== undefined) {
+                                // Queued behind the session's earlier messages, then not admitted
+                                this.retryAfter = data.retry_after;
+                            }
+                            finished = true;
                         }
+                    } catch (e) {
+                        console.error('Error parsing SSE data:', e);
                     }
                 }
             }
+        }
+        return finished;
+    }
+    
+    async cancelResponse() {
+        if (!this.isStreaming) return;
+        
+        // Stop waiting to resend a submission the server was too busy for
+        this.cancelRequested = true;
+        if (this.wakeRetry) this.wakeRetry();
+        
+        // The server stops generating and keeps the partial answer in history;
+        // the stream then ends with a normal completion event
+        try {
+            await fetch('/api/chat/cancel', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                }
+            });
         } catch (error) {
-            console.error('Error streaming response:', error);
-            this.updateMessageContent(assistantMessageElement, 'Sorry, there was an error processing your request. Please try again.');
-            this.setStatus('disconnected');
+            console.error('Error cancelling response:', error);
+        }
+    }
+    
+    async loadHistory() {
+        // Render the newest turns of an existing conversation (e.g. after a page reload)
+        try {
+            const response = await fetch(`/api/history?limit=${this.historyPageSize}`);
+            if (!response.ok) return;
+            
+            const data = await response.json();
+            this.renderTurns(data.history, false);
+            this.hasOlderTurns = data.has_more;
+            this.scrollToBottom();
+        } catch (error) {
+            console.error('Error loading history:', error);
+        }
+    }
+    
+    async loadOlderHistory() {
+        // Fetch the page of turns before the oldest rendered one
+        if (!this.hasOlderTurns || this.loadingHistory || this.oldestTurnId === null) return;
+        this.loadingHistory = true;
+        
+        try {
+            const response = await fetch(`/api/history?limit=${this.historyPageSize}&before=${this.oldestTurnId}`);
+            if (!response.ok) return;
+            
+            const data = await response.json();
+            if (data.reset) {
+                this.resetRenderedHistory(data);
+                return;
+            }
+            
+            // Keep the visible messages in place while older ones are inserted above
+            const previousHeight = this.messagesContainer.scrollHeight;
+            this.renderTurns(data.history, true);
+            this.hasOlderTurns = data.has_more;
+            this.messagesContainer.scrollTop += this.messagesContainer.scrollHeight - previousHeight;
+        } catch (error) {
+            console.error('Error loading older history:', error);
         } finally {
-            this.isStreaming = false;
+            this.loadingHistory = false;
+        }
+    }
+    
+    async syncHistory() {
+        // Fetch only the turns added after the last rendered one (e.g. from another tab)
+        if (this.isStreaming || this.lastTurnId === null) return;
+        
+        try {
+            let hasMore = true;
+            while (hasMore) {
+                const response = await fetch(`/api/history?limit=${this.historyPageSize}&since=${this.lastTurnId}`);
+                if (!response.ok) return;
+                
+                const data = await response.json();
+                if (data.reset) {
+                    this.resetRenderedHistory(data);
+                    return;
+                }
+                this.renderTurns(data.history, false);
+                hasMore = data.has_more && data.history.length > 0;
+            }
+            this.scrollToBottom();
+        } catch (error) {
+            console.error('Error syncing history:', error);
+        }
+    }
+    
+    resetRenderedHistory(data) {
+        // The conversation was cleared elsewhere: render the server's newest turns instead
+        this.removeRenderedMessages();
+        this.renderTurns(data.history, false);
+        this.hasOlderTurns = data.has_more;
+        this.scrollToBottom();
+    }
+    
+    renderTurns(turns, prepend) {
+        if (!turns.length) return;
+        
+        const fragment = document.createDocumentFragment();
+        for (const turn of turns) {
+            const text = typeof turn.content === 'string'
+                ? turn.content
+                : turn.content.map((part) => part.text || '').join('');
+            fragment.appendChild(this.createMessageElement(text, turn.role === 'user' ? 'user' : 'assistant'));
+        }
+        
+        if (prepend) {
+            // Older turns go right after the welcome message
+            this.messagesContainer.querySelector('.message').after(fragment);
+            this.oldestTurnId = turns[0].id;
+        } else {
+            this.messagesContainer.appendChild(fragment);
+            this.lastTurnId = turns[turns.length - 1].id;
+            if (this.oldestTurnId === null) {
+                this.oldestTurnId = turns[0].id;
+            }
         }
     }
     
+    removeRenderedMessages() {
+        // Remove all messages except the welcome message
+        const messages = this.messagesContainer.querySelectorAll('.message');
+        messages.forEach((message, index) => {
+            if (index > 0) { // Keep the first welcome message
+                message.remove();
+            }
+        });
+        this.lastTurnId = null;
+        this.oldestTurnId = null;
+        this.hasOlderTurns = false;
+    }
+    
     async clearConversation() {
         if (this.isStreaming) return;
         
@@ -158,13 +477,7 @@ class FlaskChatApp {
             });
             
             if (response.ok) {
-                // Clear all messages except the welcome message
-                const messages = this.messagesContainer.querySelectorAll('.message');
-                messages.forEach((message, index) => {
-                    if (index > 0) { // Keep the first welcome message
-                        message.remove();
-                    }
-                });
+                this.removeRenderedMessages();
                 
                 this.messageInput.focus();
             }
@@ -282,6 +595,11 @@ class FlaskChatApp {
         this.messageInput.disabled = !enabled;
     }
     
+    showStopButton(show) {
+        this.stopButton.style.display = show ? 'flex' : 'none';
+        this.sendButton.style.display = show ? 'none' : 'flex';
+    }
+    
     showTypingIndicator(show) {
         this.typingIndicator.style.display = show ? 'block' : 'none';
         if (show) {
@@ -304,5 +622,7 @@ class FlaskChatApp {
 
 // Initialize the chat app when the page loads
 document.addEventListener('DOMContentLoaded', () => {
+    // Pages without the chat UI (e.g. benchmarks/render_benchmark.html) only use the classes
+    if (!document.getElementById('chatMessages')) return;
     new FlaskChatApp();
 });
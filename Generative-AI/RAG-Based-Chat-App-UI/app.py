@@ -1,8 +1,15 @@
 from flask import Flask, render_template, request, jsonify, Response, session
 import os
-import json
+import time
 import uuid
+import threading
 from backend.chat_service import ChatService
+from backend.session_store import create_session_store
+from backend.static_assets import StaticAssets
+from backend.sse import coalesce
+from backend.admission import AdmissionRejected, ConcurrencyLimiter, TokenBucketLimiter
+from backend.drain import Drain
+from backend.stream_registry import StreamRegistry, follow, request_key, until_cancelled
 from flask_cors import CORS
 
 app = Flask(__name__, 
@@ -11,24 +18,95 @@ app = Flask(__name__,
 CORS(app)
 
 # Secret key for session management
-app.secret_key = os.urandom(24)
+# (set SECRET_KEY when running several workers so they all accept the same session cookie)
+app.secret_key = os.getenv("SECRET_KEY") or os.urandom(24)
 
-# Initialize chat service
+# Initialize chat service (the Azure OpenAI client is created on first use;
+# PREWARM=true creates it and opens a connection in the background at startup)
 chat_service = ChatService()
+if os.getenv("PREWARM", "false").lower() == "true":
+    threading.Thread(target=chat_service.warm_up, daemon=True).start()
+chat_service.start_keep_warm()
 
-# Store conversation histories (in production, use a database)
-conversation_histories = {}
+# Store conversation histories (bounded by SESSION_* environment variables)
+session_store = create_session_store()
+
+# Streamed tokens are coalesced into SSE frames: the first token is sent at once,
+# then a frame is flushed every SSE_FLUSH_INTERVAL_MS or SSE_FLUSH_BYTES, whichever comes first
+sse_flush_interval_ms = int(os.getenv("SSE_FLUSH_INTERVAL_MS", "50"))
+sse_flush_bytes = int(os.getenv("SSE_FLUSH_BYTES", "256"))
+
+# In-flight generations. A session's messages are answered one at a time, in order,
+# and an answer stops as soon as no client is connected to it
+active_streams = StreamRegistry(resume_ttl=0, resume_grace=0)
+
+# Admission control: a global limit on concurrent streams with a bounded wait queue,
+# and a per-session token bucket (0 disables either limit)
+chat_limiter = ConcurrencyLimiter(
+    max_concurrent=int(os.getenv("CHAT_MAX_CONCURRENT_STREAMS", "32")),
+    max_queue=int(os.getenv("CHAT_MAX_QUEUE", "64")),
+    queue_timeout=float(os.getenv("CHAT_QUEUE_TIMEOUT_SECONDS", "30")),
+    wait_histogram=chat_service.metrics.queue_wait,
+)
+rate_limiter = TokenBucketLimiter(
+    rate_per_minute=float(os.getenv("CHAT_RATE_PER_MINUTE", "20")),
+    burst=int(os.getenv("CHAT_RATE_BURST", "5")),
+)
+
+# Graceful shutdown: on SIGTERM (gunicorn.conf.py, run.py --fast) new chat streams are
+# refused with 503 while running answers get DRAIN_TIMEOUT_SECONDS to finish; answers
+# still running then are stopped and keep what they have
+drain = Drain(
+    timeout=float(os.getenv("DRAIN_TIMEOUT_SECONDS", "25")),
+    pending=active_streams.active_count,
+    stop=active_streams.cancel_all,
+)
+
+# Fingerprinted, precompressed static files written by build_static.py
+# (templates fall back to the plain /static/ files until it has been run)
+static_assets = StaticAssets(os.path.join(app.root_path, 'frontend', 'dist'))
+
+# Application gauges reported next to the stream metrics at /metrics
+chat_service.metrics.gauge('chat_sessions', 'Conversation sessions held by the session store',
+                           lambda: session_store.stats()['sessions'])
+chat_service.metrics.gauge('chat_queue_depth', 'Requests waiting for a free stream slot',
+                           lambda: chat_limiter.waiting)
+chat_service.metrics.gauge('chat_session_queued_turns', 'Messages waiting for an earlier message of their session',
+                           active_streams.queued_count)
+duplicate_requests = chat_service.metrics.registry.counter(
+    'chat_duplicate_requests_total', 'Chat requests joined to the answer already running for the same request ID',
+)
 
 @app.route('/')
 def index():
     """Serve the main chat interface"""
     # Generate a unique session ID for the user
+    # (history is created lazily on the first message)
     if 'session_id' not in session:
         session['session_id'] = str(uuid.uuid4())
-        conversation_histories[session['session_id']] = []
     
     return render_template('index.html')
 
+@app.context_processor
+def inject_asset_url():
+    """
+    Templates link static files with asset_url('style.css'); in debug mode
+    they get the plain files, so edits show up without rebuilding
+    """
+    return {'asset_url': static_assets.plain_url if app.debug else static_assets.url}
+
+@app.route('/assets/<path:filename>')
+def assets(filename):
+    """
+    Fingerprinted static files: the brotli or gzip variant the client accepts,
+    cached by browsers for a year (the name changes whenever the content does)
+    """
+    asset = static_assets.get(filename, request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+    status, body, headers = asset
+    return Response(body, status=status, headers=headers)
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """
@@ -37,70 +115,221 @@ def chat():
     try:
         data = request.get_json()
         user_message = data.get('message', '').strip()
+        # Optional ID of this submission; a retry with the same ID joins its answer
+        key = request_key(data.get('request_id'))
         
         if not user_message:
             return jsonify({'error': 'Message cannot be empty'}), 400
         
         # Get or create session
         session_id = session.get('session_id')
-        if session_id not in conversation_histories:
-            conversation_histories[session_id] = []
+        if not session_id:
+            session_id = session['session_id'] = str(uuid.uuid4())
+        
+        # A repeated submission (same request ID) of a message still being
+        # answered follows that answer instead of asking again
+        generation = active_streams.find(session_id, key)
+        if generation is not None:
+            duplicate_requests.inc()
+            return event_stream_response(follow(generation))
+        
+        if drain.draining:
+            return draining_response()
+        
+        # Fast rejections: per-session rate limit, then a full wait queue
+        try:
+            rate_limiter.acquire(session_id)
+            chat_limiter.check()
+        except AdmissionRejected as e:
+            return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+        
+        # Generate in the background; this response and any repeated submissions
+        # follow the generation's event buffer
+        generation, started = active_streams.start(session_id, key)
+        if not started:
+            duplicate_requests.inc()
+            return event_stream_response(follow(generation))
         
+        # A message that can run now waits for its stream slot before the
+        # response starts, so a queue timeout is a 429 with Retry-After; one
+        # queued behind the session's earlier messages is admitted when its turn comes
+        admitted_at = None
+        if generation.turn.is_set():
+            try:
+                admitted_at = admit(generation)
+            except AdmissionRejected as e:
+                return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+        threading.Thread(target=generate_answer, args=(session_id, generation, user_message, admitted_at),
+                         daemon=True).start()
+        return event_stream_response(follow(generation))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def admit(generation):
+    """
+    Wait for a free stream slot (bounded queue and wait time) and return when
+    it was granted. When none frees up in time the generation ends with an
+    error event carrying the Retry-After hint, and AdmissionRejected is re-raised.
+    """
+    try:
+        chat_limiter.acquire()
+    except AdmissionRejected as e:
+        generation.emit({'content': f'Error: {str(e)}', 'type': 'error', 'retry_after': e.retry_after})
+        active_streams.finish(generation)
+        raise
+    return time.monotonic()
+
+def generate_answer(session_id, generation, user_message, admitted_at=None):
+    """
+    Stream one answer from Azure OpenAI into the generation's event buffer
+    (admitted_at: when chat() already took its stream slot)
+    """
+    if admitted_at is None:
+        # Wait until the session's earlier messages are answered, so each turn
+        # reads the history the previous one wrote
+        generation.turn.wait()
+        if generation.stopped():
+            # Cancelled (or left by every client) before it started
+            generation.emit({'type': 'complete', 'cancelled': True})
+            active_streams.finish(generation)
+            return
+        try:
+            admitted_at = admit(generation)
+        except AdmissionRejected:
+            return
+    
+    assistant_response = ""
+    saved = False
+    chunks = None
+    try:
         # Add user message to conversation history
         user_msg = chat_service.format_user_message(user_message)
-        conversation_histories[session_id].append(user_msg)
+        session_store.append(session_id, user_msg)
         
-        def generate():
-            assistant_response = ""
-            try:
-                for chunk in chat_service.stream_chat_response(conversation_histories[session_id]):
-                    assistant_response += chunk
-                    # Send each chunk as Server-Sent Event
-                    yield f"data: {json.dumps({'content': chunk, 'type': 'chunk'})}\n\n"
-                
-                # Add assistant response to conversation history
-                assistant_msg = chat_service.format_assistant_message(assistant_response)
-                conversation_histories[session_id].append(assistant_msg)
-                
-                # Send completion signal
-                yield f"data: {json.dumps({'type': 'complete'})}\n\n"
-                
-            except Exception as e:
-                yield f"data: {json.dumps({'content': f'Error: {str(e)}', 'type': 'error'})}\n\n"
+        # Brochure chunks for the question (RETRIEVAL_MODE=local; otherwise
+        # Azure AI Search retrieves them during the completion call), or
+        # a cached answer to a question that means the same
+        history = session_store.get(session_id)
+        retrieval = chat_service.retrieve(history)
+        chunks = chat_service.stream_chat_response(history, retrieval)
+        for chunk in coalesce(until_cancelled(chunks, generation), sse_flush_interval_ms, sse_flush_bytes):
+            assistant_response += chunk
+            # Send coalesced chunks as Server-Sent Events
+            generation.emit({'content': chunk, 'type': 'chunk'})
         
-        return Response(
-            generate(),
-            mimetype='text/plain',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'Access-Control-Allow-Origin': '*',
-            }
-        )
+        # Add assistant response (partial if cancelled) to conversation history
+        assistant_msg = chat_service.format_assistant_message(assistant_response)
+        turn_id = session_store.append(session_id, assistant_msg)
+        saved = True
+        
+        # Send completion signal
+        complete = {'type': 'complete', 'turn_id': turn_id}
+        if retrieval is not None:
+            complete['retrieval'] = retrieval.summary()
+        if generation.stopped():
+            complete['cancelled'] = True
+        generation.emit(complete)
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        generation.emit({'content': f'Error: {str(e)}', 'type': 'error'})
+    finally:
+        try:
+            # Close the upstream stream (it stops early when the generation is
+            # cancelled or abandoned) and keep what was already streamed
+            if chunks is not None:
+                chunks.close()
+            if assistant_response and not saved:
+                session_store.append(session_id, chat_service.format_assistant_message(assistant_response))
+        finally:
+            # Always let the session's next message run
+            active_streams.finish(generation)
+            chat_limiter.release(time.monotonic() - admitted_at)
+
+def event_stream_response(frames):
+    return Response(
+        drain.track(frames),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no',
+            'Access-Control-Allow-Origin': '*',
+        }
+    )
+
+def draining_response():
+    # Connection: close, so the client's retry opens a connection to another worker
+    return jsonify({'error': 'Server is restarting, please retry'}), 503, {'Retry-After': '1', 'Connection': 'close'}
+
+def shutdown():
+    """Drain (unless already draining) and flush session state; called when the worker exits"""
+    drain.begin()
+    drain.wait()
+    session_store.close()
+
+@app.route('/api/chat/cancel', methods=['POST'])
+def cancel_chat():
+    """Stop the session's in-flight generation (the partial answer is kept in history)"""
+    session_id = session.get('session_id')
+    cancelled = active_streams.cancel(session_id) if session_id else 0
+    return jsonify({'status': 'success', 'cancelled': cancelled})
 
 @app.route('/api/clear', methods=['POST'])
 def clear_conversation():
     """Clear the conversation history"""
     session_id = session.get('session_id')
-    if session_id in conversation_histories:
-        conversation_histories[session_id] = []
+    if session_id:
+        session_store.clear(session_id)
     return jsonify({'status': 'success'})
 
 @app.route('/api/history')
 def get_history():
-    """Get conversation history"""
+    """
+    Get conversation history. Turns carry stable IDs for incremental reads:
+    ?limit=N returns the newest N turns, &before=<id> the page before that turn,
+    and ?since=<id> only the turns after it. `reset` is true when the given turn
+    no longer exists (history cleared), in which case the newest turns are returned.
+    """
+    since = request.args.get('since', type=int)
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+    
     session_id = session.get('session_id')
-    if session_id in conversation_histories:
-        return jsonify({'history': conversation_histories[session_id]})
-    return jsonify({'history': []})
+    if not session_id:
+        return jsonify({'history': [], 'has_more': False, 'reset': False})
+    
+    page = session_store.get_turns(session_id, after=since, before=before, limit=limit)
+    reset = page is None
+    if reset:
+        page = session_store.get_turns(session_id, limit=limit)
+    turns, has_more = page
+    return jsonify({
+        'history': [{'id': turn_id, **message} for turn_id, message in turns],
+        'has_more': has_more,
+        'reset': reset,
+    })
 
 @app.route('/api/health')
 def health_check():
-    """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'service': 'Flask AI Chat Application'})
+    """Health check endpoint (503 while draining, so load balancers stop sending traffic)"""
+    return jsonify({
+        'status': 'draining' if drain.draining else 'healthy',
+        'service': 'Flask AI Chat Application',
+        'sessions': session_store.stats(),
+        'admission': chat_limiter.stats(),
+        'rate_limit': rate_limiter.stats(),
+        'upstream': chat_service.upstream.stats(),
+        'retrieval': chat_service.retrieval_stats(),
+        'drain': drain.stats(),
+    }), 503 if drain.draining else 200
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics: time to first token, stream latency, throughput and active streams"""
+    return Response(chat_service.metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=5000, debug=True)
@@ -0,0 +1,231 @@
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+
+class AdmissionRejected(Exception):
+    """Raised when a chat request is not admitted; carries a Retry-After hint in seconds"""
+
+    def __init__(self, message, reason, retry_after):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _ConcurrencyStats:
+    """Counters shared by the thread and asyncio concurrency limiters"""
+
+    def __init__(self, max_concurrent, max_queue, queue_timeout, wait_histogram=None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # Optional histogram (labelled by outcome) of the time spent waiting for a slot
+        self.wait_histogram = wait_histogram
+
+        self.active = 0
+        self.waiting = 0
+        self._admitted = 0
+        self._rejected = {'queue_full': 0, 'timeout': 0}
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+        self._avg_hold_seconds = 1.0
+
+    def _saturated(self):
+        return self.active >= self.max_concurrent and self.waiting >= self.max_queue
+
+    def _retry_after(self):
+        """Estimate when a slot frees up from the average time streams hold one"""
+        queued = self.waiting / self.max_concurrent if self.max_concurrent else 0
+        return max(1, math.ceil(self._avg_hold_seconds * (1 + queued)))
+
+    def _reject(self, reason, wait_seconds=None):
+        self._rejected[reason] += 1
+        if wait_seconds is not None and self.wait_histogram is not None:
+            self.wait_histogram.observe(wait_seconds, outcome=reason)
+        message = 'Server is busy, please retry shortly' if reason == 'queue_full' else 'Timed out waiting for a free stream slot'
+        return AdmissionRejected(message, reason, self._retry_after())
+
+    def _admit(self, wait_seconds):
+        self.active += 1
+        self._admitted += 1
+        self._wait_seconds_total += wait_seconds
+        self._wait_seconds_max = max(self._wait_seconds_max, wait_seconds)
+        if self.wait_histogram is not None:
+            self.wait_histogram.observe(wait_seconds, outcome='admitted')
+
+    def _release(self, hold_seconds):
+        self.active -= 1
+        # Exponentially weighted average, used for Retry-After estimates
+        self._avg_hold_seconds = 0.9 * self._avg_hold_seconds + 0.1 * hold_seconds
+
+    def _stats(self):
+        return {
+            'active': self.active,
+            'queue_depth': self.waiting,
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'admitted': self._admitted,
+            'rejected': dict(self._rejected),
+            'wait_seconds_total': round(self._wait_seconds_total, 6),
+            'wait_seconds_max': round(self._wait_seconds_max, 6),
+        }
+
+
+class ConcurrencyLimiter(_ConcurrencyStats):
+    """
+    Global limit on concurrent chat streams for threaded (WSGI) servers.
+    Requests beyond the limit wait in a bounded queue for up to queue_timeout
+    seconds; when the queue is full they are rejected immediately.
+    max_concurrent=0 disables the limit. Waits are observed in wait_histogram
+    when one is given.
+    """
+
+    def __init__(self, max_concurrent=32, max_queue=64, queue_timeout=30, wait_histogram=None):
+        super().__init__(max_concurrent, max_queue, queue_timeout, wait_histogram)
+        self._condition = threading.Condition()
+
+    def check(self):
+        """Fast rejection before a response is started: raise AdmissionRejected if the queue is full"""
+        if not self.max_concurrent:
+            return
+        with self._condition:
+            if self._saturated():
+                raise self._reject('queue_full')
+
+    def acquire(self):
+        """Wait for a free slot; return the time waited in seconds"""
+        if not self.max_concurrent:
+            return 0.0
+        start = time.monotonic()
+        with self._condition:
+            if self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    raise self._reject('queue_full')
+                self.waiting += 1
+                try:
+                    admitted = self._condition.wait_for(
+                        lambda: self.active < self.max_concurrent, self.queue_timeout or None
+                    )
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    raise self._reject('timeout', time.monotonic() - start)
+            wait_seconds = time.monotonic() - start
+            self._admit(wait_seconds)
+        return wait_seconds
+
+    def release(self, hold_seconds):
+        if not self.max_concurrent:
+            return
+        with self._condition:
+            self._release(hold_seconds)
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return self._stats()
+
+
+class AsyncConcurrencyLimiter(_ConcurrencyStats):
+    """
+    Async version of ConcurrencyLimiter for the ASGI server (one event loop per worker)
+    """
+
+    def __init__(self, max_concurrent=256, max_queue=512, queue_timeout=30, wait_histogram=None):
+        super().__init__(max_concurrent, max_queue, queue_timeout, wait_histogram)
+        self._condition = None
+
+    def check(self):
+        if self.max_concurrent and self._saturated():
+            raise self._reject('queue_full')
+
+    async def acquire(self):
+        if not self.max_concurrent:
+            return 0.0
+        if self._condition is None:
+            # Created lazily so it binds to the server's running event loop
+            self._condition = asyncio.Condition()
+        start = time.monotonic()
+        async with self._condition:
+            if self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    raise self._reject('queue_full')
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(
+                        self._condition.wait_for(lambda: self.active < self.max_concurrent),
+                        self.queue_timeout or None,
+                    )
+                except asyncio.TimeoutError:
+                    raise self._reject('timeout', time.monotonic() - start)
+                finally:
+                    self.waiting -= 1
+            wait_seconds = time.monotonic() - start
+            self._admit(wait_seconds)
+        return wait_seconds
+
+    async def release(self, hold_seconds):
+        if not self.max_concurrent:
+            return
+        async with self._condition:
+            self._release(hold_seconds)
+            self._condition.notify()
+
+    def stats(self):
+        return self._stats()
+
+
+class TokenBucketLimiter:
+    """
+    Per-session token bucket: each session may start `burst` chats at once and
+    then `rate_per_minute` chats per minute. Idle buckets refill to full and are
+    dropped, so memory stays proportional to recently active sessions.
+    rate_per_minute=0 disables the limit.
+    """
+
+    def __init__(self, rate_per_minute=20, burst=5):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._allowed = 0
+        self._rejected = 0
+
+    def acquire(self, key):
+        """Take one token for key, or raise AdmissionRejected with the time until one is available"""
+        if not self.rate:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._drop_full_buckets(now)
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self._rejected += 1
+                retry_after = max(1, math.ceil((1 - tokens) / self.rate))
+                raise AdmissionRejected('Too many messages, please slow down', 'rate_limited', retry_after)
+            self._buckets[key] = (tokens - 1, now)
+            self._allowed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked_sessions': len(self._buckets),
+                'rate_per_minute': round(self.rate * 60, 3),
+                'burst': self.burst,
+                'allowed': self._allowed,
+                'rejected': self._rejected,
+            }
+
+    def _drop_full_buckets(self, now):
+        """Buckets are kept in last-use order; any idle long enough to be full can go"""
+        refill_seconds = self.burst / self.rate
+        while self._buckets:
+            key, (tokens, updated) = next(iter(self._buckets.items()))
+            if now - updated < refill_seconds:
+                break
+            del self._buckets[key]
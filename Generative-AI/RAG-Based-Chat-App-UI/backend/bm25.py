@@ -0,0 +1,68 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lowercased word tokens; "Margie's" gives margie and s, "Las Vegas" gives las and vegas"""
+    return TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 keyword scoring over an inverted index. The postings of each
+    term are stored contiguously (document ids and their precomputed BM25
+    weights, in CSR layout), so scoring a query is one np.bincount over the
+    postings of its terms: no per-document Python loop, and only documents
+    that contain a query term are touched.
+    """
+
+    def __init__(self, texts, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = len(texts)
+
+        vocabulary = {}
+        term_ids, doc_ids, frequencies = [], [], []
+        lengths = np.zeros(self.size, dtype=np.float32)
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[doc] = len(tokens)
+            counts = Counter(tokens)
+            term_ids.extend(vocabulary.setdefault(token, len(vocabulary)) for token in counts)
+            doc_ids.extend([doc] * len(counts))
+            frequencies.extend(counts.values())
+        self.vocabulary = vocabulary
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind='stable')
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)[order]
+        frequencies = np.asarray(frequencies, dtype=np.float32)[order]
+        document_frequency = np.bincount(term_ids, minlength=len(vocabulary))
+        self.offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(document_frequency, out=self.offsets[1:])
+
+        # idf as in Lucene (never negative); weight = idf * tf * (k1 + 1) / (tf + k1 * length norm)
+        idf = np.log1p((self.size - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        average_length = float(lengths.mean()) if self.size else 0.0
+        norm = k1 * (1 - b + b * lengths[self.doc_ids] / (average_length or 1.0))
+        self.weights = (np.repeat(idf, document_frequency) * frequencies * (k1 + 1) / (frequencies + norm)).astype(np.float32)
+
+    def __len__(self):
+        return self.size
+
+    def scores(self, query):
+        """BM25 score of the query text against every document (0 where no term matches)"""
+        terms = {self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary}
+        if not terms:
+            return np.zeros(self.size, dtype=np.float32)
+        slices = [slice(self.offsets[term], self.offsets[term + 1]) for term in terms]
+        doc_ids = np.concatenate([self.doc_ids[s] for s in slices])
+        weights = np.concatenate([self.weights[s] for s in slices])
+        return np.bincount(doc_ids, weights=weights, minlength=self.size).astype(np.float32)
+
+    def stats(self):
+        return {'terms': len(self.vocabulary), 'postings': len(self.doc_ids)}
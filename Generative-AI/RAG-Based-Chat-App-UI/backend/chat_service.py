@@ -1,11 +1,25 @@
 import os
 import json
-from openai import AzureOpenAI
+import time
+import threading
 from dotenv import load_dotenv
+from .metrics import ChatMetrics
+from .upstream import UpstreamPool
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Retrieval latency buckets (seconds)
+RETRIEVAL_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+# Rewrites a follow-up question for the semantic cache (SEMANTIC_CACHE_CONDENSE=true)
+CONDENSE_PROMPT = (
+    "Rewrite the user's last message as a standalone question that can be understood "
+    "without the conversation. Reply with the question only."
+)
+# Recent messages sent along with CONDENSE_PROMPT
+CONDENSE_HISTORY_MESSAGES = 6
+
 class ChatService:
     def __init__(self):
         self.endpoint = os.getenv("ENDPOINT_URL", "")
@@ -15,13 +29,12 @@ class ChatService:
         self.search_endpoint = os.getenv("SEARCH_ENDPOINT", "")
         self.search_key = os.getenv("SEARCH_KEY", "")
         self.index_name = os.getenv("INDEX_NAME", "")
+        # vector, or e.g. vector_simple_hybrid to combine keyword and vector search in Azure AI Search
+        self.search_query_type = os.getenv("SEARCH_QUERY_TYPE", "vector")
 
-        # Initialize Azure OpenAI client
-        self.client = AzureOpenAI(
-            azure_endpoint=self.endpoint,
-            api_key=self.subscription_key,
-            api_version="2025-01-01-preview",
-        )
+        # Azure OpenAI client, created on first use (see the client property)
+        self._client = None
+        self._client_lock = threading.Lock()
         
         # System message that stays constant
         #self.system_message = {
@@ -32,22 +45,175 @@ class ChatService:
             "role": "system",
             "content": "You are a travel assistant that provides information on travel services."            
         }
+        
+        # Latency and throughput metrics for streamed responses (served at /metrics)
+        self.metrics = ChatMetrics()
+        
+        # One tuned connection pool shared by all upstream requests; when no request
+        # was made for UPSTREAM_PING_INTERVAL_SECONDS, a cheap ping keeps a connection open
+        self.upstream = UpstreamPool(
+            self.metrics,
+            max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100")),
+            max_keepalive=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("UPSTREAM_KEEPALIVE_SECONDS", "120")),
+        )
+        self.ping_interval = float(os.getenv("UPSTREAM_PING_INTERVAL_SECONDS", "0"))
+        self._keep_warm = None
+        self._stopping = threading.Event()
+        
+        # RETRIEVAL_MODE=azure_search (default) lets Azure OpenAI query the Azure AI Search
+        # index; local retrieves chunks of the documents in RAG_DATA_DIR in-process
+        # and adds them to the prompt, without the extra service round trip
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "azure_search").lower()
+        self.retriever = None
+        self.semantic_cache = None
+        if self.retrieval_mode == "local":
+            from .retrieval import create_retriever
+            from .semantic_cache import SemanticCache
+            self.retriever = create_retriever(lambda: self.client, self.metrics.registry)
+            
+            # Answers to earlier standalone questions, found by embedding similarity
+            # (SEMANTIC_CACHE_MAX_ENTRIES=0 disables)
+            semantic_cache = SemanticCache(
+                max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000")),
+                threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+                ttl_seconds=int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600")),
+            )
+            self.semantic_cache = semantic_cache if semantic_cache.enabled else None
+            self.condense_questions = os.getenv("SEMANTIC_CACHE_CONDENSE", "false").lower() == "true"
+            self.semantic_cache_lookups = self.metrics.registry.counter(
+                'chat_semantic_cache_lookups_total', 'Questions looked up in the semantic answer cache, by result', ('result',)
+            )
+        elif self.retrieval_mode != "azure_search":
+            raise ValueError(f"Unknown RETRIEVAL_MODE: {self.retrieval_mode}")
+        self.retrieval_seconds = self.metrics.registry.histogram(
+            'chat_retrieval_seconds', 'Time to retrieve document chunks for a question (RETRIEVAL_MODE=local)',
+            RETRIEVAL_BUCKETS,
+        )
+    
+    @property
+    def client(self):
+        """
+        Azure OpenAI client, created on first use so that importing the app
+        (and a worker's cold start) does not pay for importing openai
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self.create_client()
+        return self._client
     
-    def create_chat_prompt(self, conversation_history):
+    def create_client(self):
         """
-        Create chat prompt with system message and conversation history
+        Create the Azure OpenAI client used for chat completions
+        """
+        from openai import AzureOpenAI
+        
+        return AzureOpenAI(
+            azure_endpoint=self.endpoint,
+            api_key=self.subscription_key,
+            api_version="2025-01-01-preview",
+            http_client=self.upstream.http_client(),
+        )
+    
+    def create_chat_prompt(self, conversation_history, retrieval=None):
+        """
+        Create chat prompt with system message and conversation history.
+        Retrieved chunks go in a system message just before the latest
+        question, so the rest of the prompt is the same from turn to turn.
         """
         chat_prompt = [self.system_message]
-        chat_prompt.extend(conversation_history)
+        if retrieval is None:
+            chat_prompt.extend(conversation_history)
+        else:
+            chat_prompt.extend(conversation_history[:-1])
+            chat_prompt.append({"role": "system", "content": retrieval.context()})
+            chat_prompt.extend(conversation_history[-1:])
         return chat_prompt
     
-    def stream_chat_response(self, conversation_history):
+    def retrieve(self, conversation_history):
+        """
+        Retrieve the document chunks for the latest question in local retrieval
+        mode (None with Azure AI Search, which retrieves during the completion call).
+        A standalone question close enough to one answered before gets that
+        answer and its sources from the semantic cache instead (retrieval.answer).
+        """
+        if self.retriever is None:
+            return None
+        started = time.perf_counter()
+        question = conversation_history[-1]['content']
+        standalone = self.standalone_question(conversation_history) if self.semantic_cache is not None else None
+        
+        retrieval = None
+        vector = version = None
+        if standalone is not None:
+            question = standalone
+            version = self.retriever.version
+            vector = self.retriever.embed_query(question)
+            hit = self.semantic_cache.get(vector, version)
+            self.semantic_cache_lookups.inc(result='hit' if hit is not None else 'miss')
+            if hit is not None:
+                retrieval = self.retriever.cached_retrieval(question, hit)
+        if retrieval is None:
+            retrieval = self.retriever.retrieve(question, query_vector=vector)
+            retrieval.vector, retrieval.version = vector, version
+        
+        retrieval.seconds = time.perf_counter() - started
+        self.retrieval_seconds.observe(retrieval.seconds)
+        return retrieval
+    
+    def standalone_question(self, conversation_history):
         """
-        Stream chat response from Azure OpenAI
+        The latest question in a form that does not depend on the conversation:
+        the question itself when it opens the conversation, otherwise (with
+        SEMANTIC_CACHE_CONDENSE=true) a rewrite by the model. None for a
+        follow-up that is not condensed; it is neither looked up nor cached.
         """
+        question = conversation_history[-1]['content']
+        if len(conversation_history) == 1:
+            return question
+        if not self.condense_questions:
+            return None
         try:
+            response = self.client.chat.completions.create(
+                model=self.deployment,
+                messages=[{"role": "system", "content": CONDENSE_PROMPT},
+                          *conversation_history[-CONDENSE_HISTORY_MESSAGES:]],
+                max_tokens=100,
+                temperature=0,
+            )
+            return (response.choices[0].message.content or "").strip() or None
+        except Exception:
+            # Answer without the cache rather than fail the question
+            return None
+    
+    def retrieval_stats(self):
+        if self.retriever is None:
+            return {'mode': self.retrieval_mode, 'index_name': self.index_name, 'query_type': self.search_query_type}
+        stats = self.retriever.stats()
+        stats['semantic_cache'] = self.semantic_cache.stats() if self.semantic_cache is not None else None
+        return stats
+    
+    def stream_chat_response(self, conversation_history, retrieval=None):
+        """
+        Stream chat response from Azure OpenAI, grounded on the Azure AI Search
+        index or, in local retrieval mode, on the chunks from retrieve().
+        Closing the generator early closes the upstream stream, so generation stops.
+        """
+        stream = self.metrics.stream()
+        response = None
+        try:
+            # Replay an answer from the semantic cache chunk by chunk, like a live stream
+            if retrieval is not None and retrieval.answer is not None:
+                stream.source = 'cache'
+                for content in retrieval.answer:
+                    stream.chunk(content)
+                    yield content
+                stream.complete()
+                return
+            
             # Additional parameters to apply RAG pattern using the AI Search index
-            rag_params = {
+            rag_params = None if self.retriever is not None else {
                 "data_sources": [
                     {
                         # he following params are used to search the index
@@ -60,7 +226,7 @@ class ChatService:
                             "key": self.search_key,
                         },
                         # The following params are used to vectorize the query
-                        "query_type": "vector",
+                        "query_type": self.search_query_type,
                         "embedding_dependency": {
                             "type": "deployment_name",
                             "deployment_name": self.embedding_model,
@@ -70,7 +236,7 @@ class ChatService:
                 ],
             }
 
-            messages = self.create_chat_prompt(conversation_history)
+            messages = self.create_chat_prompt(conversation_history, retrieval)
             
             response = self.client.chat.completions.create(
                 model=self.deployment,
@@ -85,13 +251,26 @@ class ChatService:
                 stream=True
             )
             
+            chunks = []
             for update in response:
                 if update.choices and update.choices[0].delta.content:
                     content = update.choices[0].delta.content
+                    chunks.append(content)
+                    stream.chunk(content)
                     yield content
+            stream.complete()
+            
+            # Only complete answers to standalone questions are cached
+            if retrieval is not None and retrieval.vector is not None:
+                self.semantic_cache.put(retrieval.vector, retrieval.version, retrieval.query, retrieval.results, chunks)
                     
         except Exception as e:
+            stream.fail()
             yield f"Error: {str(e)}"
+        finally:
+            stream.finish()
+            if response is not None:
+                response.close()
     
     def format_user_message(self, user_input):
         """
@@ -111,7 +290,48 @@ class ChatService:
             "content": assistant_response
         }
     
+    def warm_up(self):
+        """
+        Create the client and open a pooled connection to the endpoint (and
+        build the local retrieval index), so the first chat request does not pay for them
+        """
+        self.ping()
+        if self.retriever is not None:
+            self.retriever.build()
+    
+    def ping(self):
+        """
+        Cheap request (list models, no tokens used) that opens or refreshes a pooled connection
+        """
+        try:
+            self.client.with_options(max_retries=0, timeout=10).models.list()
+        except Exception:
+            # Any response, even an error status, leaves a connection in the pool
+            pass
+    
+    def start_keep_warm(self):
+        """
+        Ping the endpoint in the background whenever no upstream request was made
+        for UPSTREAM_PING_INTERVAL_SECONDS (no-op when the interval is 0)
+        """
+        if not self.ping_interval or self._keep_warm is not None:
+            return
+        self._keep_warm = threading.Thread(target=self._keep_warm_loop, name='upstream-keep-warm', daemon=True)
+        self._keep_warm.start()
+    
+    def _keep_warm_loop(self):
+        while True:
+            wait = self.ping_interval - self.upstream.idle_seconds()
+            if wait <= 0:
+                self.ping()
+                wait = self.ping_interval
+            if self._stopping.wait(wait):
+                return
+    
     def close(self):
-        """Close the OpenAI client"""
-        if hasattr(self.client, 'close'):
-            self.client.close()
+        """Stop the keep-warm pings and the retrieval watcher, and close the OpenAI client (if it was created)"""
+        self._stopping.set()
+        if self.retriever is not None:
+            self.retriever.close()
+        if self._client is not None:
+            self._client.close()
@@ -0,0 +1,66 @@
+import os
+
+# Documents read from the data directory; PDFs need the pypdf package
+DOCUMENT_EXTENSIONS = ('.pdf', '.txt', '.md')
+
+
+class Chunk:
+    """A passage of a source document: the unit that is embedded, retrieved and cited"""
+
+    __slots__ = ('id', 'source', 'page', 'text')
+
+    def __init__(self, id, source, page, text):
+        self.id = id
+        self.source = source
+        self.page = page
+        self.text = text
+
+
+def document_paths(directory):
+    """Supported documents under directory, in a stable order (hidden files and folders are skipped)"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+        for name in sorted(files):
+            if not name.startswith('.') and name.lower().endswith(DOCUMENT_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return paths
+
+
+def read_pages(path):
+    """Text of each page of a PDF, or the whole text of a .txt / .md file as one page"""
+    if path.lower().endswith('.pdf'):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise ImportError("Reading PDFs for RETRIEVAL_MODE=local requires the pypdf package: pip install pypdf")
+        return [page.extract_text() or '' for page in PdfReader(path).pages]
+    with open(path, 'r', encoding='utf-8') as f:
+        return [f.read()]
+
+
+def split_words(text, chunk_words=120, overlap_words=30):
+    """
+    Split text into windows of chunk_words words, each sharing overlap_words
+    with the one before, so a sentence cut at a boundary is whole in one of them.
+    Whitespace (including the line breaks of PDF columns) is collapsed.
+    """
+    words = text.split()
+    step = max(1, chunk_words - overlap_words)
+    passages = []
+    for start in range(0, len(words), step):
+        passages.append(' '.join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return passages
+
+
+def load_chunks(directory, chunk_words=120, overlap_words=30):
+    """Chunks of every document under directory; sources are paths relative to it"""
+    chunks = []
+    for path in document_paths(directory):
+        source = os.path.relpath(path, directory).replace(os.sep, '/')
+        for page, text in enumerate(read_pages(path), 1):
+            for passage in split_words(text, chunk_words, overlap_words):
+                chunks.append(Chunk(len(chunks), source, page, passage))
+    return chunks
@@ -0,0 +1,186 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+import numpy as np
+
+
+def cache_key(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings kept in a SQLite file in WAL mode, keyed by (model, SHA-256
+    of the text), so a text is embedded once per model across restarts,
+    index rebuilds and worker processes. Vectors are stored as float32
+    blobs. The file is bounded by max_bytes of vectors: periodic sweeps
+    evict the least recently used entries.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS embeddings (
+            model TEXT NOT NULL,
+            key TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (model, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used);
+    """
+
+    # Keys per SELECT (stays under SQLite's bound-parameter limit)
+    _LOOKUP_BATCH = 500
+    # Hits refresh an entry's last use at most this often, so most lookups do not write
+    _TOUCH_SECONDS = 3600
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, sweep_interval=30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._counts = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self._SCHEMA)
+
+    def get_many(self, model, keys):
+        """{key: vector} for the keys that are cached"""
+        keys = list(keys)
+        found = {}
+        conn = self._connection()
+        for start in range(0, len(keys), self._LOOKUP_BATCH):
+            batch = keys[start:start + self._LOOKUP_BATCH]
+            rows = conn.execute(
+                f"SELECT key, vector, last_used FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(batch))})",
+                (model, *batch),
+            ).fetchall()
+            stale = time.time() - self._TOUCH_SECONDS
+            touch = [key for key, _, last_used in rows if last_used < stale]
+            if touch:
+                with conn:
+                    conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?",
+                        [(time.time(), model, key) for key in touch],
+                    )
+            for key, vector, _ in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, model, items):
+        """Store (key, vector) pairs"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, key, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items],
+            )
+        self._maybe_sweep(conn)
+
+    def count(self, hits, misses):
+        with self._lock:
+            self._counts['hits'] += hits
+            self._counts['misses'] += misses
+
+    def stats(self):
+        entries, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = counts['hits'] + counts['misses']
+        return {
+            'path': self.path,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hit_ratio': round(counts['hits'] / lookups, 4) if lookups else None,
+            **counts,
+        }
+
+    def _connection(self):
+        """One connection per thread; SQLite connections cannot be shared across threads"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Close this thread's connection; other threads' connections close on exit"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _maybe_sweep(self, conn):
+        now = time.monotonic()
+        with self._lock:
+            if not self.max_bytes or now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+        with conn:
+            evicted = conn.execute(
+                "DELETE FROM embeddings WHERE (model, key) IN (SELECT model, key FROM "
+                "(SELECT model, key, SUM(LENGTH(vector)) OVER (ORDER BY last_used DESC) AS total FROM embeddings) "
+                "WHERE total > ?)",
+                (self.max_bytes,),
+            ).rowcount
+        if evicted > 0:
+            with self._lock:
+                self._counts['evictions'] += evicted
+
+
+class CachedEmbedder:
+    """
+    An embedder that looks texts up in an EmbeddingCache first and sends
+    only the misses (each distinct text once) to the wrapped embedder,
+    which batches them. Hits and misses are counted per text, in the
+    cache's stats and, when given, in a counter labelled by result.
+    """
+
+    def __init__(self, embedder, cache, counter=None):
+        self.embedder = embedder
+        self.cache = cache
+        self.counter = counter
+        self.name = embedder.name
+
+    def embed(self, texts):
+        """L2-normalized float32 vectors, one row per text"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [cache_key(text) for text in texts]
+        found = self.cache.get_many(self.name, set(keys))
+        hits = sum(1 for key in keys if key in found)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = self.embedder.embed(list(missing.values()))
+            fresh = dict(zip(missing, vectors))
+            self.cache.put_many(self.name, fresh.items())
+            found.update(fresh)
+
+        self.cache.count(hits, len(texts) - hits)
+        if self.counter is not None:
+            self.counter.inc(hits, result='hit')
+            self.counter.inc(len(texts) - hits, result='miss')
+        return np.stack([found[key] for key in keys]).astype(np.float32, copy=False)
+
+    def stats(self):
+        stats = self.cache.stats()
+        if hasattr(self.embedder, 'stats'):
+            stats['embedder'] = self.embedder.stats()
+        return stats
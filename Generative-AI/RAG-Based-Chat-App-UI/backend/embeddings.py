@@ -0,0 +1,94 @@
+import re
+import hashlib
+import threading
+
+import numpy as np
+
+WORD = re.compile(r"\w+")
+
+
+def batches(texts, max_items, max_chars):
+    """
+    Split texts into consecutive batches of at most max_items texts and
+    max_chars characters (a text longer than max_chars gets a batch of its own)
+    """
+    batch, size = [], 0
+    for text in texts:
+        if batch and (len(batch) >= max_items or size + len(text) > max_chars):
+            yield batch
+            batch, size = [], 0
+        batch.append(text)
+        size += len(text)
+    if batch:
+        yield batch
+
+
+def normalize(vectors):
+    """Scale each row to unit length, so dot products are cosine similarities"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class HashingEmbedder:
+    """
+    Deterministic embedder for offline runs and tests: word unigrams and
+    bigrams are hashed into a fixed number of signed buckets (feature
+    hashing). Texts that share words get similar vectors, the same text gets
+    the same vector in every process, and no model or network is needed.
+    """
+
+    def __init__(self, dimensions=512):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def embed(self, texts):
+        """L2-normalized float32 vectors, one row per text"""
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = WORD.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                vectors[row, value % self.dimensions] += 1.0 if value >> 63 else -1.0
+        return normalize(vectors)
+
+
+class AzureOpenAIEmbedder:
+    """
+    Embeddings from an Azure OpenAI embedding deployment (e.g.
+    text-embedding-3-small). Texts are sent in batches of up to batch_size
+    texts and batch_chars characters, which keeps each request within the
+    service's per-request input limits while needing few round trips.
+    text-embedding-3 models can return shortened vectors (dimensions),
+    which cost proportionally less memory and time to search.
+    """
+
+    def __init__(self, client_factory, deployment, batch_size=256, batch_chars=200000, dimensions=None):
+        # client_factory returns the service's shared AzureOpenAI client
+        self._client_factory = client_factory
+        self.deployment = deployment
+        self.batch_size = batch_size
+        self.batch_chars = batch_chars
+        self.dimensions = dimensions
+        self.name = f"azure:{deployment}" + (f":{dimensions}" if dimensions else "")
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._texts = 0
+
+    def embed(self, texts):
+        """L2-normalized float32 vectors, one row per text"""
+        client = self._client_factory()
+        options = {'dimensions': self.dimensions} if self.dimensions else {}
+        rows = []
+        for batch in batches(texts, self.batch_size, self.batch_chars):
+            response = client.embeddings.create(model=self.deployment, input=batch, **options)
+            rows.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+            with self._lock:
+                self._requests += 1
+                self._texts += len(batch)
+        return normalize(np.asarray(rows, dtype=np.float32).reshape(len(rows), -1))
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self._requests, 'texts': self._texts,
+                    'batch_size': self.batch_size, 'batch_chars': self.batch_chars}
@@ -0,0 +1,61 @@
+import numpy as np
+
+from .vector_index import top_indices
+
+# Retrieval methods of the local retriever (RETRIEVAL_SEARCH)
+SEARCH_METHODS = ('hybrid', 'vector', 'bm25')
+
+
+def reciprocal_rank_fusion(rankings, size, k=60):
+    """
+    Fused score of each of size documents: the sum, over the rankings it
+    appears in, of 1 / (k + rank), rank counting from 1. Only ranks are
+    used, so BM25 scores and cosine similarities need no common scale.
+    """
+    fused = np.zeros(size, dtype=np.float32)
+    for ranking in rankings:
+        fused[ranking] += 1.0 / (k + np.arange(1, len(ranking) + 1, dtype=np.float32))
+    return fused
+
+
+class HybridIndex:
+    """
+    Keyword (BM25) and vector search over the same chunks, fused with
+    reciprocal rank fusion. Vector similarity finds paraphrases; BM25 finds
+    exact names ("Las Vegas", "Margie's") that embeddings blur. Each scorer
+    ranks its top `candidates` chunks and the fused top k is returned. With
+    only one of the two indexes, its own ranking and scores are returned.
+    """
+
+    def __init__(self, chunks, vector_index=None, bm25_index=None, candidates=50, rrf_k=60):
+        self.chunks = chunks
+        self.vector_index = vector_index
+        self.bm25_index = bm25_index
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query, query_vector=None, k=5):
+        """The k best chunks as [(chunk, score), ...], best first"""
+        if not self.chunks:
+            return []
+        depth = max(k, self.candidates)
+        rankings = []
+        if self.bm25_index is not None:
+            scores = self.bm25_index.scores(query)
+            top = top_indices(scores, depth)
+            rankings.append((top[scores[top] > 0], scores))
+        if self.vector_index is not None:
+            scores = self.vector_index.scores(query_vector)
+            rankings.append((top_indices(scores, depth), scores))
+
+        if len(rankings) == 1:
+            top, scores = rankings[0]
+            top = top[:k]
+        else:
+            scores = reciprocal_rank_fusion([top for top, _ in rankings], len(self.chunks), self.rrf_k)
+            top = top_indices(scores, k)
+            top = top[scores[top] > 0]
+        return [(self.chunks[i], float(scores[i])) for i in top]
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import numpy as np
+
+from .documents import Chunk, document_paths, read_pages, split_words
+
+try:
+    import fcntl
+except ImportError:  # Windows: only one process should ingest at a time
+    fcntl = None
+
+# Bumped when the layout of the index directory changes; older indexes are rebuilt
+INDEX_VERSION = 1
+MANIFEST = 'manifest.json'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class IndexSnapshot:
+    """One generation of the on-disk index: its chunks and their memory-mapped vectors (row i is chunks[i])"""
+
+    __slots__ = ('generation', 'chunks', 'vectors', 'embedder')
+
+    def __init__(self, generation, chunks, vectors, embedder):
+        self.generation = generation
+        self.chunks = chunks
+        self.vectors = vectors
+        self.embedder = embedder
+
+
+class Ingestor:
+    """
+    Incremental ingestion of the documents in data_dir into index_dir.
+
+    index_dir holds manifest.json (for every file its size, mtime and
+    SHA-256 and its chunks; for every chunk its source, page, text and
+    content hash) and vectors-<generation>.npy, the chunk vectors in row
+    order. update() re-reads only files whose size or mtime changed and
+    whose content hash differs, and embeds only chunks whose text hash is
+    not already in the index, reusing the stored vectors of everything else.
+    A new generation is written next to the old one and published by
+    atomically replacing the manifest, so readers never see a partial index.
+
+    Servers open the vectors with np.load(mmap_mode='r'): every process maps
+    the same file, and its pages live once in the OS page cache instead of
+    once per worker heap. A file lock lets several workers call update()
+    concurrently; one does the work and the others find nothing to do.
+    """
+
+    def __init__(self, data_dir, index_dir, embedder=None, chunk_words=120, overlap_words=30):
+        # embedder None (BM25-only search) stores zero-width vectors
+        self.data_dir = data_dir
+        self.index_dir = index_dir
+        self.embedder = embedder
+        self.chunk_words = chunk_words
+        self.overlap_words = overlap_words
+        self._lock = threading.Lock()
+
+    @property
+    def embedder_name(self):
+        return self.embedder.name if self.embedder is not None else None
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def read_manifest(self):
+        try:
+            with open(self._path(MANIFEST), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _compatible(self, manifest):
+        return (manifest is not None
+                and manifest.get('version') == INDEX_VERSION
+                and manifest.get('embedder') == self.embedder_name
+                and manifest.get('chunk_words') == self.chunk_words
+                and manifest.get('overlap_words') == self.overlap_words)
+
+    def _open_vectors(self, generation):
+        return np.load(self._path(f"vectors-{generation}.npy"), mmap_mode='r')
+
+    def load(self):
+        """The current generation, or None if there is no usable index yet"""
+        for _ in range(3):
+            manifest = self.read_manifest()
+            if not self._compatible(manifest):
+                return None
+            try:
+                vectors = self._open_vectors(manifest['generation'])
+            except FileNotFoundError:
+                # Replaced (and its vectors cleaned up) between the two reads
+                continue
+            chunks = [Chunk(row, chunk['source'], chunk['page'], chunk['text'])
+                      for row, chunk in enumerate(manifest['chunks'])]
+            return IndexSnapshot(manifest['generation'], chunks, vectors, manifest['embedder'])
+        return None
+
+    def update(self):
+        """Bring the index up to date with data_dir; returns a report of what changed"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        with self._lock, open(self._path('lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return self._update()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _update(self):
+        started = time.perf_counter()
+        manifest = self.read_manifest()
+        if not self._compatible(manifest):
+            manifest = None
+        old_files = manifest['files'] if manifest else {}
+        old_chunks = manifest['chunks'] if manifest else []
+        report = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0, 'embedded': 0, 'reused': 0}
+
+        files, chunks = {}, []
+        for path in document_paths(self.data_dir):
+            source = os.path.relpath(path, self.data_dir).replace(os.sep, '/')
+            stat = os.stat(path)
+            entry = old_files.get(source)
+            if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                sha256 = entry['sha256']
+            else:
+                sha256 = file_sha256(path)
+            if entry and entry['sha256'] == sha256:
+                # Same content: keep its chunks without parsing the file again
+                file_chunks = old_chunks[entry['start']:entry['start'] + entry['count']]
+                report['unchanged'] += 1
+            else:
+                file_chunks = [
+                    {'source': source, 'page': page, 'hash': text_hash(passage), 'text': passage}
+                    for page, text in enumerate(read_pages(path), 1)
+                    for passage in split_words(text, self.chunk_words, self.overlap_words)
+                ]
+                report['changed' if entry else 'added'] += 1
+            files[source] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256,
+                             'start': len(chunks), 'count': len(file_chunks)}
+            chunks.extend(file_chunks)
+        report['removed'] = len(set(old_files) - set(files))
+
+        def layout(chunk_list):
+            return [(chunk['source'], chunk['page'], chunk['hash']) for chunk in chunk_list]
+
+        if manifest and layout(chunks) == layout(old_chunks):
+            # Same chunks (e.g. files only touched): keep the generation, record the new file stats
+            if files != old_files:
+                self._write_manifest(manifest['generation'], files, chunks)
+            report.update(generation=manifest['generation'], chunks=len(chunks), reused=len(chunks),
+                          seconds=round(time.perf_counter() - started, 3))
+            return report
+
+        # Vectors: reuse stored rows by chunk text hash, embed the rest (each distinct text once)
+        old_rows = {chunk['hash']: row for row, chunk in enumerate(old_chunks)}
+        old_vectors = self._open_vectors(manifest['generation']) if manifest and old_chunks else None
+        missing = list(dict.fromkeys(chunk['hash'] for chunk in chunks if chunk['hash'] not in old_rows))
+        texts = {chunk['hash']: chunk['text'] for chunk in chunks}
+        embedded = {}
+        if missing and self.embedder is not None:
+            new_vectors = self.embedder.embed([texts[key] for key in missing])
+            embedded = {key: row for row, key in enumerate(missing)}
+        else:
+            new_vectors = None
+
+        if self.embedder is None:
+            dimensions = 0
+        elif new_vectors is not None:
+            dimensions = new_vectors.shape[1]
+        else:
+            dimensions = old_vectors.shape[1] if old_vectors is not None else 0
+        vectors = np.zeros((len(chunks), dimensions), dtype=np.float32)
+        if dimensions:
+            reused = [(row, old_rows[chunk['hash']]) for row, chunk in enumerate(chunks) if chunk['hash'] in old_rows]
+            if reused:
+                rows, old = np.array(reused).T
+                vectors[rows] = old_vectors[old]
+            fresh = [(row, embedded[chunk['hash']]) for row, chunk in enumerate(chunks) if chunk['hash'] in embedded]
+            if fresh:
+                rows, new = np.array(fresh).T
+                vectors[rows] = new_vectors[new]
+        report['embedded'] = len(missing) if self.embedder is not None else 0
+        report['reused'] = len(chunks) - sum(1 for chunk in chunks if chunk['hash'] in embedded)
+
+        generation = (manifest['generation'] + 1) if manifest else self._next_generation()
+        self._write_vectors(generation, vectors)
+        self._write_manifest(generation, files, chunks)
+        self._remove_old_vectors(generation)
+        report.update(generation=generation, chunks=len(chunks), seconds=round(time.perf_counter() - started, 3))
+        return report
+
+    def _next_generation(self):
+        # After an incompatible (or missing) manifest, continue numbering so readers notice the change
+        previous = self.read_manifest()
+        return (previous.get('generation', 0) + 1) if previous else 1
+
+    def _write_vectors(self, generation, vectors):
+        vectors_tmp = self._path(f"vectors-{generation}.npy.tmp")
+        with open(vectors_tmp, 'wb') as f:
+            np.save(f, vectors)
+        os.replace(vectors_tmp, self._path(f"vectors-{generation}.npy"))
+
+    def _write_manifest(self, generation, files, chunks):
+        manifest = {
+            'version': INDEX_VERSION,
+            'generation': generation,
+            'embedder': self.embedder_name,
+            'chunk_words': self.chunk_words,
+            'overlap_words': self.overlap_words,
+            'files': files,
+            'chunks': chunks,
+        }
+        manifest_tmp = self._path(MANIFEST + '.tmp')
+        with open(manifest_tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_tmp, self._path(MANIFEST))
+
+    def _remove_old_vectors(self, generation):
+        # Keep the previous generation for processes that have not reloaded yet
+        for name in os.listdir(self.index_dir):
+            if name.startswith('vectors-') and name.endswith('.npy'):
+                try:
+                    if int(name[len('vectors-'):-len('.npy')]) < generation - 1:
+                        os.remove(self._path(name))
+                except (ValueError, OSError):
+                    # Not ours, or still mapped by a process on Windows
+                    pass
@@ -0,0 +1,249 @@
+import os
+import time
+import threading
+
+from .bm25 import BM25Index
+from .documents import load_chunks
+from .embedding_cache import CachedEmbedder, EmbeddingCache
+from .embeddings import AzureOpenAIEmbedder, HashingEmbedder
+from .hybrid_index import SEARCH_METHODS, HybridIndex
+from .ingest import Ingestor
+from .vector_index import VectorIndex
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATA_DIR = os.path.join(APP_DIR, 'rag-data')
+DEFAULT_INDEX_DIR = os.path.join(APP_DIR, 'rag-index')
+
+
+class Retrieval:
+    """
+    The chunks retrieved for one question, best first, and how long retrieval
+    took. With a semantic cache hit, answer holds the cached answer's chunks
+    and results the chunks it was grounded on; on a miss, vector and version
+    are what the answer is cached under once it completes.
+    """
+
+    __slots__ = ('query', 'results', 'seconds', 'answer', 'similarity', 'cached_question', 'vector', 'version')
+
+    def __init__(self, query, results, seconds):
+        self.query = query
+        self.results = results
+        self.seconds = seconds
+        self.answer = None
+        self.similarity = None
+        self.cached_question = None
+        self.vector = None
+        self.version = None
+
+    def context(self):
+        """Prompt text with the numbered chunks, for a system message next to the question"""
+        if not self.results:
+            return "No brochure excerpts matched the question; say so if you cannot answer it."
+        sources = [
+            f"[{number}] {chunk.source}, page {chunk.page}:\n{chunk.text}"
+            for number, (chunk, _) in enumerate(self.results, 1)
+        ]
+        return ("Answer using the following brochure excerpts when they are relevant, "
+                "and cite them by number, like [1].\n\n" + "\n\n".join(sources))
+
+    def summary(self):
+        """Sources and latency, for the client"""
+        summary = {
+            'ms': round(self.seconds * 1000, 2),
+            'sources': [
+                {'number': number, 'source': chunk.source, 'page': chunk.page, 'score': round(score, 4)}
+                for number, (chunk, score) in enumerate(self.results, 1)
+            ],
+        }
+        if self.answer is not None:
+            summary.update(cached=True, similarity=round(self.similarity, 4), cached_question=self.cached_question)
+        return summary
+
+
+class LocalRetriever:
+    """
+    In-process retrieval over the documents in data_dir (PDF, text and
+    Markdown), in place of the Azure AI Search data source. The documents are
+    chunked on first use (or by build()) and indexed for the search method:
+    'hybrid' (BM25 and vector rankings fused), 'vector' or 'bm25'. For
+    vector search, chunks and questions are embedded with the same embedder.
+
+    With an index_dir, chunks and vectors are kept on disk by an Ingestor,
+    which re-embeds only what changed and memory-maps the vectors; every
+    watch_seconds (0 disables) changes in data_dir are ingested and the new
+    index is swapped in while the server keeps answering. Without one, the
+    documents are chunked and embedded in memory.
+    """
+
+    def __init__(self, data_dir, embedder, top_k=5, chunk_words=120, overlap_words=30,
+                 search='hybrid', candidates=50, index_dir=None, watch_seconds=0):
+        if search not in SEARCH_METHODS:
+            raise ValueError(f"Unknown retrieval search method: {search}")
+        self.data_dir = data_dir
+        self.embedder = embedder
+        self.top_k = top_k
+        self.chunk_words = chunk_words
+        self.overlap_words = overlap_words
+        self.search = search
+        self.candidates = candidates
+        self.ingestor = None
+        if index_dir:
+            self.ingestor = Ingestor(data_dir, index_dir, embedder if search != 'bm25' else None,
+                                     chunk_words, overlap_words)
+        self.watch_seconds = watch_seconds
+
+        self._index = None
+        self._version = 0
+        self._generation = None
+        self._lock = threading.Lock()
+        self._build_seconds = None
+        self._last_update = None
+        self._watch_error = None
+        self._watcher = None
+        self._stopping = threading.Event()
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._build()
+        return self._index
+
+    @property
+    def version(self):
+        """Changes whenever a new index is swapped in (building it first if needed)"""
+        self.index
+        return self._version
+
+    def build(self):
+        """Read, chunk and embed the documents now (e.g. at startup), or apply what changed since"""
+        with self._lock:
+            self._build()
+
+    def _build(self):
+        started = time.perf_counter()
+        if self.ingestor is None:
+            chunks = load_chunks(self.data_dir, self.chunk_words, self.overlap_words)
+            vectors = self.embedder.embed([chunk.text for chunk in chunks]) if chunks and self.search != 'bm25' else []
+        else:
+            self._last_update = self.ingestor.update()
+            if self._index is not None and self._last_update['generation'] == self._generation:
+                return
+            snapshot = self.ingestor.load()
+            chunks, vectors = snapshot.chunks, snapshot.vectors
+            self._generation = snapshot.generation
+
+        vector_index = bm25_index = None
+        if self.search != 'bm25':
+            vector_index = VectorIndex(vectors, chunks)
+        if self.search != 'vector':
+            bm25_index = BM25Index([chunk.text for chunk in chunks])
+        self._index = HybridIndex(chunks, vector_index, bm25_index, self.candidates)
+        self._version += 1
+        self._build_seconds = time.perf_counter() - started
+        self.start_watch()
+
+    def start_watch(self):
+        """Ingest changes in data_dir every watch_seconds in the background (no-op without an index_dir)"""
+        if not self.watch_seconds or self.ingestor is None or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch_loop, name='retrieval-watch', daemon=True)
+        self._watcher.start()
+
+    def _watch_loop(self):
+        while not self._stopping.wait(self.watch_seconds):
+            try:
+                self.build()
+                self._watch_error = None
+            except Exception as e:
+                # Keep serving the last good index (e.g. while a PDF is half copied)
+                self._watch_error = str(e)
+
+    def close(self):
+        """Stop watching data_dir"""
+        self._stopping.set()
+
+    def cached_retrieval(self, query, hit):
+        """A Retrieval carrying a semantic cache hit: its answer and the sources that answer cites"""
+        retrieval = Retrieval(query, hit.results, 0.0)
+        retrieval.answer = hit.chunks
+        retrieval.similarity = hit.similarity
+        retrieval.cached_question = hit.question
+        return retrieval
+
+    def embed_query(self, query):
+        return self.embedder.embed([query])[0]
+
+    def retrieve(self, query, k=None, query_vector=None):
+        """Retrieve the top k (default top_k) chunks for a question (query_vector: its embedding, if known)"""
+        index = self.index
+        started = time.perf_counter()
+        if index.vector_index is None:
+            query_vector = None
+        elif query_vector is None and len(index):
+            query_vector = self.embed_query(query)
+        results = index.search(query, query_vector, k or self.top_k)
+        return Retrieval(query, results, time.perf_counter() - started)
+
+    def stats(self):
+        index = self._index
+        return {
+            'mode': 'local',
+            'data_dir': self.data_dir,
+            'search': self.search,
+            'embedder': self.embedder.name if self.search != 'bm25' else None,
+            'embedding_cache': self.embedder.stats() if isinstance(self.embedder, CachedEmbedder) else None,
+            'built': index is not None,
+            'chunks': len(index) if index is not None else 0,
+            'documents': len({chunk.source for chunk in index.chunks}) if index is not None else 0,
+            'build_seconds': round(self._build_seconds, 3) if self._build_seconds is not None else None,
+            'top_k': self.top_k,
+            'index_dir': self.ingestor.index_dir if self.ingestor is not None else None,
+            'generation': self._generation,
+            'last_update': self._last_update,
+            'watch_seconds': self.watch_seconds,
+            'watch_error': self._watch_error,
+            'terms': len(index.bm25_index.vocabulary) if index is not None and index.bm25_index is not None else None,
+        }
+
+
+def create_retriever(client_factory, registry=None):
+    """
+    Create the local retriever configured by environment variables.
+    client_factory returns the Azure OpenAI client, for the azure embedder;
+    registry (a MetricsRegistry) gets the embedding cache counters.
+    """
+    embedder_kind = os.getenv("RETRIEVAL_EMBEDDER") or ("azure" if os.getenv("EMBEDDING_MODEL") else "hashing")
+    if embedder_kind == "azure":
+        embedder = AzureOpenAIEmbedder(
+            client_factory,
+            os.getenv("EMBEDDING_MODEL", ""),
+            batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "256")),
+            batch_chars=int(os.getenv("EMBEDDING_BATCH_CHARS", "200000")),
+            dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None,
+        )
+        # Azure embeddings cost a round trip and quota: keep them on disk (empty path disables)
+        cache_path = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(DEFAULT_INDEX_DIR, 'embedding-cache.db'))
+        if cache_path:
+            cache = EmbeddingCache(cache_path, max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(256 * 1024 * 1024))))
+            counter = None
+            if registry is not None:
+                counter = registry.counter(
+                    'chat_embedding_cache_lookups_total', 'Texts looked up in the embedding cache, by result', ('result',)
+                )
+            embedder = CachedEmbedder(embedder, cache, counter)
+    elif embedder_kind == "hashing":
+        embedder = HashingEmbedder(dimensions=int(os.getenv("RETRIEVAL_HASHING_DIMENSIONS", "512")))
+    else:
+        raise ValueError(f"Unknown RETRIEVAL_EMBEDDER: {embedder_kind}")
+
+    return LocalRetriever(
+        data_dir=os.getenv("RAG_DATA_DIR") or DEFAULT_DATA_DIR,
+        embedder=embedder,
+        top_k=int(os.getenv("RETRIEVAL_TOP_K", "5")),
+        search=os.getenv("RETRIEVAL_SEARCH", "hybrid").lower(),
+        candidates=int(os.getenv("RETRIEVAL_CANDIDATES", "50")),
+        index_dir=os.getenv("RETRIEVAL_INDEX_DIR", DEFAULT_INDEX_DIR),
+        watch_seconds=float(os.getenv("RETRIEVAL_WATCH_SECONDS", "0")),
+    )
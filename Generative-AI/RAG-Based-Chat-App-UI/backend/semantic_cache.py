@@ -0,0 +1,141 @@
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticCacheHit:
+    """A cached answer: the question it was given for, its retrieved chunks and its streamed chunks"""
+
+    __slots__ = ('question', 'results', 'chunks', 'similarity')
+
+    def __init__(self, question, results, chunks, similarity):
+        self.question = question
+        self.results = results
+        self.chunks = chunks
+        self.similarity = similarity
+
+
+class SemanticCache:
+    """
+    Answers to earlier questions, found by meaning rather than exact text:
+    a question whose embedding has at least `threshold` cosine similarity
+    to a cached question gets that question's answer and sources.
+
+    Question vectors live in one preallocated float32 matrix of max_entries
+    rows, so a lookup is a single matrix-vector product and an argmax.
+    Entries are evicted least recently used first, expire after ttl_seconds,
+    and are all dropped when the retrieval index version changes, so no
+    answer outlives the brochure chunks it was grounded on.
+    """
+
+    def __init__(self, max_entries=1000, threshold=0.92, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+
+        self._vectors = None
+        self._entries = OrderedDict()
+        self._free = []
+        self._rows = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, vector, version):
+        """The cached answer closest to vector if it is similar enough, or None"""
+        with self._lock:
+            self._check_version(version)
+            if self._entries:
+                scores = self._vectors[:self._rows] @ vector
+                # Rows similar enough, best first: an expired one is dropped and the next one tried
+                candidates = np.flatnonzero(scores >= self.threshold)
+                for row in candidates[np.argsort(-scores[candidates], kind='stable')]:
+                    row = int(row)
+                    entry = self._entries.get(row)
+                    if entry is None:
+                        continue
+                    question, results, chunks, stored_at = entry
+                    if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+                        self._remove(row)
+                        self._evictions += 1
+                        continue
+                    self._entries.move_to_end(row)
+                    self._hits += 1
+                    return SemanticCacheHit(question, results, chunks, float(scores[row]))
+            self._misses += 1
+            return None
+
+    def put(self, vector, version, question, results, chunks):
+        """Cache an answer; dropped if the index changed since its chunks were retrieved"""
+        if not self.enabled:
+            return
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if self._version is not None and version != self._version:
+                # The index changed after this answer's chunks were retrieved
+                return
+            self._version = version
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+                self._entries.clear()
+                self._free = []
+                self._rows = 0
+            existing = None
+            if self._entries:
+                # A question answered concurrently (or re-answered after expiry) replaces its entry
+                scores = self._vectors[:self._rows] @ vector
+                best = int(np.argmax(scores))
+                if best in self._entries and scores[best] >= self.threshold:
+                    existing = best
+            if existing is not None:
+                row = existing
+                del self._entries[row]
+            elif self._free:
+                row = self._free.pop()
+            elif self._rows < self.max_entries:
+                row = self._rows
+                self._rows += 1
+            else:
+                # Least recently used
+                row = next(iter(self._entries))
+                del self._entries[row]
+                self._evictions += 1
+            self._vectors[row] = vector
+            self._entries[row] = (question, results, tuple(chunks), time.monotonic())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'ttl_seconds': self.ttl_seconds,
+            }
+
+    def _check_version(self, version):
+        # Called with the lock held: a new index version empties the cache
+        if version == self._version:
+            return
+        if self._entries:
+            self._invalidations += 1
+        for row in list(self._entries):
+            self._remove(row)
+        self._version = version
+
+    def _remove(self, row):
+        del self._entries[row]
+        self._vectors[row] = 0
+        self._free.append(row)
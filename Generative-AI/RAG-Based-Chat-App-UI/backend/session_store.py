@@ -0,0 +1,629 @@
+import os
+import json
+import re
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+
+
+class SessionStore:
+    """
+    Base interface for conversation history storage.
+    Histories are lists of messages built by ChatService.format_*_message.
+    Every message has a turn ID that increases with each append and is never
+    reused by the session, even after clear(), so clients can page through a
+    history and fetch only the turns they have not seen yet.
+    """
+
+    # Whether calls do I/O and should be kept off the event loop in async servers
+    blocking = False
+
+    def get(self, session_id):
+        """Return a copy of the session's history (empty list if unknown)"""
+        raise NotImplementedError
+
+    def get_turns(self, session_id, after=None, before=None, limit=None):
+        """
+        Return one page of the session's history as ([(turn_id, message), ...], has_more),
+        oldest first: the oldest `limit` turns after turn `after`, otherwise the newest
+        `limit` turns before turn `before` (or the end). has_more tells whether more
+        turns lie beyond the page in that direction. Return None when `after` or
+        `before` is not a turn of the session, e.g. because it was cleared.
+        """
+        raise NotImplementedError
+
+    def append(self, session_id, message):
+        """Append a message to the session's history, creating it if needed; return its turn ID"""
+        raise NotImplementedError
+
+    def clear(self, session_id):
+        """Remove all messages from the session's history"""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """Remove the session entirely"""
+        raise NotImplementedError
+
+    def __contains__(self, session_id):
+        raise NotImplementedError
+
+    def stats(self):
+        """Return a dict of store metrics"""
+        return {}
+
+    def close(self):
+        """Flush pending writes and release connections when the worker shuts down"""
+
+    async def aget(self, session_id):
+        return await self._run(self.get, session_id)
+
+    async def aget_turns(self, session_id, after=None, before=None, limit=None):
+        return await self._run(self.get_turns, session_id, after, before, limit)
+
+    async def aappend(self, session_id, message):
+        return await self._run(self.append, session_id, message)
+
+    async def aclear(self, session_id):
+        return await self._run(self.clear, session_id)
+
+    async def astats(self):
+        return await self._run(self.stats)
+
+    async def _run(self, func, *args):
+        if self.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+
+class _SessionEntry:
+    __slots__ = ('messages', 'first_id', 'size', 'last_access')
+
+    def __init__(self, now):
+        self.messages = []
+        self.first_id = 0
+        self.size = 0
+        self.last_access = now
+
+
+def turn_page(first_id, next_id, after=None, before=None, limit=None):
+    """
+    Page a history whose turn IDs run from first_id to next_id - 1 without gaps.
+    Return (start, end, has_more) for turn IDs start..end-1, or None when `after`
+    or `before` is not one of the turns.
+    """
+    for turn_id in (after, before):
+        if turn_id is not None and not first_id <= turn_id < next_id:
+            return None
+    if after is not None:
+        start = after + 1
+        end = next_id if limit is None else min(next_id, start + limit)
+        return start, end, end < next_id
+    end = next_id if before is None else before
+    start = first_id if limit is None else max(first_id, end - limit)
+    return start, end, start > first_id
+
+
+def message_size(message):
+    """Approximate resident size of a message in bytes"""
+    return len(json.dumps(message, separators=(',', ':')).encode('utf-8'))
+
+
+def encode_message(message):
+    """
+    Serialize a message compactly for out-of-process stores.
+    Messages in the standard format_*_message shapes are stored as
+    [role, text] (string content) or [role, text, 1] (single text part);
+    anything else is stored as the full JSON object.
+    """
+    if len(message) == 2 and 'role' in message and 'content' in message:
+        role, content = message['role'], message['content']
+        if isinstance(content, str):
+            return json.dumps([role, content], separators=(',', ':'), ensure_ascii=False)
+        if (isinstance(content, list) and len(content) == 1
+                and content[0].keys() == {'type', 'text'} and content[0]['type'] == 'text'):
+            return json.dumps([role, content[0]['text'], 1], separators=(',', ':'), ensure_ascii=False)
+    return json.dumps(message, separators=(',', ':'), ensure_ascii=False)
+
+
+def decode_message(data):
+    """Inverse of encode_message"""
+    value = json.loads(data)
+    if isinstance(value, list):
+        if len(value) == 3:
+            return {"role": value[0], "content": [{"type": "text", "text": value[1]}]}
+        return {"role": value[0], "content": value[1]}
+    return value
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process session store bounded by session count, total bytes and idle TTL.
+    Sessions are kept in least-recently-used order, so expired and LRU sessions
+    are always found at the front and eviction never scans the whole store.
+    """
+
+    def __init__(self, max_sessions=10000, max_bytes=64 * 1024 * 1024, ttl_seconds=3600):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._sessions = OrderedDict()
+        self._resident_bytes = 0
+        self._lock = threading.Lock()
+        self._evictions = {'ttl': 0, 'max_sessions': 0, 'max_bytes': 0}
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._touch(session_id, create=False)
+            return list(entry.messages) if entry else []
+
+    def get_turns(self, session_id, after=None, before=None, limit=None):
+        with self._lock:
+            entry = self._touch(session_id, create=False)
+            first_id, messages = (entry.first_id, entry.messages) if entry else (0, [])
+            page = turn_page(first_id, first_id + len(messages), after, before, limit)
+            if page is None:
+                return None
+            start, end, has_more = page
+            # Only the requested slice is copied
+            return list(zip(range(start, end), messages[start - first_id:end - first_id])), has_more
+
+    def append(self, session_id, message):
+        size = message_size(message)
+        with self._lock:
+            entry = self._touch(session_id, create=True)
+            entry.messages.append(message)
+            entry.size += size
+            self._resident_bytes += size
+            self._evict(keep=session_id)
+            return entry.first_id + len(entry.messages) - 1
+
+    def clear(self, session_id):
+        with self._lock:
+            entry = self._touch(session_id, create=False)
+            if entry:
+                self._resident_bytes -= entry.size
+                # Turn IDs continue after a clear
+                entry.first_id += len(entry.messages)
+                entry.messages = []
+                entry.size = 0
+
+    def delete(self, session_id):
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry:
+                self._resident_bytes -= entry.size
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return self._touch(session_id, create=False) is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'sessions': len(self._sessions),
+                'resident_bytes': self._resident_bytes,
+                'max_sessions': self.max_sessions,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'evictions': dict(self._evictions),
+            }
+
+    def _touch(self, session_id, create):
+        """Look up a session, expiring it if idle too long, and mark it most recently used"""
+        now = time.monotonic()
+        entry = self._sessions.get(session_id)
+        if entry is not None and self._expired(entry, now):
+            self._remove(session_id, 'ttl')
+            entry = None
+        if entry is None:
+            if not create:
+                return None
+            entry = _SessionEntry(now)
+            self._sessions[session_id] = entry
+        else:
+            entry.last_access = now
+            self._sessions.move_to_end(session_id)
+        return entry
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds and now - entry.last_access > self.ttl_seconds
+
+    def _evict(self, keep):
+        """Drop expired sessions, then least recently used ones until within limits"""
+        now = time.monotonic()
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if session_id == keep:
+                break
+            if self._expired(entry, now):
+                reason = 'ttl'
+            elif self.max_sessions and len(self._sessions) > self.max_sessions:
+                reason = 'max_sessions'
+            elif self.max_bytes and self._resident_bytes > self.max_bytes:
+                reason = 'max_bytes'
+            else:
+                break
+            self._remove(session_id, reason)
+
+    def _remove(self, session_id, reason):
+        entry = self._sessions.pop(session_id)
+        self._resident_bytes -= entry.size
+        self._evictions[reason] += 1
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store backed by a SQLite file in WAL mode.
+    Several worker processes on the same host can share one file: readers
+    never block the writer, and limits are enforced with periodic SQL sweeps.
+    """
+
+    blocking = True
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            last_access REAL NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions(last_access);
+        CREATE TABLE IF NOT EXISTS messages (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+            body TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS messages_session ON messages(session_id, seq);
+    """
+
+    def __init__(self, path='sessions.db', max_sessions=10000, max_bytes=64 * 1024 * 1024,
+                 ttl_seconds=3600, sweep_interval=30):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._evictions = {'ttl': 0, 'max_sessions': 0, 'max_bytes': 0}
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self._SCHEMA)
+
+    def get(self, session_id):
+        conn = self._connection()
+        with conn:
+            if not self._touch(conn, session_id):
+                return []
+            rows = conn.execute(
+                "SELECT body FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+        return [decode_message(body) for (body,) in rows]
+
+    def get_turns(self, session_id, after=None, before=None, limit=None):
+        # Turn IDs are message row IDs: increasing and never reused, but not contiguous
+        cursor_id = after if after is not None else before
+        if after is not None:
+            condition, args, order = "AND seq > ?", (after,), "ASC"
+        elif before is not None:
+            condition, args, order = "AND seq < ?", (before,), "DESC"
+        else:
+            condition, args, order = "", (), "DESC"
+        conn = self._connection()
+        with conn:
+            if not self._touch(conn, session_id):
+                return None if cursor_id is not None else ([], False)
+            if cursor_id is not None and conn.execute(
+                "SELECT 1 FROM messages WHERE seq = ? AND session_id = ?", (cursor_id, session_id)
+            ).fetchone() is None:
+                return None
+            rows = conn.execute(
+                f"SELECT seq, body FROM messages WHERE session_id = ? {condition} ORDER BY seq {order} LIMIT ?",
+                (session_id, *args, -1 if limit is None else limit + 1),
+            ).fetchall()
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if has_more else rows
+        if order == "DESC":
+            rows.reverse()
+        return [(seq, decode_message(body)) for seq, body in rows], has_more
+
+    def append(self, session_id, message):
+        body = encode_message(message)
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            # An expired session that has not been swept yet starts over, as in the
+            # memory store, instead of coming back with its old messages
+            if self.ttl_seconds and conn.execute(
+                "DELETE FROM sessions WHERE id = ? AND last_access < ?", (session_id, now - self.ttl_seconds)
+            ).rowcount:
+                self._count_evictions('ttl', 1)
+            conn.execute(
+                "INSERT INTO sessions (id, last_access, size) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET last_access = excluded.last_access, "
+                "size = size + excluded.size",
+                (session_id, now, len(body.encode('utf-8'))),
+            )
+            turn_id = conn.execute(
+                "INSERT INTO messages (session_id, body) VALUES (?, ?)", (session_id, body)
+            ).lastrowid
+        self._maybe_sweep(conn)
+        return turn_id
+
+    def clear(self, session_id):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute(
+                "UPDATE sessions SET size = 0, last_access = ? WHERE id = ?", (time.time(), session_id)
+            )
+
+    def delete(self, session_id):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def __contains__(self, session_id):
+        conn = self._connection()
+        with conn:
+            return self._touch(conn, session_id)
+
+    def stats(self):
+        count, resident = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions"
+        ).fetchone()
+        with self._lock:
+            evictions = dict(self._evictions)
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'sessions': count,
+            'resident_bytes': resident,
+            'max_sessions': self.max_sessions,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'evictions': evictions,
+        }
+
+    def _connection(self):
+        """One connection per thread; SQLite connections cannot be shared across threads"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """
+        Move the write-ahead log into the database file, so the next worker to
+        open it starts with a short log, and close this thread's connection.
+        Committed writes are already durable; other threads' connections close on exit.
+        """
+        conn = self._connection()
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.OperationalError:
+            # Another process is writing; it will checkpoint later
+            pass
+        conn.close()
+        self._local.conn = None
+
+    def _touch(self, conn, session_id):
+        """Refresh a session's last access time, deleting it if it has expired"""
+        now = time.time()
+        cutoff = now - self.ttl_seconds if self.ttl_seconds else 0
+        updated = conn.execute(
+            "UPDATE sessions SET last_access = ? WHERE id = ? AND last_access >= ?",
+            (now, session_id, cutoff),
+        ).rowcount
+        if updated:
+            return True
+        if conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount:
+            self._count_evictions('ttl', 1)
+        return False
+
+    def _maybe_sweep(self, conn):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+        with conn:
+            if self.ttl_seconds:
+                self._count_evictions('ttl', conn.execute(
+                    "DELETE FROM sessions WHERE last_access < ?", (time.time() - self.ttl_seconds,)
+                ).rowcount)
+            if self.max_sessions:
+                self._count_evictions('max_sessions', conn.execute(
+                    "DELETE FROM sessions WHERE id IN "
+                    "(SELECT id FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_sessions,),
+                ).rowcount)
+            if self.max_bytes:
+                self._count_evictions('max_bytes', conn.execute(
+                    "DELETE FROM sessions WHERE id IN (SELECT id FROM "
+                    "(SELECT id, SUM(size) OVER (ORDER BY last_access DESC) AS total FROM sessions) "
+                    "WHERE total > ?)",
+                    (self.max_bytes,),
+                ).rowcount)
+
+    def _count_evictions(self, reason, count):
+        if count > 0:
+            with self._lock:
+                self._evictions[reason] += count
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Session store backed by any Redis-protocol server (Redis, Valkey, or a local stand-in).
+    Each history is a list key with a sliding idle TTL. Size limits are left to the
+    server's maxmemory and allkeys-lru eviction policy; use a dedicated database.
+    The session count in stats() is a SCAN over this store's key prefix, so other
+    keys in the database are not counted; it is refreshed at most every count_interval seconds.
+    The first item of a list is the turn ID of the first message, followed by the
+    messages, so pages are read by offset and turn IDs continue after a clear.
+    """
+
+    blocking = True
+
+    def __init__(self, url='redis://localhost:6379/0', ttl_seconds=3600, prefix='chat:session:', count_interval=10):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("SESSION_STORE=redis requires the redis package: pip install redis")
+
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.count_interval = count_interval
+        self._redis = redis.Redis.from_url(url)
+        self._response_error = redis.exceptions.ResponseError
+        self._count_lock = threading.Lock()
+        self._counted = (None, 0)
+
+    def get(self, session_id):
+        key = self.prefix + session_id
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.lrange(key, 1, -1)
+        if self.ttl_seconds:
+            pipe.expire(key, self.ttl_seconds)
+        items = pipe.execute()[0]
+        return [decode_message(item) for item in items]
+
+    def get_turns(self, session_id, after=None, before=None, limit=None):
+        key = self.prefix + session_id
+        page = None
+
+        def read(pipe):
+            nonlocal page
+            head = pipe.lindex(key, 0)
+            first_id = int(head) if head is not None else 0
+            page = turn_page(first_id, first_id + max(pipe.llen(key) - 1, 0), after, before, limit)
+            pipe.multi()
+            if page is not None:
+                start, end, _ = page
+                pipe.lrange(key, start - first_id + 1, end - first_id)
+            if self.ttl_seconds:
+                pipe.expire(key, self.ttl_seconds)
+
+        # WATCH keeps the offsets consistent with a concurrent clear()
+        results = self._redis.transaction(read, key)
+        if page is None:
+            return None
+        start, end, has_more = page
+        return [(start + index, decode_message(item)) for index, item in enumerate(results[0])], has_more
+
+    def append(self, session_id, message):
+        key = self.prefix + session_id
+        body = encode_message(message)
+        pipe = self._redis.pipeline()
+        pipe.rpushx(key, body)
+        pipe.lindex(key, 0)
+        if self.ttl_seconds:
+            pipe.expire(key, self.ttl_seconds)
+        length, head = pipe.execute()[:2]
+        if length:
+            return int(head) + length - 2
+
+        # New history: create the list with its first turn ID, unless another request just did
+        def create(pipe):
+            nonlocal head
+            head = pipe.lindex(key, 0)
+            pipe.multi()
+            if head is None:
+                pipe.rpush(key, 0, body)
+            else:
+                pipe.rpush(key, body)
+            if self.ttl_seconds:
+                pipe.expire(key, self.ttl_seconds)
+
+        length = self._redis.transaction(create, key)[0]
+        return int(head or 0) + length - 2
+
+    def clear(self, session_id):
+        key = self.prefix + session_id
+
+        def clear(pipe):
+            head = pipe.lindex(key, 0)
+            if head is None:
+                return
+            next_id = int(head) + pipe.llen(key) - 1
+            pipe.multi()
+            pipe.delete(key)
+            pipe.rpush(key, next_id)
+            if self.ttl_seconds:
+                pipe.expire(key, self.ttl_seconds)
+
+        self._redis.transaction(clear, key)
+
+    def delete(self, session_id):
+        self._redis.delete(self.prefix + session_id)
+
+    def __contains__(self, session_id):
+        return bool(self._redis.exists(self.prefix + session_id))
+
+    def stats(self):
+        try:
+            info = self._redis.info()
+        except self._response_error:
+            # Minimal Redis-protocol stand-ins may not implement INFO
+            info = {}
+        return {
+            'backend': 'redis',
+            'sessions': self._count_sessions(),
+            'resident_bytes': info.get('used_memory', 0),
+            'max_bytes': info.get('maxmemory', 0),
+            'ttl_seconds': self.ttl_seconds,
+            'evictions': {
+                'ttl': info.get('expired_keys', 0),
+                'max_bytes': info.get('evicted_keys', 0),
+            },
+        }
+
+    def _count_sessions(self):
+        # Only keys under this store's prefix (glob characters in it are escaped)
+        with self._count_lock:
+            counted_at, sessions = self._counted
+            now = time.monotonic()
+            if counted_at is None or now - counted_at >= self.count_interval:
+                pattern = re.sub(r'([*?\[\]\\])', r'\\\1', self.prefix) + '*'
+                sessions = sum(1 for _ in self._redis.scan_iter(match=pattern, count=1000))
+                self._counted = (now, sessions)
+            return sessions
+
+    def close(self):
+        self._redis.close()
+
+
+def create_session_store():
+    """
+    Create the session store configured by environment variables
+    """
+    backend = os.getenv("SESSION_STORE", "memory").lower()
+    max_sessions = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+    max_bytes = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+    ttl_seconds = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+
+    if backend == "memory":
+        return MemorySessionStore(max_sessions=max_sessions, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            path=os.getenv("SESSION_STORE_PATH", "sessions.db"),
+            max_sessions=max_sessions,
+            max_bytes=max_bytes,
+            ttl_seconds=ttl_seconds,
+        )
+    if backend == "redis":
+        return RedisSessionStore(
+            url=os.getenv("SESSION_STORE_URL", "redis://localhost:6379/0"),
+            ttl_seconds=ttl_seconds,
+        )
+    raise ValueError(f"Unknown SESSION_STORE backend: {backend}")
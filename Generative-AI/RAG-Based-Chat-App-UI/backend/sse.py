@@ -0,0 +1,137 @@
+import json
+import time
+import asyncio
+
+
+class EventStream:
+    """
+    Formats Server-Sent Events with increasing event IDs.
+    Each event is one `id:` line and one `data:` line carrying the JSON payload.
+    With a stream_id, event IDs are `<stream_id>:<n>`, so a Last-Event-ID
+    header names both the stream and the position in it.
+    """
+
+    def __init__(self, stream_id=None, first_id=1):
+        self.stream_id = stream_id
+        self.next_id = first_id
+
+    def event(self, payload):
+        event_id = self.next_id
+        self.next_id += 1
+        if self.stream_id:
+            event_id = f"{self.stream_id}:{event_id}"
+        return f"id: {event_id}\ndata: {json.dumps(payload)}\n\n"
+
+
+def frame_data(frame):
+    """The JSON payload of a frame made by EventStream.event, or None for a comment (keep-alive)"""
+    for line in frame.split('\n'):
+        if line.startswith('data: '):
+            return line[6:]
+    return None
+
+
+def parse_event_id(value):
+    """Split a `<stream_id>:<n>` event ID into (stream_id, n), or return None"""
+    stream_id, separator, sequence = (value or '').strip().rpartition(':')
+    if not separator or not stream_id or not sequence.isdigit():
+        return None
+    return stream_id, int(sequence)
+
+
+class ChunkCoalescer:
+    """
+    Buffers streamed text and decides when to flush it as one SSE frame:
+    the first chunk is flushed immediately (to keep time-to-first-token low),
+    after that whenever flush_interval_ms has passed since the last flush or
+    flush_bytes (UTF-8 encoded) are buffered, whichever comes first.
+    """
+
+    def __init__(self, flush_interval_ms=50, flush_bytes=256, clock=time.monotonic):
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_bytes = flush_bytes
+        self.clock = clock
+
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._last_flush = None
+
+    def add(self, text):
+        """Buffer text; return the text to flush now, or None"""
+        self._buffer.append(text)
+        self._buffered_bytes += len(text.encode('utf-8'))
+        if (self._last_flush is None
+                or self._buffered_bytes >= self.flush_bytes
+                or self.clock() - self._last_flush >= self.flush_interval):
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Return all buffered text (or None when empty) and reset the buffer"""
+        self._last_flush = self.clock()
+        if not self._buffer:
+            return None
+        text = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered_bytes = 0
+        return text
+
+    def time_until_flush(self):
+        """Seconds until buffered text is due, or None when nothing is buffered"""
+        if not self._buffer:
+            return None
+        return max(0.0, self._last_flush + self.flush_interval - self.clock())
+
+
+def coalesce(chunks, flush_interval_ms=50, flush_bytes=256, clock=time.monotonic):
+    """
+    Coalesce a generator of text chunks into fewer, larger chunks.
+    Buffered text is flushed when the next chunk arrives after the interval,
+    or at the end of the stream.
+    """
+    coalescer = ChunkCoalescer(flush_interval_ms, flush_bytes, clock)
+    for chunk in chunks:
+        text = coalescer.add(chunk)
+        if text:
+            yield text
+    text = coalescer.flush()
+    if text:
+        yield text
+
+
+async def coalesce_async(chunks, flush_interval_ms=50, flush_bytes=256):
+    """
+    Async version of coalesce. Buffered text is also flushed when the interval
+    passes while waiting for the next chunk, so a slow upstream never holds
+    text back for longer than flush_interval_ms.
+    """
+    coalescer = ChunkCoalescer(flush_interval_ms, flush_bytes)
+    iterator = chunks.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=coalescer.time_until_flush())
+            if not done:
+                text = coalescer.flush()
+                if text:
+                    yield text
+                continue
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+            text = coalescer.add(chunk)
+            if text:
+                yield text
+    finally:
+        if pending is not None:
+            pending.cancel()
+            # Wait for the cancelled read, so the source generator can be closed afterwards
+            await asyncio.wait({pending})
+    text = coalescer.flush()
+    if text:
+        yield text
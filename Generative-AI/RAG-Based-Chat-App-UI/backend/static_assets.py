@@ -0,0 +1,206 @@
+import os
+import gzip
+import json
+import hashlib
+import mimetypes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+
+# Text files get precompressed variants; images and fonts are already compressed
+COMPRESSIBLE = ('.css', '.js', '.html', '.json', '.svg', '.txt', '.map')
+
+# Variants in order of preference: (Content-Encoding, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def build(source_dir, output_dir):
+    """
+    Write a content-hashed copy of every file in source_dir to output_dir
+    (style.css -> style.<hash>.css), gzip and, when the brotli package is
+    installed, brotli variants of text files, and a manifest.json mapping
+    original names to hashed ones. Hashed files from earlier builds are kept,
+    so pages rendered before a deploy can still load their assets.
+    Returns the manifest.
+    """
+    manifest = {}
+    for root, _, files in os.walk(source_dir):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, source_dir).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            base, ext = os.path.splitext(relative)
+            hashed = f"{base}.{fingerprint(data)}{ext}"
+            target = os.path.join(output_dir, hashed)
+            manifest[relative] = hashed
+            if os.path.exists(target):
+                continue
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if ext in COMPRESSIBLE:
+                variants = {'.gz': gzip.compress(data, 9, mtime=0)}
+                if brotli is not None:
+                    variants['.br'] = brotli.compress(data, quality=11)
+                for suffix, compressed in variants.items():
+                    # Only worth serving when smaller than the original
+                    if len(compressed) < len(data):
+                        _write(target + suffix, compressed)
+            # The uncompressed file is written last; its presence marks the asset complete
+            _write(target, data)
+
+    _write(os.path.join(output_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def is_stale(source_dir, output_dir):
+    """Whether output_dir is missing or older than any file in source_dir"""
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return True
+    built_at = os.path.getmtime(manifest_path)
+    return any(
+        os.path.getmtime(os.path.join(root, name)) > built_at
+        for root, _, files in os.walk(source_dir) for name in files
+    )
+
+
+def _write(path, data):
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def accepted_encodings(header):
+    """Content codings with q > 0 in an Accept-Encoding header"""
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding)
+    if '*' in accepted:
+        accepted.update(encoding for encoding, _ in ENCODINGS)
+    return accepted
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in ('*', etag):
+            return True
+    return False
+
+
+class StaticAssets:
+    """
+    Serves the output of build() from memory. Each response is the brotli or
+    gzip variant the client accepts, with a strong ETag per variant and
+    `Cache-Control: immutable`, since a hashed file name never changes content.
+    Without a build, url() falls back to the plain static files.
+    """
+
+    CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+    def __init__(self, output_dir, url_prefix='/assets', fallback_prefix='/static'):
+        self.output_dir = output_dir
+        self.url_prefix = url_prefix
+        self.fallback_prefix = fallback_prefix
+        self.manifest = {}
+        self._files = {}
+        self.load()
+
+    def load(self):
+        """(Re)load the manifest and every built file"""
+        manifest_path = os.path.join(self.output_dir, MANIFEST)
+        if not os.path.exists(manifest_path):
+            self.manifest, self._files = {}, {}
+            return
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        files = {}
+        for root, _, names in os.walk(self.output_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.output_dir).replace(os.sep, '/')
+                if relative == MANIFEST or relative.endswith(('.gz', '.br')) or '.tmp' in name:
+                    continue
+                files[relative] = self._load_variants(path, relative)
+        self.manifest, self._files = manifest, files
+
+    def _load_variants(self, path, relative):
+        content_type = mimetypes.guess_type(relative)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        variants = {}
+        for encoding, suffix in (('identity', ''),) + ENCODINGS:
+            if os.path.exists(path + suffix):
+                with open(path + suffix, 'rb') as f:
+                    body = f.read()
+                variants[encoding] = (body, f'"{fingerprint(body)}"')
+        return content_type, variants
+
+    @property
+    def built(self):
+        return bool(self.manifest)
+
+    def url(self, filename):
+        """URL of a static file: its fingerprinted name when built, else the plain static file"""
+        hashed = self.manifest.get(filename)
+        if hashed is None:
+            return self.plain_url(filename)
+        return f"{self.url_prefix}/{hashed}"
+
+    def plain_url(self, filename):
+        return f"{self.fallback_prefix}/{filename}"
+
+    def get(self, filename, accept_encoding=None, if_none_match=None):
+        """
+        Return (status, body, headers) for a built file, or None if there is no such file.
+        Picks the preferred encoding the client accepts and answers 304 when its ETag matches.
+        """
+        asset = self._files.get(filename)
+        if asset is None:
+            return None
+        content_type, variants = asset
+
+        accepted = accepted_encodings(accept_encoding)
+        encoding = next((encoding for encoding, _ in ENCODINGS if encoding in accepted and encoding in variants),
+                        'identity')
+        body, etag = variants[encoding]
+        headers = {
+            'Cache-Control': self.CACHE_CONTROL,
+            'ETag': etag,
+        }
+        if len(variants) > 1:
+            headers['Vary'] = 'Accept-Encoding'
+        if etag_matches(if_none_match, etag):
+            return 304, b'', headers
+
+        headers['Content-Type'] = content_type
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return 200, body, headers
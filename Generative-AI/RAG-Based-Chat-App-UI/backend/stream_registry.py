@@ -0,0 +1,355 @@
+import json
+import time
+import uuid
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict, deque
+
+from .sse import EventStream
+
+
+class StreamGone(Exception):
+    """Raised when the events after a Last-Event-ID are no longer buffered"""
+
+
+class _EventFrames:
+    """Ring buffer of (event_id, frame) pairs shared by the thread and asyncio event buffers"""
+
+    def __init__(self, max_events):
+        self._frames = deque(maxlen=max_events)
+        self.last_id = 0
+        self.done = False
+
+    def has(self, after):
+        """Whether a reader can resume after event `after` without missing events"""
+        first_id = self._frames[0][0] if self._frames else self.last_id + 1
+        return first_id <= after + 1 and after <= self.last_id
+
+    def _append(self, event_id, frame):
+        self._frames.append((event_id, frame))
+        self.last_id = event_id
+
+    def _since(self, after):
+        if not self.has(after):
+            raise StreamGone(after)
+        if after == self.last_id:
+            return []
+        return list(itertools.islice(self._frames, after + 1 - self._frames[0][0], None))
+
+
+class EventBuffer(_EventFrames):
+    """
+    Bounded buffer of the SSE frames one generation has emitted, for threaded
+    (WSGI) servers. Readers wait for new frames, so several connections can
+    follow the same generation and a reconnect can start from any buffered event.
+    """
+
+    def __init__(self, max_events=1024):
+        super().__init__(max_events)
+        self._condition = threading.Condition()
+
+    def append(self, event_id, frame):
+        with self._condition:
+            self._append(event_id, frame)
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self.done = True
+            self._condition.notify_all()
+
+    def read(self, after, timeout=None):
+        """Return ([(event_id, frame), ...] after event `after`, done), waiting up to timeout seconds for new frames"""
+        with self._condition:
+            self._condition.wait_for(lambda: self.last_id > after or self.done, timeout)
+            return self._since(after), self.done
+
+
+class AsyncEventBuffer(_EventFrames):
+    """
+    Async version of EventBuffer for the ASGI server (one event loop per worker)
+    """
+
+    def __init__(self, max_events=1024):
+        super().__init__(max_events)
+        self._changed = asyncio.Event()
+
+    def append(self, event_id, frame):
+        self._append(event_id, frame)
+        self._notify()
+
+    def close(self):
+        self.done = True
+        self._notify()
+
+    def _notify(self):
+        # Wake the current readers; later readers wait on a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def read(self, after, timeout=None):
+        if self.last_id <= after and not self.done:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._since(after), self.done
+
+
+class Generation:
+    """
+    An in-flight chat response for one session. Its SSE events go to a buffer
+    that clients follow; once no client has followed it for resume_grace
+    seconds the generation counts as abandoned and is stopped. `turn` is set
+    once the session's earlier generations have finished, and `key` (the
+    client's request ID, see request_key) identifies repeated submissions.
+    """
+
+    def __init__(self, session_id, buffer, turn, key=None, resume_grace=10):
+        self.id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.key = key
+        self.cancelled = threading.Event()
+        self.turn = turn
+        self.buffer = buffer
+        self.resume_grace = resume_grace
+
+        self._events = EventStream(self.id)
+        self._readers = 0
+        self._detached_at = None
+        self._lock = threading.Lock()
+
+    def emit(self, payload):
+        """Format an SSE event and add it to the buffer"""
+        event_id = self._events.next_id
+        self.buffer.append(event_id, self._events.event(payload))
+
+    def attach(self):
+        with self._lock:
+            self._readers += 1
+            self._detached_at = None
+
+    def detach(self):
+        with self._lock:
+            self._readers -= 1
+            if not self._readers:
+                self._detached_at = time.monotonic()
+
+    def abandoned(self):
+        with self._lock:
+            return (not self._readers and self._detached_at is not None
+                    and time.monotonic() - self._detached_at >= self.resume_grace)
+
+    def stopped(self):
+        """Cancelled by the user, or abandoned by every client"""
+        return self.cancelled.is_set() or self.abandoned()
+
+
+class StreamRegistry:
+    """
+    Tracks generations per session so a session's streams can be cancelled
+    from another request (e.g. /api/chat/cancel) and resumed after a dropped
+    connection. Finished generations stay resumable for resume_ttl seconds.
+
+    A session's generations take turns in the order they were started: each
+    one's `turn` event (from event_factory, threading.Event or asyncio.Event)
+    is set when the one before it finishes, so history is read and written
+    one turn at a time while different sessions run in parallel.
+    """
+
+    def __init__(self, buffer_factory=EventBuffer, event_factory=threading.Event, max_events=1024, resume_ttl=60,
+                 resume_grace=10, max_finished=1000):
+        self.buffer_factory = buffer_factory
+        self.event_factory = event_factory
+        self.max_events = max_events
+        self.resume_ttl = resume_ttl
+        self.resume_grace = resume_grace
+        self.max_finished = max_finished
+
+        self._generations = {}
+        self._by_id = {}
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, session_id, key=None):
+        """
+        Queue a generation behind the session's unfinished ones. When one with
+        the same key is still unfinished (the same submission sent again),
+        return it instead. Returns (generation, started).
+        """
+        with self._lock:
+            duplicate = self._find(session_id, key)
+            if duplicate is not None:
+                return duplicate, False
+            generations = self._generations.setdefault(session_id, [])
+            generation = Generation(session_id, self.buffer_factory(self.max_events), self.event_factory(), key,
+                                    self.resume_grace)
+            generations.append(generation)
+            self._by_id[generation.id] = generation
+            if len(generations) == 1:
+                generation.turn.set()
+        return generation, True
+
+    def find(self, session_id, key):
+        """Return the session's unfinished generation for key, or None"""
+        with self._lock:
+            return self._find(session_id, key)
+
+    def _find(self, session_id, key):
+        if key is None:
+            return None
+        for generation in self._generations.get(session_id, []):
+            # Only while a new client can still follow it from the first event
+            if generation.key == key and not generation.stopped() and generation.buffer.has(0):
+                return generation
+        return None
+
+    def finish(self, generation):
+        generation.buffer.close()
+        with self._lock:
+            generations = self._generations.get(generation.session_id, [])
+            if generation in generations:
+                generations.remove(generation)
+            if generations:
+                # The session's next generation may run now
+                generations[0].turn.set()
+            else:
+                self._generations.pop(generation.session_id, None)
+            if self._by_id.pop(generation.id, None) is not None and self.resume_ttl:
+                self._finished[generation.id] = (generation, time.monotonic())
+            self._sweep()
+
+    def get(self, generation_id):
+        """Return an active or recently finished generation, or None"""
+        with self._lock:
+            self._sweep()
+            generation = self._by_id.get(generation_id)
+            if generation is None and generation_id in self._finished:
+                generation = self._finished[generation_id][0]
+            return generation
+
+    def cancel(self, session_id):
+        """Cancel all in-flight generations of a session; return how many were cancelled"""
+        with self._lock:
+            generations = list(self._generations.get(session_id, []))
+        for generation in generations:
+            generation.cancelled.set()
+        return len(generations)
+
+    def cancel_all(self):
+        """Cancel every in-flight generation (e.g. when a draining worker runs out of time)"""
+        with self._lock:
+            generations = [generation for generations in self._generations.values() for generation in generations]
+        for generation in generations:
+            generation.cancelled.set()
+        return len(generations)
+
+    def active_count(self):
+        with self._lock:
+            return sum(len(generations) for generations in self._generations.values())
+
+    def queued_count(self):
+        """Generations waiting for an earlier generation of their session"""
+        with self._lock:
+            return sum(len(generations) - 1 for generations in self._generations.values())
+
+    def _sweep(self):
+        """Forget finished generations past their resume window (oldest first)"""
+        now = time.monotonic()
+        while self._finished:
+            _, finished_at = next(iter(self._finished.values()))
+            if len(self._finished) <= self.max_finished and now - finished_at < self.resume_ttl:
+                break
+            self._finished.popitem(last=False)
+
+
+def request_key(value):
+    """
+    The generation key for a client-supplied request ID, or None. Clients send
+    a new ID with every submission and the same ID when they retry it, so only
+    a repeated submission joins a running answer; the same text sent twice on
+    purpose is answered twice. Requests without an ID are never joined.
+    """
+    if isinstance(value, str) and 0 < len(value.strip()) <= 128:
+        return value.strip()
+    return None
+
+
+def _gone_frame():
+    return f"data: {json.dumps({'content': 'Error: This response can no longer be resumed', 'type': 'error'})}\n\n"
+
+
+def follow(generation, after=0, keepalive=15):
+    """
+    Yield the generation's SSE frames after event `after` until it finishes,
+    sending a keep-alive comment while waiting. The reader is counted while
+    it follows, so a generation nobody reads is stopped after its grace period.
+    """
+    generation.attach()
+    try:
+        while True:
+            try:
+                frames, done = generation.buffer.read(after, keepalive)
+            except StreamGone:
+                yield _gone_frame()
+                return
+            if not frames and not done:
+                yield ": keep-alive\n\n"
+            for event_id, frame in frames:
+                yield frame
+                after = event_id
+            if done:
+                return
+    finally:
+        generation.detach()
+
+
+async def follow_async(generation, after=0, keepalive=15):
+    """
+    Async version of follow
+    """
+    generation.attach()
+    try:
+        while True:
+            try:
+                frames, done = await generation.buffer.read(after, keepalive)
+            except StreamGone:
+                yield _gone_frame()
+                return
+            if not frames and not done:
+                yield ": keep-alive\n\n"
+            for event_id, frame in frames:
+                yield frame
+                after = event_id
+            if done:
+                return
+    finally:
+        generation.detach()
+
+
+def until_cancelled(chunks, generation):
+    """
+    Yield chunks until the generation is cancelled or abandoned, then close
+    the source, which closes the upstream Azure OpenAI stream
+    """
+    try:
+        for chunk in chunks:
+            if generation.stopped():
+                break
+            yield chunk
+    finally:
+        chunks.close()
+
+
+async def until_cancelled_async(chunks, generation):
+    """
+    Async version of until_cancelled
+    """
+    try:
+        async for chunk in chunks:
+            if generation.stopped():
+                break
+            yield chunk
+    finally:
+        await chunks.aclose()
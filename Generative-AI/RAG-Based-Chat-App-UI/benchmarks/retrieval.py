@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark for local retrieval (RETRIEVAL_MODE=local)
+
+Builds the BM25 and vector indexes over a synthetic corpus of --chunks
+chunks (Zipf-distributed words, random unit vectors of --dimensions) and
+times --queries searches with each method: vector, bm25 and hybrid
+(both, fused with reciprocal rank fusion). Query text is a few words of a
+random chunk and the query vector is that chunk's vector plus noise, so no
+embedding model is needed. Prints a JSON report with build times and
+p50/p95/p99 query latency in milliseconds. Needs numpy.
+
+Usage:
+    python benchmarks/retrieval.py --chunks 50000 --dimensions 1536 --queries 500
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from backend.bm25 import BM25Index
+from backend.documents import Chunk
+from backend.embeddings import normalize
+from backend.hybrid_index import HybridIndex
+from backend.vector_index import VectorIndex
+
+
+def synthetic_corpus(rng, chunks, words_per_chunk, vocabulary, dimensions):
+    ranks = np.minimum(rng.zipf(1.2, size=(chunks, words_per_chunk)), vocabulary) - 1
+    texts = [' '.join(f"word{rank}" for rank in row) for row in ranks]
+    vectors = normalize(rng.standard_normal((chunks, dimensions), dtype=np.float32))
+    return texts, vectors
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    return {name: round(float(np.percentile(samples, q)), 3) for name, q in (('p50', 50), ('p95', 95), ('p99', 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=50000)
+    parser.add_argument('--dimensions', type=int, default=1536, help='vector size (1536 for text-embedding-3-small)')
+    parser.add_argument('--words', type=int, default=120, help='words per chunk')
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--query-words', type=int, default=6)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--candidates', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    texts, vectors = synthetic_corpus(rng, args.chunks, args.words, args.vocabulary, args.dimensions)
+    chunks = [Chunk(i, 'synthetic', 1, text) for i, text in enumerate(texts)]
+
+    started = time.perf_counter()
+    vector_index = VectorIndex(vectors, chunks)
+    vector_build = time.perf_counter() - started
+    started = time.perf_counter()
+    bm25_index = BM25Index(texts)
+    bm25_build = time.perf_counter() - started
+
+    indexes = {
+        'vector': HybridIndex(chunks, vector_index=vector_index, candidates=args.candidates),
+        'bm25': HybridIndex(chunks, bm25_index=bm25_index, candidates=args.candidates),
+        'hybrid': HybridIndex(chunks, vector_index, bm25_index, candidates=args.candidates),
+    }
+
+    queries = []
+    for target in rng.integers(0, args.chunks, size=args.queries):
+        words = texts[target].split()
+        start = int(rng.integers(0, max(1, len(words) - args.query_words)))
+        noisy = vectors[target] + rng.standard_normal(args.dimensions, dtype=np.float32) * 0.03
+        queries.append((int(target), ' '.join(words[start:start + args.query_words]), normalize(noisy[None])[0]))
+
+    report = {}
+    for method, index in indexes.items():
+        index.search(*queries[0][1:], k=args.top_k)
+        latencies = []
+        hits = 0
+        for target, query, query_vector in queries:
+            started = time.perf_counter()
+            results = index.search(query, query_vector, k=args.top_k)
+            latencies.append(time.perf_counter() - started)
+            hits += any(chunk.id == target for chunk, _ in results)
+        report[method] = {'ms': percentiles(latencies), 'recall_at_k': round(hits / len(queries), 3)}
+
+    print(json.dumps({
+        'config': vars(args),
+        'build_seconds': {'vector': round(vector_build, 3), 'bm25': round(bm25_build, 3)},
+        'bm25': bm25_index.stats(),
+        'queries': report,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark for SSE chunk coalescing in /api/chat
+
+Replays synthetic token streams (on a simulated clock, so no waiting) through
+the same framing code the server uses, and writes every frame to a local
+socket like the server would. Compares one frame per token against coalesced
+frames and reports frames, frames/sec of streaming, and CPU time.
+
+Usage:
+    python benchmarks/sse_coalescing.py --streams 200 --tokens 400 --token-rate 60
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from backend.sse import EventStream, coalesce
+
+
+class SimulatedClock:
+    """Clock advanced by the token generator instead of real time"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def token_stream(clock, tokens, token_rate):
+    for index in range(tokens):
+        clock.now += 1.0 / token_rate
+        yield f"token{index % 97} "
+
+
+def drain(sock):
+    while sock.recv(1 << 16):
+        pass
+
+
+def run(streams, tokens, token_rate, flush_interval_ms, flush_bytes):
+    sender, receiver = socket.socketpair()
+    reader = threading.Thread(target=drain, args=(receiver,), daemon=True)
+    reader.start()
+
+    frames = 0
+    stream_seconds = 0.0
+    cpu_start = time.process_time()
+    for _ in range(streams):
+        clock = SimulatedClock()
+        events = EventStream()
+        chunks = token_stream(clock, tokens, token_rate)
+        if flush_interval_ms is not None:
+            chunks = coalesce(chunks, flush_interval_ms, flush_bytes, clock=clock)
+        for chunk in chunks:
+            sender.sendall(events.event({'content': chunk, 'type': 'chunk'}).encode('utf-8'))
+            frames += 1
+        stream_seconds += clock.now
+    cpu_seconds = time.process_time() - cpu_start
+
+    sender.close()
+    reader.join()
+    receiver.close()
+    return {
+        'frames': frames,
+        'frames_per_stream': round(frames / streams, 1),
+        'frames_per_sec_per_stream': round(frames / stream_seconds, 1),
+        'cpu_seconds': round(cpu_seconds, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=200, help='number of responses to stream')
+    parser.add_argument('--tokens', type=int, default=400, help='tokens per response')
+    parser.add_argument('--token-rate', type=float, default=60.0, help='upstream tokens per second')
+    parser.add_argument('--flush-interval-ms', type=int, default=50)
+    parser.add_argument('--flush-bytes', type=int, default=256)
+    args = parser.parse_args()
+
+    per_token = run(args.streams, args.tokens, args.token_rate, None, None)
+    coalesced = run(args.streams, args.tokens, args.token_rate, args.flush_interval_ms, args.flush_bytes)
+
+    print(json.dumps({
+        'config': vars(args),
+        'per_token': per_token,
+        'coalesced': coalesced,
+        'frames_saved_percent': round(100 * (1 - coalesced['frames'] / per_token['frames']), 1),
+        'cpu_saved_percent': round(100 * (1 - coalesced['cpu_seconds'] / per_token['cpu_seconds']), 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark
+
+Measures, over several fresh processes:
+  - import time: how long `import app` takes in a new interpreter, and
+    whether the heavy openai package was imported at startup
+  - time to ready: from launching the server until /api/health answers
+
+Prints a JSON report. Placeholder Azure OpenAI settings are used when none
+are set; no request reaches Azure OpenAI. Uses only the standard library.
+
+Usage:
+    python benchmarks/startup.py --runs 5
+    python benchmarks/startup.py --module asgi_app --command "{python} -m uvicorn asgi_app:app --port {port}"
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+IMPORT_PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import {module}
+print(json.dumps({{'ms': (time.perf_counter() - started) * 1000, 'openai': 'openai' in sys.modules}}))
+"""
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault('ENDPOINT_URL', 'http://127.0.0.1:9')
+    env.setdefault('DEPLOYMENT_NAME', 'startup-benchmark')
+    env.setdefault('AZURE_OPENAI_API_KEY', 'startup-benchmark')
+    return env
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure_import(module):
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_PROBE.format(module=module)],
+        cwd=APP_DIR, env=child_env(), capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_ready(command, timeout):
+    port = free_port()
+    args = shlex.split(command.format(python=sys.executable, port=port))
+    url = f"http://127.0.0.1:{port}/api/health"
+    started = time.perf_counter()
+    process = subprocess.Popen(args, cwd=APP_DIR, env=child_env(),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with code {process.returncode}: {command}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"server not ready after {timeout} seconds")
+    finally:
+        process.terminate()
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def summarize(values):
+    return {
+        'min': round(min(values), 1),
+        'median': round(statistics.median(values), 1),
+        'max': round(max(values), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--module', default='app', help='module imported for the import time measurement')
+    parser.add_argument('--command', default='{python} run.py --fast --port {port}',
+                        help='server command for time to ready ({python} and {port} are filled in)')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for the server to be ready')
+    args = parser.parse_args()
+
+    # One untimed import first, so every timed run starts with compiled bytecode
+    measure_import(args.module)
+    imports = [measure_import(args.module) for _ in range(args.runs)]
+    ready = [measure_ready(args.command, args.timeout) for _ in range(args.runs)]
+
+    print(json.dumps({
+        'runs': args.runs,
+        'module': args.module,
+        'command': args.command,
+        'import_ms': summarize([run['ms'] for run in imports]),
+        'openai_imported_at_startup': any(run['openai'] for run in imports),
+        'time_to_ready_ms': summarize(ready),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
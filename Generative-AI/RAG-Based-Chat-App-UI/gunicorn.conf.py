@@ -0,0 +1,37 @@
+"""
+Gunicorn settings for app.py with graceful drain and zero-downtime reload
+
+    gunicorn -c gunicorn.conf.py -w 4 -b 127.0.0.1:5000 app:app
+
+kill -TERM <master pid>   stop: each worker stops accepting connections, refuses
+                          new chat streams and lets running answers finish for up
+                          to DRAIN_TIMEOUT_SECONDS
+kill -HUP <master pid>    reload: new workers (with new code) take new connections
+                          on the same socket while the old ones drain as above
+"""
+
+import os
+import sys
+
+# Streams are long-lived, so each worker serves them from a thread pool
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+
+# Workers still running this long after SIGTERM are killed; leave time for
+# answers stopped at the drain deadline to be saved
+graceful_timeout = int(float(os.getenv("DRAIN_TIMEOUT_SECONDS", "25"))) + 10
+
+
+def post_worker_init(worker):
+    # The app is loaded by now; drain before gunicorn's own SIGTERM handling
+    from app import drain
+    from backend.drain import drain_on_signal
+    drain_on_signal(drain)
+
+
+def worker_exit(server, worker):
+    # Also when a worker exits for other reasons (e.g. max_requests);
+    # nothing to flush if the app failed to load
+    app = sys.modules.get('app')
+    if app is not None:
+        app.shutdown()
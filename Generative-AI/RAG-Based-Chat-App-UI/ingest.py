@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Build or update the local retrieval index (RETRIEVAL_MODE=local)
+
+Ingests the documents in RAG_DATA_DIR (default rag-data/) into
+RETRIEVAL_INDEX_DIR (default rag-index/). Only files whose content changed
+are parsed again, and only chunks whose text is new are embedded. Running
+servers pick up the new index when RETRIEVAL_WATCH_SECONDS is set; the
+retrieval settings are read from .env like the app reads them.
+
+Usage:
+    python ingest.py              # update once and print what changed
+    python ingest.py --watch 5    # keep applying changes every 5 seconds
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+os.environ.setdefault("RETRIEVAL_MODE", "local")
+
+from backend.chat_service import ChatService
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--watch', type=float, default=0, metavar='SECONDS',
+                        help='check for changes every SECONDS until interrupted')
+    args = parser.parse_args()
+
+    chat_service = ChatService()
+    retriever = chat_service.retriever
+    if retriever is None or retriever.ingestor is None:
+        print("Set RETRIEVAL_MODE=local and RETRIEVAL_INDEX_DIR to ingest documents", file=sys.stderr)
+        return 1
+
+    print(json.dumps(retriever.ingestor.update()))
+    try:
+        while args.watch:
+            time.sleep(args.watch)
+            report = retriever.ingestor.update()
+            if report['added'] or report['changed'] or report['removed']:
+                print(json.dumps(report))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        chat_service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
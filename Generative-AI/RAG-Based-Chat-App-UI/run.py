@@ -2,30 +2,35 @@
 """
 Simple runner script for the Flask AI Chat Application
 Checks dependencies and starts the Flask server
+
+Usage:
+    python run.py            # development: debugger, auto-reload, opens the browser
+    python run.py --fast     # fast start: no reloader or browser; SIGTERM drains running answers
+    python run.py --fast --prewarm --port 8000
 """
 
 import os
 import sys
-import subprocess
+import argparse
 import webbrowser
 import time
+import signal
 import threading
 from pathlib import Path
+from importlib import metadata
+
+# Distribution names as installed by pip (checked without importing the packages)
+REQUIRED_PACKAGES = ['flask', 'openai', 'python-dotenv', 'flask-cors']
+REQUIRED_VARS = ['ENDPOINT_URL', 'DEPLOYMENT_NAME', 'AZURE_OPENAI_API_KEY']
 
 def check_dependencies():
     """Check if required dependencies are installed"""
-    required_packages = ['flask', 'openai', 'dotenv', 'flask_cors']
     missing_packages = []
     
-    for package in required_packages:
+    for package in REQUIRED_PACKAGES:
         try:
-            if package == 'dotenv':
-                import dotenv
-            elif package == 'flask_cors':
-                import flask_cors
-            else:
-                __import__(package)
-        except ImportError:
+            metadata.version(package)
+        except metadata.PackageNotFoundError:
             missing_packages.append(package)
     
     if missing_packages:
@@ -38,9 +43,9 @@ def check_dependencies():
     return True
 
 def check_env_file():
-    """Check if .env file exists with required variables"""
+    """Check that the required variables are set, in the environment or the .env file"""
     env_path = Path(".env")
-    if not env_path.exists():
+    if not env_path.exists() and not all(os.getenv(var) for var in REQUIRED_VARS):
         print("❌ .env file not found")
         print("📝 Please create a .env file with the following variables:")
         print("   ENDPOINT_URL=https://your-resource.openai.azure.com/")
@@ -48,39 +53,85 @@ def check_env_file():
         print("   AZURE_OPENAI_API_KEY=your-api-key")
         return False
     
-    # Check if required env vars are present
+    # Parse .env rather than searching its text, so commented-out or empty entries do not count
     try:
-        with open(env_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            required_vars = ['ENDPOINT_URL', 'DEPLOYMENT_NAME', 'AZURE_OPENAI_API_KEY']
-            missing_vars = []
-            
-            for var in required_vars:
-                if var not in content:
-                    missing_vars.append(var)
-            
-            if missing_vars:
-                print(f"❌ Missing environment variables: {', '.join(missing_vars)}")
-                return False
+        from dotenv import dotenv_values
+        values = dotenv_values(env_path) if env_path.exists() else {}
     except Exception as e:
         print(f"❌ Error reading .env file: {e}")
         return False
     
+    missing_vars = [var for var in REQUIRED_VARS if not (os.getenv(var) or values.get(var))]
+    if missing_vars:
+        print(f"❌ Missing environment variables: {', '.join(missing_vars)}")
+        return False
+    
     print("✅ Environment configuration found")
     return True
 
-def open_browser():
+def build_static_assets():
+    """Rebuild the fingerprinted static files when frontend/static has changed"""
+    try:
+        from backend.static_assets import build, is_stale
+        source_dir, output_dir = os.path.join('frontend', 'static'), os.path.join('frontend', 'dist')
+        if is_stale(source_dir, output_dir):
+            build(source_dir, output_dir)
+            print("✅ Static assets built")
+    except Exception as e:
+        # The app falls back to the plain static files
+        print(f"⚠️  Could not build static assets: {e}")
+
+def open_browser(url):
     """Open browser after a short delay"""
     time.sleep(2)  # Wait for server to start
     try:
-        webbrowser.open("http://127.0.0.1:5000")
+        webbrowser.open(url)
         print("🌐 Opening browser...")
     except Exception as e:
         print(f"⚠️  Could not open browser automatically: {e}")
-        print("🌐 Please open http://127.0.0.1:5000 in your browser manually")
+        print(f"🌐 Please open {url} in your browser manually")
+
+def serve(host, port):
+    """
+    Serve without the debugger or reloader. On SIGTERM the app drains (new
+    chat streams get 503 while running answers finish) before the server stops.
+    """
+    from werkzeug.serving import make_server
+    import app as chat_app
+    
+    server = make_server(host, port, chat_app.app, threaded=True)
+    
+    def stop_when_drained():
+        chat_app.drain.wait()
+        server.shutdown()
+    
+    def handle_sigterm(signum, frame):
+        if chat_app.drain.begin():
+            print("\n🛑 Draining: waiting for running answers to finish...")
+            threading.Thread(target=stop_when_drained, daemon=True).start()
+    
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    try:
+        server.serve_forever()
+    finally:
+        chat_app.shutdown()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the Flask AI Chat Application")
+    parser.add_argument('--fast', action='store_true',
+                        help="fast start: no debugger, auto-reloader (which imports the app twice) or browser")
+    parser.add_argument('--prewarm', action='store_true',
+                        help="create the Azure OpenAI client and open a connection in the background at startup")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    return parser.parse_args()
 
 def main():
     """Main function to run the application"""
+    started = time.perf_counter()
+    args = parse_args()
+    url = f"http://{args.host}:{args.port}"
+    
     print("🤖 Flask AI Chat Application")
     print("=" * 40)
     print()
@@ -93,21 +144,31 @@ def main():
     if not check_env_file():
         sys.exit(1)
     
+    build_static_assets()
+    
+    if args.prewarm:
+        os.environ["PREWARM"] = "true"
+    
     print()
     print("🚀 Starting Flask application...")
-    print("📍 Server will be available at: http://127.0.0.1:5000")
+    print(f"📍 Server will be available at: {url}")
     print("🔄 Press Ctrl+C to stop the server")
     print()
     
     # Open browser in background
-    browser_thread = threading.Thread(target=open_browser)
-    browser_thread.daemon = True
-    browser_thread.start()
+    if not args.fast:
+        browser_thread = threading.Thread(target=open_browser, args=(url,))
+        browser_thread.daemon = True
+        browser_thread.start()
     
     # Start Flask app
     try:
         from app import app
-        app.run(host='127.0.0.1', port=5000, debug=True)
+        if args.fast:
+            print(f"⏱️  App loaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+            serve(args.host, args.port)
+        else:
+            app.run(host=args.host, port=args.port, debug=True)
     except KeyboardInterrupt:
         print("\n\n🛑 Shutting down server...")
     except Exception as e: